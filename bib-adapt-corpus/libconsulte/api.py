@@ -11,13 +11,37 @@ __status__    = "Dev"
 
 from json            import loads
 from urllib.parse    import quote
-from urllib.request  import urlopen, HTTPBasicAuthHandler, build_opener, install_opener
-from urllib.error    import URLError
+from urllib.parse    import urlsplit
+from urllib.error    import URLError, HTTPError
+from http.client     import IncompleteRead, HTTPException
+from hashlib         import sha1
+from threading       import Lock
+from time            import sleep
 from getpass   import getpass
-from os import path
+from os import path, rename, remove
 from sys import stderr
 from re import sub
 from json import dumps  # pretty printing si debug ou main
+from collections     import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# débit max vers l'API (partagé entre processus, cf. set_rate_limit)
+try:
+	from libconsulte.ratelimit import RateLimiter, default_state_path, read_limited, READ_CHUNK
+except ImportError:
+	from ratelimit import RateLimiter, default_state_path, read_limited, READ_CHUNK
+
+# connexions keep-alive réutilisées par toutes les requêtes du module
+try:
+	from libconsulte.session import ApiSession
+except ImportError:
+	from session import ApiSession
+
+# cache disque optionnel des réponses json (cf. set_cache)
+try:
+	from libconsulte.respcache import ResponseCache
+except ImportError:
+	from respcache import ResponseCache
 
 # globals
 DEFAULT_API_CONF = {
@@ -25,6 +49,27 @@ DEFAULT_API_CONF = {
 	'route' : 'document'
 }
 
+# None: pas de limite (cf. set_rate_limit)
+API_LIMITER = None
+
+# session partagée (threads compris), cf. set_session
+API_SESSION = ApiSession()
+
+# None: pas de cache (cf. set_cache)
+API_CACHE = None
+DEFAULT_CACHE_PATH = path.join(path.dirname(path.realpath(__file__)),
+                               'pool_cache', 'api_responses.sqlite')
+
+# fichiers déjà téléchargés dans chaque dossier cible (nom, taille, sha1)
+#  (cf. _bget_to_file et write_fulltexts: pas de nouveau téléchargement
+#   d'un fichier complet)
+FETCH_LOG_NAME = '.fetched.tsv'
+FETCH_LOGS = {}
+FETCH_LOCK = Lock()
+
+# tentatives d'un même téléchargement (reprises à l'octet près)
+DOWNLOAD_TRIES = 3
+
 class AuthWarning(Exception):
 	def __init__(self, msg):
 		self.msg = msg
@@ -41,8 +86,19 @@ def _get(my_url):
 	
 	# print("> api._get:%s" % my_url, file=stderr)
 	
+	# réponse déjà connue ?
+	if API_CACHE is not None:
+		response = API_CACHE.get(my_url)
+		if response is not None:
+			return loads(response.decode('UTF-8'))
+		elif API_CACHE.offline:
+			print("api: absent du cache (mode hors ligne) '%s'" % my_url, file=stderr)
+			raise URLError("offline mode: '%s' not in cache" % my_url)
+	
+	if API_LIMITER is not None:
+		API_LIMITER.acquire()
 	try:
-		remote_file = urlopen(my_url)
+		remote_file = API_SESSION.open(my_url)
 		
 	except URLError as url_e:
 		# signale 401 Unauthorized ou 404 etc
@@ -52,71 +108,322 @@ def _get(my_url):
 		# print ("ERR.info(): \n %s" % url_e.info(), file=stderr)
 		raise
 	try:
-		response = remote_file.read()
-	except httplib.IncompleteRead as ir_e:
+		response = read_limited(remote_file, API_LIMITER)
+	except IncompleteRead as ir_e:
 		response = ir_e.partial
 		print("WARN: IncompleteRead '%s' but 'partial' content has page" 
 				% my_url, file=stderr)
 	remote_file.close()
 	result_str = response.decode('UTF-8')
 	json_values = loads(result_str)
+	if API_CACHE is not None:
+		API_CACHE.put(my_url, response)
 	return json_values
 
 
-def _bget(my_url, user=None, passw=None):
+def _bget_to_file(my_url, tgt_path, user=None, passw=None):
 	"""
 	Get remote auth-protected url *that contains a ~file~* 
-	and pass its binary data straight from remote response
-	(for instance when retrieving fulltext from ISTEX API)
-	"""
-	
-	# /!\ attention le password est en clair ici /!\
-	# print ("REGARD:", user, passw,     file=stderr)
+	and stream it by chunks to tgt_path
 	
-	no_contents = False
+	Le fichier est d'abord écrit en tgt_path.part puis renommé (un fichier
+	final est toujours complet). Si une tentative précédente a laissé un
+	.part, la suite est demandée avec un en-tête Range.
 	
-	auth_handler = HTTPBasicAuthHandler()
-	auth_handler.add_password(
-			realm  = 'Authentification sur api.istex.fr',
-			uri    = 'https://api.istex.fr',
-			user   = user,
-			passwd = passw)
-	install_opener(build_opener(auth_handler))
+	=> (size, sha1) of the file, or None if no contents (404 etc., or
+	   still failing after DOWNLOAD_TRIES: the .part is kept for later)
+	"""
+	if user is not None:
+		API_SESSION.set_auth(urlsplit(my_url).netloc, user, passw)
+	
+	part_path = tgt_path + '.part'
+	last_err = None
+	for i_try in range(DOWNLOAD_TRIES):
+		if last_err is not None:
+			sleep(i_try)
+		offset = path.getsize(part_path) if path.exists(part_path) else 0
+		headers = {'Range': 'bytes=%i-' % offset} if offset else None
+		
+		if API_LIMITER is not None:
+			API_LIMITER.acquire()
+		
+		# contact
+		try:
+			remote_file = API_SESSION.open(my_url, headers)
+		except HTTPError as url_e:
+			if url_e.getcode() == 401:
+				raise AuthWarning("need_auth")
+			elif url_e.getcode() == 416 and offset:
+				# .part inutilisable: on repart de zéro
+				remove(part_path)
+				continue
+			else:
+				# 404 à gérer *sans quitter* pour les fulltexts en nombre...
+				print("api: HTTP ERR no %i (%s) sur '%s'" % 
+					(url_e.getcode(),url_e.msg, my_url), file=stderr)
+				return None
+		except URLError as url_e:
+			last_err = url_e
+			continue
+		
+		# lecture par morceaux, à la suite du .part si le serveur l'accepte
+		with remote_file:
+			hasher = sha1()
+			if (offset and remote_file.status == 206
+			    and not (remote_file.getheader('Content-Range') or '').startswith('bytes %i-' % offset)):
+				# pas la suite attendue: on repart de zéro
+				remove(part_path)
+				last_err = "bad Content-Range"
+				continue
+			if offset and remote_file.status == 206:
+				part = open(part_path, 'rb')
+				for chunk in iter(lambda: part.read(READ_CHUNK), b""):
+					hasher.update(chunk)
+				part.close()
+				out = open(part_path, 'ab')
+			else:
+				offset = 0
+				out = open(part_path, 'wb')
+			length = remote_file.getheader('Content-Length')
+			expected = offset + int(length) if length is not None else None
+			try:
+				chunk = remote_file.read(READ_CHUNK)
+				while chunk:
+					if API_LIMITER is not None and API_LIMITER.bytes_rate:
+						API_LIMITER.acquire(0, len(chunk))
+					out.write(chunk)
+					hasher.update(chunk)
+					chunk = remote_file.read(READ_CHUNK)
+			except (HTTPException, OSError) as err:
+				last_err = err
+				continue
+			finally:
+				out.close()
+		
+		size = path.getsize(part_path)
+		if expected is not None and size != expected:
+			last_err = "%i bytes of %i" % (size, expected)
+			continue
+		rename(part_path, tgt_path)
+		return (size, hasher.hexdigest())
+	
+	print("api: ERR téléchargement incomplet (%s) sur '%s'" % (last_err, my_url), file=stderr)
+	return None
+
+
+def _remote_size(my_url, user=None, passw=None):
+	"""
+	Content-Length of url according to a HEAD request (None if unknown)
+	"""
+	if user is not None:
+		API_SESSION.set_auth(urlsplit(my_url).netloc, user, passw)
+	if API_LIMITER is not None:
+		API_LIMITER.acquire()
+	try:
+		with API_SESSION.open(my_url, method='HEAD') as answer:
+			length = answer.getheader('Content-Length')
+	except (HTTPError, URLError):
+		return None
+	return int(length) if length is not None else None
+
+
+def _file_sha1(a_path):
+	hasher = sha1()
+	a_file = open(a_path, 'rb')
+	for chunk in iter(lambda: a_file.read(READ_CHUNK), b""):
+		hasher.update(chunk)
+	a_file.close()
+	return hasher.hexdigest()
+
+
+def _fetch_log(tgt_dir):
+	"""
+	{file name: (size, sha1)} of the files already downloaded in tgt_dir
+	"""
+	with FETCH_LOCK:
+		if tgt_dir not in FETCH_LOGS:
+			entries = {}
+			log_path = path.join(tgt_dir, FETCH_LOG_NAME)
+			if path.exists(log_path):
+				log_file = open(log_path, 'r')
+				for line in log_file:
+					fields = line.rstrip('\n').split('\t')
+					if len(fields) == 3:
+						entries[fields[0]] = (int(fields[1]), fields[2])
+				log_file.close()
+			FETCH_LOGS[tgt_dir] = entries
+		return FETCH_LOGS[tgt_dir]
+
+
+def _log_fetched(tgt_path, size, sha1_hex):
+	tgt_dir = path.dirname(tgt_path)
+	entries = _fetch_log(tgt_dir)
+	with FETCH_LOCK:
+		entries[path.basename(tgt_path)] = (size, sha1_hex)
+		log_file = open(path.join(tgt_dir, FETCH_LOG_NAME), 'a')
+		log_file.write("%s\t%i\t%s\n" % (path.basename(tgt_path), size, sha1_hex))
+		log_file.close()
+
+
+def _already_fetched(tgt_path, check='size'):
+	"""
+	Is tgt_path already there and complete ?
 	
-	print("GET bin (user:%s)" % user, file=stderr)
+	   check -- 'size': same size as when downloaded
+	            'sha1': same size and same sha1
+	            None: never (always download again)
 	
-	# contact
-	try:
-		remote_file = urlopen(my_url)
-		
-	except URLError as url_e:
-		if url_e.getcode() == 401:
-			raise AuthWarning("need_auth")
-		else:
-			# 404 à gérer *sans quitter* pour les fulltexts en nombre...
-			no_contents = True
-			print("api: HTTP ERR no %i (%s) sur '%s'" % 
-				(url_e.getcode(),url_e.msg, my_url), file=stderr)
-				# pour + de détail
-				# print ("ERR.info(): \n %s" % url_e.info(),file=stderr)
-	
-	if no_contents:
+	=> True, False, or None if the file is there but not in the log
+	   (ex: téléchargé avant l'existence du journal, ou écrit par un
+	    autre outil): rien ne dit qu'il est complet, cf. write_fulltexts
+	"""
+	if check is None or not path.isfile(tgt_path):
+		return False
+	size = path.getsize(tgt_path)
+	entry = _fetch_log(path.dirname(tgt_path)).get(path.basename(tgt_path))
+	if entry is None:
 		return None
-	else:
-		# lecture
-		contents = remote_file.read()
-		remote_file.close()
-		return contents
+	if size != entry[0]:
+		return False
+	if check == 'sha1':
+		return _file_sha1(tgt_path) == entry[1]
+	return True
 
 
 # public functions
 # ----------------
-# £TODO1: séparer le mode i_from dans une fonction à part random_search_one
+def set_session(max_idle=8, timeout=60):
+	"""
+	Replaces the pooled HTTP session used by all the API functions
+	
+	   max_idle    -- keep-alive connections kept open per host
+	   timeout     -- socket timeout in seconds
+	"""
+	global API_SESSION
+	API_SESSION.close()
+	API_SESSION = ApiSession(max_idle=max_idle, timeout=timeout)
+	return API_SESSION
+
+
+def set_rate_limit(max_rps=0, max_bps=0, state_file=None, api_conf=DEFAULT_API_CONF):
+	"""
+	Limits all the following API requests of this module
+	
+	   max_rps     -- max requests per second (0: no limit)
+	   max_bps     -- max bytes per second (0: no limit)
+	   state_file  -- shared state of the limit: all processes using the
+	                  same file share the same budget (bib-get included)
+	                  default: one file per api host in the temp dir
+	
+	set_rate_limit() without arguments removes the limit
+	"""
+	global API_LIMITER
+	if not max_rps and not max_bps:
+		API_LIMITER = None
+	else:
+		API_LIMITER = RateLimiter(state_file or default_state_path(api_conf['host']),
+		                          rate=max_rps, bytes_rate=max_bps)
+	return API_LIMITER
+
+
+def set_cache(db_path=DEFAULT_CACHE_PATH, ttl=None, max_mb=None, offline=False):
+	"""
+	Keeps the json answers (search, count, terms_facet) in a local SQLite
+	base, for all the following API requests of this module
+	
+	   db_path     -- the base (default: pool_cache/api_responses.sqlite)
+	   ttl         -- seconds before a cached answer is asked again
+	                  (None: kept until evicted)
+	   max_mb      -- size bound of the base in MB, least recently
+	                  used answers evicted first (None: no bound)
+	   offline     -- read-only, no API: every request must be in cache
+	
+	set_cache(None) removes the cache (cf. cache_stats for the counters)
+	"""
+	global API_CACHE
+	if API_CACHE is not None:
+		API_CACHE.close()
+	if db_path is None:
+		API_CACHE = None
+	else:
+		API_CACHE = ResponseCache(db_path, ttl=ttl, offline=offline,
+		                          max_bytes=int(max_mb * 1000000) if max_mb else None)
+	return API_CACHE
+
+
+def cache_stats():
+	"""
+	Hits, misses etc. of the response cache (None if no cache)
+	"""
+	if API_CACHE is None:
+		return None
+	return API_CACHE.stats()
+
+
 # £TODO2: limit par défaut à 1 pour éviter de tout télécharger si test rapide ??
-# £TODO3: stockage disque sur fichier tempo si liste grande et champx nbx
+def iter_search(q, api_conf=DEFAULT_API_CONF, limit=None, n_docs=None, outfields=('title','host.issn','fulltext'), i_from=0, page_size=5000):
+	"""
+	Generator over the hits of a lucene query, page by page: the next
+	page is already requested while the hits of the current one are
+	consumed (at most 2 pages in memory, whatever the number of hits)
+	
+	args: cf. search() and
+	   i_from      -- offset of the first hit (ex: to resume an export
+	                  interrupted after i_from hits)
+	   page_size   -- hits per request (max 5000 on the API)
+	"""
+	# préparation requête
+	url_encoded_lucene_query = my_url_quoting(q)
+	
+	# borne de fin: limit si donnée, sinon décompte à part
+	if limit is not None:
+		stop = i_from + limit
+	else:
+		if n_docs is None:
+			n_docs = count(url_encoded_lucene_query, already_escaped=True, api_conf=api_conf)
+		stop = n_docs
+	# print('%s documents trouvés' % n_docs)
+	
+	# construction de l'URL
+	base_url = 'https:' + '//' + api_conf['host']  + '/' + api_conf['route'] + '/' + '?' + 'q=' + url_encoded_lucene_query + '&output=' + ",".join(outfields)
+	# debug
+	# print("api.iter_search().base_url:", base_url)
+	
+	def page_url(k):
+		my_url = base_url + '&size=%i' % min(page_size, stop - k)
+		if k != 0:
+			my_url += "&from=%i" % k
+		return my_url
+	
+	if stop - i_from > page_size:
+		print("Collecting result hits... ", file=stderr)
+	
+	k = i_from
+	if k >= stop:
+		return
+	# 1 thread pour la page suivante pendant qu'on rend la page courante
+	with ThreadPoolExecutor(max_workers=1) as executor:
+		next_page = executor.submit(_get, page_url(k))
+		while next_page is not None:
+			hits = next_page.result()['hits']
+			asked = min(page_size, stop - k)
+			k += asked
+			if k < stop and len(hits) == asked:
+				if stop - i_from > page_size:
+					print("%i..." % k, file=stderr)
+				next_page = executor.submit(_get, page_url(k))
+			else:
+				# fin: borne atteinte ou moins de hits que demandé
+				next_page = None
+			for hit in hits:
+				yield hit
+
+
 def search(q, api_conf=DEFAULT_API_CONF, limit=None, n_docs=None, outfields=('title','host.issn','fulltext'), i_from=0):
 	"""
 	Query the API and get a (perhaps long) "hits" array of json metadata.
+	
+	(liste complète en mémoire: pour de gros exports, cf. iter_search)
 
 	args:
 	-----
@@ -133,11 +440,10 @@ def search(q, api_conf=DEFAULT_API_CONF, limit=None, n_docs=None, outfields=('ti
 	   n_docs      -- si on l'a déjà, la taille du pool dans l'api 
 	                  (résultat de count pour la même requête)
 	                  sinon, il sera recalculé pour savoir paginer
+	                  (sauf si limit est donné)
 	
-	   i_from      -- mode permettant de fixer &from à un entier [0;n_docs]
-	               TODO actuellement entraîne forcément limit = 1 afin de
-	                    ne pas interférer avec la logique de pagination
-	                    des requêtes plus normales à partir de 0
+	   i_from      -- rang du premier hit renvoyé (&from), par exemple
+	                  avec limit = 1 pour un document au hasard
 
 	Output format is a parsed json with a total value and a hit list:
 	{ 'hits': [ { 'id': '21B88F4EFBA46DC85E863709CA9824DEED7B7BFC',
@@ -147,64 +453,7 @@ def search(q, api_conf=DEFAULT_API_CONF, limit=None, n_docs=None, outfields=('ti
 				  'title': 'Holographic insights and puzzles'}],
 	  'total': 2}
 	"""
-	
-	# préparation requête
-	url_encoded_lucene_query = my_url_quoting(q)
-	
-	# décompte à part
-	if n_docs is None:
-		n_docs = count(url_encoded_lucene_query, already_escaped=True)
-	# print('%s documents trouvés' % n_docs)
-	
-	# construction de l'URL
-	base_url = 'https:' + '//' + api_conf['host']  + '/' + api_conf['route'] + '/' + '?' + 'q=' + url_encoded_lucene_query + '&output=' + ",".join(outfields)
-	# debug
-	# print("api.search().base_url:", base_url)
-	
-	
-	# éventuel point de départ choisi (à utiliser notamment avec limit = 1 pour aléa)
-	if i_from != 0:
-		if limit != 1:
-			raise NotImplementedError("l'utilisation de from dans les requêtes API n'est ici implémentée que pour des tailles de 1 (use case: choix d'un doc aléatoire)")
-		else:
-			base_url += '&from=' + str(i_from)
-	
-	# limitation éventuelle fournie par le switch --maxi
-	if limit is not None:
-		n_docs = limit
-	
-	# la liste des résultats à renvoyer
-	all_hits = []
-	
-	# ensuite 2 cas de figure : 1 requête ou plusieurs
-	if n_docs <= 5000:
-		# requête simple
-		my_url = base_url + '&size=%i' % n_docs
-		
-		# debug
-		# print("api.search()._get_url:", my_url0ll)
-		
-		try:
-			json_values = _get(my_url)
-		except:
-			raise
-		all_hits = json_values['hits']
-	
-	else:
-		# requêtes paginées pour les tailles > 5000
-		print("Collecting result hits... ", file=stderr)
-		for k in range(0, n_docs, 5000):
-			print("%i..." % k, file=stderr)
-			my_url = base_url + '&size=5000' + "&from=%i" % k
-			json_values = _get(my_url)
-			all_hits += json_values['hits']
-		
-		# TODO stocker si > RAM/5
-		
-		# si on avait une limite par ex 7500 et qu'on est allés jusqu'à 10000
-		all_hits = all_hits[0:n_docs]
-	
-	return(all_hits)
+	return list(iter_search(q, api_conf, limit, n_docs, outfields, i_from))
 
 
 def count(q, api_conf=DEFAULT_API_CONF, already_escaped=False):
@@ -229,10 +478,93 @@ def count(q, api_conf=DEFAULT_API_CONF, already_escaped=False):
 	return int(json_values['total'])
 
 
-def write_fulltexts(DID, base_name=None, api_conf=DEFAULT_API_CONF, tgt_dir='.', login=None, passw=None, api_types=['fulltext/pdf', 'metadata/xml']):
+def imap_queries(fun, queries, n_workers=8, **kwargs):
+	"""
+	Runs fun(query, **kwargs) for each query on a bounded thread pool
+	(ex: fun = count or search) and yields (query, result, error) in
+	the order of the queries, as soon as each one is ready
+	
+	error is None if ok, else the exception of this query (result None)
+	
+	(au plus 2 x n_workers requêtes soumises d'avance: une longue
+	 liste de requêtes n'est pas entièrement en mémoire)
+	"""
+	def one_query(query):
+		try:
+			return (fun(query, **kwargs), None)
+		except Exception as err:
+			return (None, err)
+	
+	queries = iter(queries)
+	pending = deque()
+	with ThreadPoolExecutor(max_workers=n_workers) as executor:
+		for query in queries:
+			pending.append((query, executor.submit(one_query, query)))
+			if len(pending) >= 2 * n_workers:
+				break
+		while pending:
+			(query, future) = pending.popleft()
+			(result, err) = future.result()
+			# une de finie => une de plus
+			for next_query in queries:
+				pending.append((next_query, executor.submit(one_query, next_query)))
+				break
+			yield (query, result, err)
+
+
+def count_many(queries, api_conf=DEFAULT_API_CONF, n_workers=8, raise_errors=False):
+	"""
+	Totals of several lucene queries, n_workers requests at a time
+	
+	=> {query: total} in the order of the queries (each query once)
+	
+	A failed query gets its exception as value (raise_errors: raised
+	once all the others are done)
+	"""
+	results = {}
+	first_err = None
+	for (query, total, err) in imap_queries(count, dict.fromkeys(queries),
+	                                        n_workers, api_conf=api_conf):
+		if err is not None:
+			first_err = first_err or err
+			results[query] = err
+		else:
+			results[query] = total
+	if raise_errors and first_err is not None:
+		raise first_err
+	return results
+
+
+def search_many(queries, api_conf=DEFAULT_API_CONF, limit=None, outfields=('title','host.issn','fulltext'), n_workers=8, raise_errors=False):
+	"""
+	search() for several lucene queries, n_workers requests at a time
+	
+	=> list of hit lists, one per query in the same order
+	
+	A failed query gets its exception instead of its hits (raise_errors:
+	raised once all the others are done)
+	"""
+	results = []
+	first_err = None
+	for (query, hits, err) in imap_queries(search, queries, n_workers,
+	                                       api_conf=api_conf, limit=limit,
+	                                       outfields=outfields):
+		if err is not None:
+			first_err = first_err or err
+			results.append(err)
+		else:
+			results.append(hits)
+	if raise_errors and first_err is not None:
+		raise first_err
+	return results
+
+
+def write_fulltexts(DID, base_name=None, api_conf=DEFAULT_API_CONF, tgt_dir='.', login=None, passw=None, api_types=['fulltext/pdf', 'metadata/xml'], check='size'):
 	"""
 	Get XML metas, TEI, PDF, ZIP fulltexts etc. for a given ISTEX-API document.
 	
+	Files already there and complete are not downloaded again
+	(check: 'size', 'sha1' or None to always download, cf. _already_fetched)
 	"""
 	# vérification
 	for at in api_types:
@@ -253,47 +585,67 @@ def write_fulltexts(DID, base_name=None, api_conf=DEFAULT_API_CONF, tgt_dir='.',
 	da_url = 'https://'+api_conf['host']+'/'+api_conf['route']+'/'+DID
 	
 	for at in api_types:
-			response = _bget(da_url+'/'+at, user=login, passw=passw)
+			# ext par défaut: partie droite de la route de l'api
+			ext = at.split('/')[1]
+			
+			tgt_path = path.join(tgt_dir, base_name+'.'+ext)
+			
+			fetched = _already_fetched(tgt_path, check)
+			if fetched is None:
+				# présent mais hors journal: complet s'il a la taille
+				# annoncée par l'API (alors journalisé), sinon retéléchargé
+				size = path.getsize(tgt_path)
+				if size == _remote_size(da_url+'/'+at, user=login, passw=passw):
+					_log_fetched(tgt_path, size, _file_sha1(tgt_path))
+					continue
+			elif fetched:
+				continue
+			
+			# flux direct vers le fichier (pas de fichier entier en mémoire)
+			fetched = _bget_to_file(da_url+'/'+at, tgt_path, user=login, passw=passw)
 			
-			# _bget renvoie None pour les (rares) 404 
+			# _bget_to_file renvoie None pour les (rares) 404 
 			#      (ex: demande tei a ecco)
-			if response is not None:
-				
-				# ext par défaut: partie droite de la route de l'api
-				ext = at.split('/')[1]
-				
-				tgt_path = path.join(tgt_dir, base_name+'.'+ext)
-				
-				fh = open(tgt_path, 'wb')
-				fh.write(response)
-				fh.close()
+			if fetched is not None:
+				_log_fetched(tgt_path, fetched[0], fetched[1])
 
 
-def write_fulltexts_loop_interact(list_of_ids, list_of_basenames=None, api_conf=DEFAULT_API_CONF, tgt_dir='.', api_types=['fulltext/pdf', 'metadata/xml']):
+def write_fulltexts_loop_interact(list_of_ids, list_of_basenames=None, api_conf=DEFAULT_API_CONF, tgt_dir='.', api_types=['fulltext/pdf', 'metadata/xml'], n_workers=4, check='size'):
 	"""
 	Calls the preceding function in a loop for an entire list,
+	with n_workers downloads at a time (after the first document)
 	
 	With optional interactive authentification step:
-	  - IF (login and passw are None AND _bget raises AuthWarning)
+	  - IF (login and passw are None AND _bget_to_file raises AuthWarning)
 	    THEN ask user
 	
 	"""
 	# test sur le premier fichier: authentification est-elle nécessaire ?
 	need_auth = False
+	my_login = None
+	my_passw = None
 	
-	first_doc_id = list_of_ids[0]
-	if list_of_basenames:
-		first_base_name = list_of_basenames[0]
-	else:
-		first_base_name = None
+	def basename_of(i):
+		if list_of_basenames:
+			return list_of_basenames[i]
+		else:
+			return None
+	
+	def fetch_doc(i):
+		write_fulltexts(
+			list_of_ids[i],
+			base_name = basename_of(i),
+			api_conf = api_conf,
+			tgt_dir = tgt_dir,
+			login = my_login,
+			passw = my_passw,
+			api_types = api_types,
+			check = check
+		)
 	
 	try:
 		# test with no auth credentials
-		write_fulltexts(
-			first_doc_id, first_base_name, 
-			tgt_dir=tgt_dir,
-			api_types=api_types
-			)
+		fetch_doc(0)
 		print("API:retrieving doc no 1 from %s" % api_types)
 	except AuthWarning as e:
 		print("NB: l'API veut une authentification pour les fulltexts SVP...",
@@ -301,46 +653,29 @@ def write_fulltexts_loop_interact(list_of_ids, list_of_basenames=None, api_conf=
 		need_auth = True
 	
 	# récupération avec ou sans authentification
+	#  (on ne refait pas le 1er s'il a marché)
 	if need_auth:
 		my_login = input(' => Nom d\'utilisateur "ia": ')
 		my_passw = getpass(prompt=' => Mot de passe: ')
-		for i, did in enumerate(list_of_ids):
-			if list_of_basenames:
-				my_bname = list_of_basenames[i]
-			else:
-				my_bname = None
-			
-			print("API:retrieving doc no %s from %s" % (str(i+1),api_types))
-			try:
-				write_fulltexts(
-					did,
-					base_name = my_bname,
-					tgt_dir=tgt_dir,
-					login=my_login,
-					passw=my_passw,
-					api_types= api_types
-				)
-			except AuthWarning as e:
-				print("authentification refusée :(")
-				my_login = input(' => Nom d\'utilisateur "ia": ')
-				my_passw = getpass(prompt=' => Mot de passe: ')
-	
+		todo = range(len(list_of_ids))
 	else:
-		for i, did in enumerate(list_of_ids):
-			# on ne refait pas le 1er car il a marché
-			if i == 0:
-				continue
-			if list_of_basenames:
-				my_bname = list_of_basenames[i]
-			else:
-				my_bname = None
+		todo = range(1, len(list_of_ids))
+	
+	# téléchargements parallèles, résultats dans l'ordre de la liste
+	# (les documents refusés sont redemandés après une nouvelle saisie)
+	while len(todo):
+		refused = []
+		for (i, ok, err) in imap_queries(fetch_doc, todo, n_workers):
 			print("API:retrieving doc no %s from %s" % (str(i+1),api_types))
-			write_fulltexts(
-				did,
-				base_name=my_bname,
-				tgt_dir=tgt_dir,
-				api_types=api_types
-			)
+			if isinstance(err, AuthWarning):
+				refused.append(i)
+			elif err is not None:
+				raise err
+		if refused:
+			print("authentification refusée :(")
+			my_login = input(' => Nom d\'utilisateur "ia": ')
+			my_passw = getpass(prompt=' => Mot de passe: ')
+		todo = refused
 
 
 def terms_facet(facet_name, q="*", api_conf=DEFAULT_API_CONF):
@@ -215,14 +215,15 @@ def pooling(crit_fields, verbose=False):
 	N_reponses = 0
 	
 	# do the counting for each combo
-	for i, combi in enumerate(sorted(combinations)):
+	#  (requêtes count lancées en parallèle, réponses dans l'ordre)
+	queries = [" AND ".join(combi) for combi in sorted(combinations)]
+	for i, (query, freq, err) in enumerate(api.imap_queries(api.count, queries)):
 		if i % 100 == 0:
 			print("pool %i/%i" % (i,n_combos), file=stderr)
 		
-		query = " AND ".join(combi)
-		
 		# counting requests ++++
-		freq = api.count(query)
+		if err is not None:
+			raise err
 		
 		# print(freq)
 		
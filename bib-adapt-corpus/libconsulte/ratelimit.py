@@ -0,0 +1,161 @@
+#! /usr/bin/python3
+"""
+Token-bucket rate limiter for ISTEX API traffic, shared across processes
+
+Deux seaux de jetons: requêtes/s et octets/s. L'état des seaux est dans
+un petit fichier (3 doubles: jetons requêtes, jetons octets, date de mise
+à jour) lu et réécrit sous verrou fcntl: tous les processus qui utilisent
+le même fichier se partagent le même budget, qu'ils soient des workers
+du Pool de bib-get ou des scripts libconsulte lancés à côté.
+
+Les octets ne sont connus qu'à la lecture: ils sont payés morceau par
+morceau (cf. read_limited), le seau d'octets pouvant passer en négatif
+(dette). La requête suivante attend que la dette soit remboursée.
+
+(copie identique dans bib-get/libbibget/ratelimit.py et dans
+ bib-adapt-corpus/libconsulte/ratelimit.py, bib-get étant aussi publié
+ seul: les 2 copies doivent rester synchronisées pour que bib-get et
+ libconsulte partagent les mêmes fichiers d'état, par défaut un par
+ hôte de l'api dans le dossier temporaire, cf. bib-get/test/test_ratelimit)
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+import os
+from os              import path
+from re              import sub
+from struct          import Struct
+from tempfile        import gettempdir
+from threading       import Lock
+from time            import time, sleep
+from fcntl           import flock, LOCK_EX, LOCK_UN
+
+# jetons requêtes, jetons octets, date de mise à jour
+STATE = Struct('<3d')
+
+# taille des morceaux lus (et payés) par read_limited
+READ_CHUNK = 65536
+
+
+def default_state_path(host):
+	"""
+	Shared state file of an api host (ex: /tmp/istex-ratelimit-api.istex.fr)
+	"""
+	return path.join(gettempdir(), "istex-ratelimit-%s" % sub(r"[^\w.-]", "_", host))
+
+
+class RateLimiter(object):
+	"""
+	Requests/s and bytes/s budget shared by all users of a state file
+
+	   state_path  -- the shared state file (created if needed)
+	   rate        -- max requests per second (0 or None: no limit)
+	   bytes_rate  -- max bytes per second (0 or None: no limit)
+	   burst       -- requests allowed at once after a pause
+	                  (default: 1 second of rate, at least 1)
+	   bytes_burst -- same for bytes (default: 1 second of bytes_rate)
+	"""
+	def __init__(self, state_path, rate=None, bytes_rate=None,
+	             burst=None, bytes_burst=None):
+		self.state_path = state_path
+		self.rate = float(rate or 0)
+		self.bytes_rate = float(bytes_rate or 0)
+		self.burst = float(burst or max(1.0, self.rate))
+		self.bytes_burst = float(bytes_burst or self.bytes_rate)
+		if self.rate < 0 or self.bytes_rate < 0:
+			raise ValueError("rate limits must be >= 0")
+		# temps passé à attendre par ce processus (pour les bilans)
+		self.waited = 0.0
+		# ouvert à la première utilisation (donc par chaque processus du
+		# Pool pour son propre compte: flock ne sépare pas des processus
+		# qui partagent le même descripteur)
+		self._fd = None
+		self._pid = None
+		self._lock = Lock()
+
+	def _state_fd(self):
+		if self._pid != os.getpid():
+			# après fork: propre descripteur et propre verrou de threads
+			self._fd = None
+			self._lock = Lock()
+			self._pid = os.getpid()
+		if self._fd is None:
+			self._fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o666)
+		return self._fd
+
+	def _take(self, n_requests, n_bytes):
+		"""
+		One try: pays and returns 0 if the buckets allow it, otherwise
+		returns the seconds to wait before trying again
+		"""
+		fd = self._state_fd()
+		with self._lock:
+			flock(fd, LOCK_EX)
+			try:
+				now = time()
+				data = os.pread(fd, STATE.size, 0)
+				if len(data) == STATE.size:
+					(tokens, byte_tokens, last) = STATE.unpack(data)
+				else:
+					# nouveau fichier: seaux pleins
+					(tokens, byte_tokens, last) = (self.burst, self.bytes_burst, now)
+
+				# remplissage depuis la dernière mise à jour
+				# (horloge reculée => rien)
+				elapsed = max(0.0, now - last)
+				tokens = min(self.burst, tokens + elapsed * self.rate)
+				byte_tokens = min(self.bytes_burst, byte_tokens + elapsed * self.bytes_rate)
+
+				wait = 0.0
+				if self.rate and n_requests and tokens < n_requests:
+					wait = (n_requests - tokens) / self.rate
+				if self.bytes_rate and byte_tokens < 0:
+					wait = max(wait, -byte_tokens / self.bytes_rate)
+				if wait == 0.0:
+					if self.rate:
+						tokens -= n_requests
+					if self.bytes_rate:
+						byte_tokens -= n_bytes
+				os.pwrite(fd, STATE.pack(tokens, byte_tokens, now), 0)
+			finally:
+				flock(fd, LOCK_UN)
+		return wait
+
+	def acquire(self, n_requests=1, n_bytes=0):
+		"""
+		Blocks until n_requests are allowed (and the bytes debt is paid)
+		then pays them, with n_bytes (which may leave a bytes debt)
+		"""
+		if not self.rate and not self.bytes_rate:
+			return
+		while True:
+			wait = self._take(n_requests, n_bytes)
+			if wait == 0.0:
+				return
+			self.waited += wait
+			sleep(wait)
+
+	def close(self):
+		if self._fd is not None and self._pid == os.getpid():
+			os.close(self._fd)
+		self._fd = None
+
+
+def read_limited(remote_file, limiter=None, chunk_size=READ_CHUNK):
+	"""
+	Whole body of an HTTP answer, paying its bytes to the limiter chunk
+	by chunk (a big PDF doesn't pass at once above bytes_rate)
+	"""
+	if limiter is None or not limiter.bytes_rate:
+		return remote_file.read()
+	chunks = []
+	chunk = remote_file.read(chunk_size)
+	while chunk:
+		limiter.acquire(0, len(chunk))
+		chunks.append(chunk)
+		chunk = remote_file.read(chunk_size)
+	return b"".join(chunks)
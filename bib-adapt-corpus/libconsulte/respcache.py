@@ -0,0 +1,189 @@
+#! /usr/bin/python3
+"""
+Persistent cache of ISTEX API json answers (SQLite)
+
+Les mêmes requêtes count/facet/search reviennent d'un échantillonnage
+à l'autre (et d'une passe de relâchement des critères à l'autre): leurs
+réponses brutes sont gardées dans une base SQLite, sous l'URL normalisée
+(paramètres triés, schéma et hôte en minuscules).
+
+  - ttl       : âge maximal d'une réponse (au-delà: redemandée à l'API)
+  - max_bytes : taille maximale des réponses gardées, les moins
+                récemment utilisées étant supprimées d'abord (LRU)
+  - offline   : lecture seule, sans API (réponses périmées comprises),
+                une requête absente du cache est une erreur (cf. api._get)
+
+Plusieurs processus peuvent partager la même base (verrous SQLite).
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2014-5 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+import os
+import sqlite3
+from os              import path, makedirs
+from urllib.parse    import urlsplit, urlunsplit
+from threading       import Lock
+from time            import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+	url    TEXT PRIMARY KEY,
+	body   BLOB NOT NULL,
+	size   INTEGER NOT NULL,
+	stored REAL NOT NULL,
+	used   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+"""
+
+
+def normalize_url(url):
+	"""
+	Cache key of an url: same query => same key, whatever the order of
+	its parameters (the values are kept as escaped in the url)
+	"""
+	parts = urlsplit(url)
+	params = sorted(p for p in parts.query.split('&') if p)
+	return urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+	                   parts.path or '/', '&'.join(params), ''))
+
+
+class ResponseCache(object):
+	"""
+	Normalized url => raw answer (bytes)
+
+	   db_path   -- the SQLite file (created if needed, except offline)
+	   ttl       -- seconds before an answer is stale (None: never)
+	   max_bytes -- total size bound of the answers (None: no bound)
+	   offline   -- read-only: no writes, stale answers are served too
+	"""
+	def __init__(self, db_path, ttl=None, max_bytes=None, offline=False):
+		self.db_path = db_path
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+		self.offline = offline
+		if offline and not path.isfile(db_path):
+			raise FileNotFoundError("offline mode: no cache at '%s'" % db_path)
+		# compteurs (cf. stats)
+		self.n_hits = 0
+		self.n_misses = 0
+		self.n_stale = 0
+		self.n_stored = 0
+		self.n_evicted = 0
+		self._db = None
+		self._pid = None
+		self._lock = Lock()
+		# taille totale connue de la base (relue avant d'évincer)
+		self._total = None
+
+	def _conn(self):
+		if self._pid != os.getpid():
+			# après fork: propre connexion (sqlite3 ne se partage pas)
+			self._db = None
+			self._lock = Lock()
+			self._pid = os.getpid()
+		if self._db is None:
+			if self.offline:
+				self._db = sqlite3.connect("file:%s?mode=ro" % self.db_path, uri=True,
+				                           timeout=30, check_same_thread=False)
+			else:
+				makedirs(path.dirname(path.abspath(self.db_path)), exist_ok=True)
+				self._db = sqlite3.connect(self.db_path, timeout=30,
+				                           check_same_thread=False)
+				self._db.executescript(SCHEMA)
+		return self._db
+
+	def get(self, url):
+		"""
+		Cached answer of url or None (absent or stale)
+		"""
+		key = normalize_url(url)
+		db = self._conn()
+		with self._lock:
+			row = db.execute("SELECT body, stored FROM responses WHERE url = ?", (key,)).fetchone()
+			if row is None:
+				self.n_misses += 1
+				return None
+			(body, stored) = row
+			now = time()
+			if self.ttl is not None and now - stored > self.ttl and not self.offline:
+				self.n_stale += 1
+				self.n_misses += 1
+				return None
+			if not self.offline:
+				with db:
+					db.execute("UPDATE responses SET used = ? WHERE url = ?", (now, key))
+			self.n_hits += 1
+			return bytes(body)
+
+	def put(self, url, body):
+		"""
+		Stores the answer of url (no-op offline), then evicts the least
+		recently used answers if over max_bytes
+		"""
+		if self.offline:
+			return
+		key = normalize_url(url)
+		db = self._conn()
+		now = time()
+		with self._lock:
+			with db:
+				db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+				           (key, sqlite3.Binary(body), len(body), now, now))
+			self.n_stored += 1
+			if self.max_bytes is None:
+				return
+			if self._total is None:
+				self._total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+			else:
+				self._total += len(body)
+			if self._total > self.max_bytes:
+				self._evict(db)
+
+	def _evict(self, db):
+		# taille réelle (d'autres processus écrivent peut-être aussi)
+		total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+		# on descend à 90% de la borne (pas une éviction à chaque put)
+		target = 0.9 * self.max_bytes
+		to_delete = []
+		if total > self.max_bytes:
+			for (key, size) in db.execute("SELECT url, size FROM responses ORDER BY used"):
+				if total <= target:
+					break
+				to_delete.append((key,))
+				total -= size
+		with db:
+			db.executemany("DELETE FROM responses WHERE url = ?", to_delete)
+		self.n_evicted += len(to_delete)
+		self._total = total
+
+	def stats(self):
+		"""
+		Counters of this process: hits, misses (stale included), stale,
+		stored, evicted + number and bytes of the answers in the base
+		"""
+		db = self._conn()
+		with self._lock:
+			(n_entries, n_bytes) = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+		return {'hits': self.n_hits, 'misses': self.n_misses,
+		        'stale': self.n_stale, 'stored': self.n_stored,
+		        'evicted': self.n_evicted,
+		        'entries': n_entries, 'bytes': n_bytes}
+
+	def clear(self):
+		if self.offline:
+			return
+		db = self._conn()
+		with self._lock:
+			with db:
+				db.execute("DELETE FROM responses")
+			self._total = 0
+
+	def close(self):
+		if self._db is not None and self._pid == os.getpid():
+			self._db.close()
+		self._db = None
@@ -209,6 +209,18 @@ def my_parse_args(arglist=None):
 		required=False,
 		action='store_true')
 	
+	parser.add_argument('-C', '--api_cache',
+		help="keep the API answers (counts, facets, hits) in pool_cache/api_responses.sqlite\nand reuse them in the next runs",
+		default=False,
+		required=False,
+		action='store_true')
+	
+	parser.add_argument('--offline',
+		help="only use the API answers kept by earlier --api_cache runs\n(no API requests at all)",
+		default=False,
+		required=False,
+		action='store_true')
+	
 	args = parser.parse_args(arglist)
 	
 	# --- checks and pre-propagation --------
@@ -576,6 +588,10 @@ def full_run(arglist=None):
 		# global var change in main
 		LISSAGE = args.smoothing_init
 	
+	# réponses de l'API gardées d'un run à l'autre ?
+	if args.api_cache or args.offline:
+		api.set_cache(offline=args.offline)
+	
 	# event log lines
 	LOG = ['INIT: sampling %i' % args.sample_size]
 	LOG.append('CRIT: fields(%s)' % ", ".join(args.criteria_list))
@@ -745,6 +761,11 @@ def full_run(arglist=None):
 		
 		LOG.append("SAVE: saved docs in %s/" % my_dir)
 	
+	if api.API_CACHE is not None:
+		cstats = api.cache_stats()
+		LOG.append("CACHE: %i API answers from cache, %i asked to the API" % (cstats['hits'], cstats['misses']))
+		print(LOG[-1], file=stderr)
+	
 	if args.log:
 		# separate logging lines
 		logfile = open(my_name+'.log', 'w')
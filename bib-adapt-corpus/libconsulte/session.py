@@ -0,0 +1,235 @@
+#! /usr/bin/python3
+"""
+Pooled keep-alive HTTP(S) connections for the ISTEX API
+
+Au lieu d'un urlopen (nouvelle connexion TCP + négociation TLS) par
+requête, les connexions http.client sont gardées ouvertes et réutilisées:
+une file de connexions libres par hôte, sous verrou (plusieurs threads
+peuvent faire des requêtes en même temps, chacun prenant sa propre
+connexion). L'authentification est configurée une fois pour la session
+et, comme avec urllib, l'en-tête Basic n'est envoyé qu'après une demande
+du serveur (401): ensuite il l'est d'office pour cet hôte.
+
+Les erreurs sont celles de urlopen (HTTPError pour les statuts >= 400,
+URLError pour les problèmes de connexion): le code appelant ne change pas.
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2014-5 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+import os
+from base64          import b64encode
+from http.client     import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse    import urlsplit, urljoin
+from urllib.request  import getproxies, proxy_bypass
+from urllib.error    import URLError, HTTPError
+from threading       import Lock
+
+# redirections suivies (comme urlopen)
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+USER_AGENT = "libconsulte/0.1"
+
+
+class PooledResponse(object):
+	"""
+	Answer of ApiSession.open: read it (all at once or by chunks), then
+	close it (the connection goes back to the pool if the body was read
+	to the end, otherwise it is dropped)
+	"""
+	def __init__(self, session, key, conn, response, url):
+		self._session = session
+		self._key = key
+		self._conn = conn
+		self._response = response
+		self.url = url
+		self.status = response.status
+		self.reason = response.reason
+		self.headers = response.headers
+
+	def getheader(self, name, default=None):
+		return self._response.getheader(name, default)
+
+	def read(self, amt=None):
+		return self._response.read(amt)
+
+	def close(self):
+		if self._conn is None:
+			return
+		reusable = self._response.isclosed() and not self._response.will_close
+		if not reusable:
+			self._response.close()
+		self._session._release(self._key, self._conn, reusable)
+		self._conn = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class ApiSession(object):
+	"""
+	Keep-alive connections to the API hosts, shared by all threads
+
+	   max_idle -- connections kept open per host between requests
+	               (more can be open at once, the rest is then closed)
+	   timeout  -- socket timeout in seconds
+	"""
+	def __init__(self, max_idle=8, timeout=60):
+		self.max_idle = max_idle
+		self.timeout = timeout
+		# hôte => valeur de l'en-tête Authorization
+		self._auth = {}
+		# hôtes qui ont demandé l'authentification (401)
+		self._challenged = set()
+		# (scheme, host) => connexions libres
+		self._idle = {}
+		self._lock = Lock()
+		self._pid = os.getpid()
+		# compteurs (connexions ouvertes / requêtes servies)
+		self.n_connects = 0
+		self.n_requests = 0
+
+	def set_auth(self, host, user, passw):
+		"""
+		Basic credentials for all the following requests to host
+		(user None: removes them)
+		"""
+		with self._lock:
+			if user is None:
+				self._auth.pop(host, None)
+				self._challenged.discard(host)
+			else:
+				token = b64encode(("%s:%s" % (user, passw)).encode('UTF-8')).decode('ascii')
+				self._auth[host] = "Basic " + token
+
+	def _connect(self, scheme, host):
+		proxy = getproxies().get(scheme)
+		if proxy and not proxy_bypass(host.split(':')[0]):
+			proxy_host = urlsplit(proxy).netloc or proxy
+			if scheme == 'https':
+				conn = HTTPSConnection(proxy_host, timeout=self.timeout)
+				conn.set_tunnel(host)
+			else:
+				conn = HTTPConnection(proxy_host, timeout=self.timeout)
+				conn._via_proxy = True
+		elif scheme == 'https':
+			conn = HTTPSConnection(host, timeout=self.timeout)
+		else:
+			conn = HTTPConnection(host, timeout=self.timeout)
+		with self._lock:
+			self.n_connects += 1
+		return conn
+
+	def _acquire(self, key):
+		"""
+		A free connection to (scheme, host) => (conn, reused)
+		"""
+		with self._lock:
+			if self._pid != os.getpid():
+				# après fork: les sockets du parent ne sont pas à nous
+				self._idle = {}
+				self._lock = Lock()
+				self._pid = os.getpid()
+			idle = self._idle.get(key)
+			if idle:
+				return (idle.pop(), True)
+		return (self._connect(*key), False)
+
+	def _release(self, key, conn, reusable):
+		if reusable:
+			with self._lock:
+				idle = self._idle.setdefault(key, [])
+				if len(idle) < self.max_idle:
+					idle.append(conn)
+					return
+		conn.close()
+
+	def _request(self, url, headers, method='GET'):
+		parts = urlsplit(url)
+		if parts.scheme not in ('http', 'https'):
+			raise URLError("unknown url type: %s" % parts.scheme)
+		key = (parts.scheme, parts.netloc)
+		target = parts.path or '/'
+		if parts.query:
+			target += '?' + parts.query
+
+		all_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'identity'}
+		if parts.netloc in self._challenged and parts.netloc in self._auth:
+			all_headers['Authorization'] = self._auth[parts.netloc]
+		all_headers.update(headers or {})
+
+		(conn, reused) = self._acquire(key)
+		while True:
+			try:
+				conn.request(method, url if getattr(conn, '_via_proxy', False) else target,
+				             headers=all_headers)
+				response = conn.getresponse()
+				break
+			except (HTTPException, ConnectionError) as err:
+				conn.close()
+				if reused:
+					# connexion keep-alive fermée entre-temps par le serveur:
+					# une seule nouvelle tentative sur une connexion neuve
+					conn = self._connect(*key)
+					reused = False
+					continue
+				raise URLError(err)
+			except OSError as err:
+				conn.close()
+				raise URLError(err)
+		with self._lock:
+			self.n_requests += 1
+		return PooledResponse(self, key, conn, response, url)
+
+	def open(self, url, headers=None, method='GET'):
+		"""
+		GET (or HEAD) url => PooledResponse (follows redirects)
+
+		Raises HTTPError if status >= 400 (URLError if no answer), like urlopen
+		"""
+		for i in range(MAX_REDIRECTS + 1):
+			answer = self._request(url, headers, method)
+			netloc = urlsplit(url).netloc
+			if (answer.status == 401 and netloc in self._auth
+			    and netloc not in self._challenged):
+				# l'hôte demande l'authentification: on la renvoie
+				answer.read()
+				answer.close()
+				with self._lock:
+					self._challenged.add(netloc)
+				answer = self._request(url, headers, method)
+			if answer.status in REDIRECT_CODES and answer.getheader('Location'):
+				answer.read()
+				answer.close()
+				url = urljoin(url, answer.getheader('Location'))
+				continue
+			if answer.status >= 400:
+				answer.read()
+				answer.close()
+				raise HTTPError(url, answer.status, answer.reason, answer.headers, None)
+			return answer
+		raise HTTPError(url, answer.status, "too many redirects", answer.headers, None)
+
+	def get(self, url, headers=None):
+		"""
+		GET url => the whole body (bytes)
+		"""
+		with self.open(url, headers) as answer:
+			return answer.read()
+
+	def close(self):
+		"""
+		Closes all the idle connections
+		"""
+		with self._lock:
+			for idle in self._idle.values():
+				for conn in idle:
+					conn.close()
+			self._idle = {}
@@ -5,6 +5,11 @@ import unittest
 # tools
 from urllib.request   import urlopen
 from http.client      import HTTPResponse
+from os               import path
+from tempfile         import mkdtemp
+from time             import time
+from threading        import Thread
+from http.server      import HTTPServer, BaseHTTPRequestHandler
 
 # the tested module
 # £TODO check if import ok
@@ -53,6 +58,114 @@ class TestApi(unittest.TestCase):
 		tei = tei_file.decode('UTF-8')
 		self.assertEqual(tei[0:5], '<?xml')
 
+	def test_4b_iter_search(self):
+		"Checks if paginated search yields hits from an offset"
+		hits = list(api.iter_search('*', limit=3, i_from=10, outfields=['id']))
+		self.assertEqual(len(hits), 3)
+		self.assertEqual(hits[0]['id'], api.search('*', limit=1, i_from=10, outfields=['id'])[0]['id'])
+
+	def test_5_rate_limit(self):
+		"Checks if the shared rate limit spaces out requests"
+		state_file = path.join(mkdtemp(), 'bucket')
+		limiter = api.set_rate_limit(max_rps=20, state_file=state_file)
+		t0 = time()
+		for i in range(30):
+			limiter.acquire()
+		# 20 d'un coup (burst) puis 10 à 20/s
+		self.assertGreaterEqual(time() - t0, 0.45)
+		api.set_rate_limit()
+		self.assertIsNone(api.API_LIMITER)
+
+	def test_6_session_keepalive(self):
+		"Checks if successive requests reuse the pooled connection"
+		session = api.set_session(max_idle=2)
+		for i in range(3):
+			json_dic = api._get(self.full_route+'?q='+'*'+'&size=1')
+			self.assertIsInstance(json_dic['total'], int)
+		self.assertEqual(session.n_requests, 3)
+		self.assertEqual(session.n_connects, 1)
+
+	def test_7_response_cache(self):
+		"Checks if cached answers are served back (any param order) and offline"
+		db_path = path.join(mkdtemp(), 'responses.sqlite')
+		cache = api.set_cache(db_path, ttl=3600)
+		url = self.full_route+'?q=*&size=1'
+		cache.put(url, b'{"total": 42, "hits": []}')
+		self.assertEqual(api._get(self.full_route+'?size=1&q=*')['total'], 42)
+		api.set_cache(db_path, offline=True)
+		self.assertEqual(api._get(url)['total'], 42)
+		self.assertEqual(api.cache_stats()['hits'], 1)
+		with self.assertRaises(api.URLError):
+			api._get(self.full_route+'?q=absent')
+		api.set_cache(None)
+		self.assertIsNone(api.API_CACHE)
+
+	def test_8_imap_queries(self):
+		"Checks if concurrent queries come back in order, errors captured"
+		def fake_count(q):
+			if q == 'bad':
+				raise ValueError(q)
+			return len(q)
+		queries = ['q'*i for i in range(1, 50)] + ['bad']
+		results = list(api.imap_queries(fake_count, queries, n_workers=4))
+		self.assertEqual([r[0] for r in results], queries)
+		self.assertEqual(results[3][1], 4)
+		self.assertIsInstance(results[-1][2], ValueError)
+
+	def test_9_already_fetched(self):
+		"Checks if complete downloaded files are recognized (size, sha1)"
+		tgt_dir = mkdtemp()
+		tgt_path = path.join(tgt_dir, 'doc.pdf')
+		fh = open(tgt_path, 'wb')
+		fh.write(b'%PDF-1.4 fake')
+		fh.close()
+		api._log_fetched(tgt_path, 13, 'f'*40)
+		self.assertTrue(api._already_fetched(tgt_path, 'size'))
+		self.assertFalse(api._already_fetched(tgt_path, 'sha1'))
+		self.assertFalse(api._already_fetched(tgt_path, None))
+		self.assertFalse(api._already_fetched(path.join(tgt_dir, 'absent.pdf')))
+		# présent mais pas dans le journal: inconnu (ni complet ni absent)
+		fh = open(path.join(tgt_dir, 'unlogged.pdf'), 'wb')
+		fh.write(b'%PDF-1.4 truncat')
+		fh.close()
+		self.assertIsNone(api._already_fetched(path.join(tgt_dir, 'unlogged.pdf'), 'size'))
+
+	def test_10_auth_challenge(self):
+		"Checks if Basic auth is only sent once the host asked for it (401)"
+		seen = []
+		class AuthHandler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+			def do_GET(self):
+				seen.append(self.headers.get('Authorization'))
+				if self.headers.get('Authorization') is None and self.path == '/private':
+					self.send_response(401)
+					self.send_header('WWW-Authenticate', 'Basic realm="test"')
+				else:
+					self.send_response(200)
+				self.send_header('Content-Length', '2')
+				self.end_headers()
+				self.wfile.write(b'ok')
+			def log_message(self, *args):
+				pass
+		server = HTTPServer(('127.0.0.1', 0), AuthHandler)
+		Thread(target=server.serve_forever, daemon=True).start()
+		host = '127.0.0.1:%i' % server.server_port
+		session = api.set_session()
+		session.set_auth(host, 'user', 'passw')
+		try:
+			self.assertEqual(session.get('http://%s/public' % host), b'ok')
+			self.assertIsNone(seen[-1])
+			self.assertEqual(session.get('http://%s/private' % host), b'ok')
+			self.assertEqual(seen[-2:], [None, 'Basic dXNlcjpwYXNzdw=='])
+			# ensuite envoyé d'office
+			session.get('http://%s/public' % host)
+			self.assertEqual(seen[-1], 'Basic dXNlcjpwYXNzdw==')
+			self.assertEqual(session.n_requests, 4)
+		finally:
+			session.close()
+			server.shutdown()
+			server.server_close()
+
 
 if __name__ == '__main__':
 	unittest.main(verbosity=2)
\ No newline at end of file
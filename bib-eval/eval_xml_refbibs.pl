@@ -22,6 +22,7 @@ use strict ;
 use Getopt::Long ;
 
 use File::Basename;            # pour les noms de fichier standards
+use File::Find ;               # pour les dossiers répartis en sous-dossiers
 
 use XML::LibXML ;              # pour parser les XML
 use HTML::HTML5::Entities;     # et enlever les entités
@@ -129,7 +130,11 @@ my @COMPARERS = (
 
 # £TODO lire directement depuis corpusdir/meta ?
 
-my @xml_to_check_list = map {decode('UTF-8', $_)} glob("$xml_dir/*.$ext") ;
+# (lecture récursive: dossier à plat ou réparti en sous-dossiers AB/CD/
+#  comme la sortie de bib-get avec shard_levels=2)
+my @xml_to_check_list = () ;
+find(sub { push(@xml_to_check_list, decode('UTF-8', $File::Find::name)) if (-f $_ && /\.\Q$ext\E$/) ; }, $xml_dir) ;
+@xml_to_check_list = sort @xml_to_check_list ;
 my $M = scalar(@xml_to_check_list) ;
 warn "RELU_d : $M fichiers $ext dans le dossier à évaluer\n" ;
 
@@ -33,7 +33,7 @@ from sys import stderr, argv
 from re import search, sub, MULTILINE, match
 from re import split as resplit
 from urllib.error import HTTPError
-from os import listdir, path
+from os import walk, makedirs, path
 from json import dump, dumps
 
 # pour some_docs uniquement
@@ -1254,12 +1254,25 @@ if __name__ == '__main__':
 	# arguments (dossier IN, OUT et optionnellement LOG)
 	args = my_parse_args()
 
-	try:
-		the_files = [path.join(args.IN_DIR,fi) for fi in listdir(args.IN_DIR)]
-	except:
+	if not path.isdir(args.IN_DIR):
 		warn("le dossier %s n'existe pas" % args.IN_DIR)
 		exit(1)
 
+	# lecture récursive: dossier à plat ou bien réparti en sous-dossiers
+	# (ex: bib-get avec shard_levels=2 => AB/CD/ID.xml)
+	# sauf les .part (TEI en cours d'écriture par bib-get)
+	the_files = []
+	n_partial = 0
+	for dirpath, dirnames, filenames in walk(args.IN_DIR):
+		dirnames.sort()
+		for fi in sorted(filenames):
+			if fi.endswith('.part'):
+				n_partial += 1
+			else:
+				the_files.append(path.join(dirpath,fi))
+	if n_partial:
+		warn("(%i fichiers .part ignorés: TEI incomplètes)" % n_partial)
+
 	NB_docs = len(the_files)
 
 	# lecture pour chaque doc => pour chaque bib
@@ -1465,7 +1478,11 @@ if __name__ == '__main__':
 		# + optionnel 1 fichier JSON de log
 
 		# même nom que le fichier d'entrée
-		out_doc_xml_path = path.join(args.OUT_DIR, teidoc.filename)
+		# (et mêmes sous-dossiers s'il y en a)
+		out_doc_dir = path.join(args.OUT_DIR,
+		                        path.relpath(path.dirname(bibfile), args.IN_DIR))
+		makedirs(out_doc_dir, exist_ok=True)
+		out_doc_xml_path = path.join(out_doc_dir, teidoc.filename)
 
 		# écriture XML enrichi
 		teidoc.xtree.write(out_doc_xml_path, pretty_print=True)
@@ -0,0 +1,190 @@
+#! /usr/bin/python3
+"""
+Offline benchmark of bib-get: throughput/latency curves vs concurrency
+
+Lance les stubs de stubs.py (API ISTEX + grobid-service) dans ce
+processus puis bib-get.py contre eux, pour chaque mode (Pool, async)
+et chaque niveau de concurrence demandé. Les mesures viennent du
+fichier d'état JSON de la télémétrie de bib-get ([telemetry] json).
+
+Usage:
+   python3 bench.py --n_docs 2000 --concurrency 1,2,4,8,16,32
+   python3 bench.py --latency const:0.2 --slots 8 --modes async --out bench.tsv
+
+Colonne 'ideal': débit max théorique = min(concurrence, slots) / latence
+moyenne du stub ; 'efficiency' = débit mesuré / idéal. Une baisse de
+l'efficacité après un changement du code de répartition est une
+régression.
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from sys             import executable, stderr
+from os              import path
+from argparse        import ArgumentParser
+from configparser    import ConfigParser
+from tempfile        import mkdtemp
+from shutil          import rmtree
+from subprocess      import run, DEVNULL, PIPE
+from random          import Random
+from json            import load
+from time            import time
+
+import stubs
+
+BIBGET_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+BIBGET = path.join(BIBGET_DIR, 'bib-get.py')
+
+COLUMNS = ['mode', 'concurrency', 'docs', 'failed', 'wall_s', 'docs_per_s',
+           'ideal', 'efficiency', 'p50_s', 'p95_s', 'p99_s', 'errors']
+
+
+def mean_latency(spec, n=20000):
+	"""
+	Mean of a stub latency distribution (by sampling)
+	"""
+	draw = stubs.parse_latency(spec)
+	rand = Random(0)
+	return sum(draw(rand) for i in range(n)) / n
+
+
+def bench_config(work_dir, api_port, grobid_port, concurrency, args):
+	"""
+	bib-get config for one run: the default bib-get.ini pointed at the stubs
+	"""
+	conf = ConfigParser()
+	conf.read(path.join(BIBGET_DIR, 'bib-get.ini'))
+	conf['istex-api']['scheme'] = 'http'
+	conf['istex-api']['host'] = '127.0.0.1:%i' % api_port
+	conf['grobid-service']['host'] = '127.0.0.1'
+	conf['grobid-service']['port'] = str(grobid_port)
+	conf['grobid-service']['mode'] = 'upload' if args.upload else 'url'
+	conf['process']['service-ncpu'] = str(concurrency)
+	conf['process']['async-conns'] = str(concurrency)
+	if args.adaptive:
+		conf['process']['concurrency'] = 'adaptive'
+		conf['process']['adaptive-max'] = str(concurrency)
+	# (pas de rapport intermédiaire: seulement l'état final)
+	conf['telemetry']['interval'] = '3600'
+	conf['telemetry']['json'] = path.join(work_dir, 'status.json')
+	conf_path = path.join(work_dir, 'bench.ini')
+	conf_file = open(conf_path, 'w')
+	conf.write(conf_file)
+	conf_file.close()
+	return conf_path
+
+
+def bench_run(mode, concurrency, api_port, grobid_port, ideal, args):
+	"""
+	One bib-get run => a row of measures (dict of COLUMNS)
+	"""
+	work_dir = mkdtemp(prefix='bibget-bench-')
+	conf_path = bench_config(work_dir, api_port, grobid_port, concurrency, args)
+	cmd = [executable, BIBGET, '-c', conf_path, '-q', 'bench', '-m', str(args.n_docs), '-y']
+	if mode == 'async':
+		cmd.append('-a')
+
+	t0 = time()
+	proc = run(cmd, cwd=work_dir, stdout=DEVNULL, stderr=PIPE)
+	wall = time() - t0
+
+	status_path = path.join(work_dir, 'status.json')
+	if proc.returncode != 0 or not path.exists(status_path):
+		print("ERR: bib-get run failed (%s x%i):\n%s" % (mode, concurrency,
+		      proc.stderr.decode('UTF-8', 'replace')[-2000:]), file=stderr)
+		return None
+	status_file = open(status_path)
+	status = load(status_file)
+	status_file.close()
+	if args.keep:
+		print("(run kept in %s)" % work_dir, file=stderr)
+	else:
+		rmtree(work_dir)
+
+	def secs(x):
+		return "" if x is None else "%.3f" % x
+	return {
+		'mode': mode,
+		'concurrency': concurrency,
+		'docs': status['docs_done'],
+		'failed': status['docs_failed'],
+		'wall_s': "%.1f" % wall,
+		'docs_per_s': "%.2f" % status['throughput_avg'],
+		'ideal': "%.2f" % ideal,
+		'efficiency': "%.2f" % (status['throughput_avg'] / ideal),
+		'p50_s': secs(status['latency_p50']),
+		'p95_s': secs(status['latency_p95']),
+		'p99_s': secs(status['latency_p99']),
+		'errors': ",".join("%s:%i" % (k, v) for (k, v) in sorted(status['errors'].items())),
+	}
+
+
+def plot(rows, width=50):
+	"""
+	Throughput vs concurrency as text bars, per mode
+	"""
+	top = max(float(r['docs_per_s']) for r in rows) or 1.0
+	lines = []
+	for mode in sorted(set(r['mode'] for r in rows)):
+		lines.append("%s:" % mode)
+		for r in rows:
+			if r['mode'] == mode:
+				n_bar = int(round(width * float(r['docs_per_s']) / top))
+				lines.append("  x%-4i %s %s docs/s" % (r['concurrency'], "#" * n_bar, r['docs_per_s']))
+	return "\n".join(lines)
+
+
+def main():
+	parser = ArgumentParser(description="bib-get throughput/latency vs concurrency, against local stubs")
+	parser.add_argument('--n_docs', type=int, default=1000, help="documents per run")
+	parser.add_argument('--concurrency', default='1,2,4,8,16', help="comma-separated levels")
+	parser.add_argument('--modes', default='pool,async', help="pool and/or async (-a)")
+	parser.add_argument('--latency', default='lognormal:0.2,0.5', help="stub grobid latency (cf. stubs.parse_latency)")
+	parser.add_argument('--error_rate', type=float, default=0.0, help="stub grobid fraction of 500 answers")
+	parser.add_argument('--n_bibs', type=int, default=30, help="stub grobid mean biblStruct per document")
+	parser.add_argument('--slots', type=int, default=None, help="stub grobid max simultaneous requests (default: max concurrency)")
+	parser.add_argument('--pdf_size', type=int, default=200000, help="stub api bytes per PDF (upload mode)")
+	parser.add_argument('--upload', action='store_true', help="bib-get in upload mode")
+	parser.add_argument('--adaptive', action='store_true', help="bib-get with concurrency=adaptive (max: the level)")
+	parser.add_argument('--out', default=None, help="also write the rows to this TSV file")
+	parser.add_argument('--keep', action='store_true', help="keep the run dirs")
+	args = parser.parse_args()
+
+	levels = [int(c) for c in args.concurrency.split(',')]
+	modes = args.modes.split(',')
+	slots = args.slots or max(levels)
+
+	api = stubs.start_api(n_docs=args.n_docs, pdf_size=args.pdf_size)
+	grobid = stubs.start_grobid(latency=args.latency, error_rate=args.error_rate,
+	                            n_bibs=args.n_bibs, slots=slots)
+	avg_latency = mean_latency(args.latency)
+
+	print("\t".join(COLUMNS))
+	rows = []
+	for mode in modes:
+		for concurrency in levels:
+			ideal = min(concurrency, slots) / avg_latency
+			row = bench_run(mode, concurrency, api.server_port, grobid.server_port, ideal, args)
+			if row is not None:
+				print("\t".join(str(row[c]) for c in COLUMNS), flush=True)
+				rows.append(row)
+
+	if rows:
+		print("\n" + plot(rows))
+	if args.out and rows:
+		out_file = open(args.out, 'w')
+		out_file.write("\t".join(COLUMNS) + "\n")
+		for row in rows:
+			out_file.write("\t".join(str(row[c]) for c in COLUMNS) + "\n")
+		out_file.close()
+
+	api.shutdown()
+	grobid.shutdown()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,154 @@
+#! /usr/bin/python3
+"""
+Micro-benchmark of the TEI post-processing: str path vs single pass
+
+  - 'str'    : ancien chemin des workers, réponse entière décodée puis
+               extract.postprocess_tei (3 passes regex) et fichier texte
+               (.part puis renommé, comme l'ancien write_tei)
+  - 'stream' : teistream.TeiFileSink, octets post-traités morceau par
+               morceau (comme lus sur la socket) directement vers le
+               fichier
+
+Les deux sorties sont d'abord comparées octet par octet (le benchmark
+s'arrête si elles diffèrent), puis chaque chemin est chronométré sur
+les mêmes TEI factices (cf. stubs.stub_tei) de différentes tailles:
+post-traitement seul en mémoire ('memory'), puis avec l'écriture des
+fichiers ('file', où le système de fichiers pèse lourd pour les
+petites TEI).
+
+Usage:
+   python3 bench_postprocess.py
+   python3 bench_postprocess.py --n_docs 2000 --n_bibs 0,30,300 --chunk 16384
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from sys             import path as sys_path, exit
+from os              import path, makedirs, rename
+from argparse        import ArgumentParser
+from tempfile        import mkdtemp
+from shutil          import rmtree
+from time            import perf_counter
+from io              import BytesIO
+
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from libbibget.extract   import postprocess_tei
+from libbibget.teistream import TeiFileSink, TeiRewriter
+
+import stubs
+
+
+def str_path(out_path, istex_id, raw, chunk):
+	# (comme bib-get avant: lecture entière, str, regex, puis write_tei)
+	result_tei = postprocess_tei(raw.decode('UTF-8'), istex_id)
+	makedirs(path.dirname(out_path), exist_ok=True)
+	out_file = open(out_path + '.part', 'w', encoding='UTF-8')
+	out_file.write(result_tei)
+	out_file.close()
+	rename(out_path + '.part', out_path)
+	return raw.count(b"<biblStruct")
+
+
+def stream_path(out_path, istex_id, raw, chunk):
+	sink = TeiFileSink(out_path, istex_id)
+	sink.begin()
+	for i in range(0, len(raw), chunk):
+		sink.feed(raw[i:i+chunk])
+	stats = {}
+	sink.commit(stats)
+	return stats['n_biblstruct']
+
+
+def str_memory(out_path, istex_id, raw, chunk):
+	# (post-traitement seul, sans le fichier)
+	return postprocess_tei(raw.decode('UTF-8'), istex_id).encode('UTF-8')
+
+
+def stream_memory(out_path, istex_id, raw, chunk):
+	out = BytesIO()
+	rewriter = TeiRewriter(istex_id, out)
+	for i in range(0, len(raw), chunk):
+		rewriter.feed(raw[i:i+chunk])
+	rewriter.close()
+	return out.getvalue()
+
+
+def check_same(work_dir, docs, chunks):
+	"""
+	Both paths must give the same bytes (and the same biblStruct count)
+	"""
+	for (istex_id, raw) in docs:
+		for chunk in chunks:
+			a = path.join(work_dir, 'a.xml')
+			b = path.join(work_dir, 'b.xml')
+			n_a = str_path(a, istex_id, raw, chunk)
+			n_b = stream_path(b, istex_id, raw, chunk)
+			same = (open(a, 'rb').read() == open(b, 'rb').read())
+			if not same or n_a != n_b:
+				print("ERR: outputs differ for %s (chunk %i)" % (istex_id, chunk))
+				return False
+	return True
+
+
+def time_path(fun, work_dir, docs, chunk):
+	"""
+	Seconds to post-process and write all the docs with one path
+
+	(chaque chemin dans son propre dossier: mêmes conditions pour les deux)
+	"""
+	out_dir = path.join(work_dir, fun.__name__)
+	makedirs(out_dir, exist_ok=True)
+	out_paths = [path.join(out_dir, "%s.tei.xml" % istex_id) for (istex_id, raw) in docs]
+	t0 = perf_counter()
+	for ((istex_id, raw), out_path) in zip(docs, out_paths):
+		fun(out_path, istex_id, raw, chunk)
+	return perf_counter() - t0
+
+
+def main():
+	parser = ArgumentParser(description="TEI post-processing: str path vs single-pass streaming")
+	parser.add_argument('--n_docs', type=int, default=1000, help="documents per size")
+	parser.add_argument('--n_bibs', default='0,10,50,300', help="comma-separated biblStruct counts")
+	parser.add_argument('--chunk', type=int, default=65536, help="bytes per chunk fed to the stream path")
+	parser.add_argument('--repeat', type=int, default=3, help="timings per path (the best is kept)")
+	args = parser.parse_args()
+
+	work_dir = mkdtemp(prefix='bibget-postprocess-')
+	try:
+		# correction d'abord: tailles de morceaux petites et bizarres
+		# pour couper les motifs (racine, <listBibl>, <biblStruct) partout
+		samples = [(stubs.bench_id(k), stubs.stub_tei(stubs.bench_id(k), n)) for (k, n) in enumerate([0, 1, 3, 40])]
+		samples.append((stubs.bench_id(99), samples[0][1].replace(b"<listBibl>\n", b"<listBibl>\n" + b" " * 200000)))
+		samples.append((stubs.bench_id(98), b""))
+		if not check_same(work_dir, samples, [1, 2, 3, 7, 11, 64, 4096, args.chunk]):
+			exit(1)
+
+		print("\t".join(['target', 'n_bibs', 'kB/doc', 'str_us', 'stream_us', 'str_MB/s', 'stream_MB/s', 'speedup']))
+		for (target, str_fun, stream_fun) in [('memory', str_memory, stream_memory),
+		                                      ('file', str_path, stream_path)]:
+			for n_bibs in [int(n) for n in args.n_bibs.split(',')]:
+				docs = [(stubs.bench_id(k), stubs.stub_tei(stubs.bench_id(k), n_bibs)) for k in range(args.n_docs)]
+				total = sum(len(raw) for (istex_id, raw) in docs)
+				t_str = min(time_path(str_fun, work_dir, docs, args.chunk) for r in range(args.repeat))
+				t_stream = min(time_path(stream_fun, work_dir, docs, args.chunk) for r in range(args.repeat))
+				print("\t".join([
+					target,
+					str(n_bibs),
+					"%.1f" % (total / len(docs) / 1000),
+					"%.1f" % (1e6 * t_str / len(docs)),
+					"%.1f" % (1e6 * t_stream / len(docs)),
+					"%.1f" % (total / t_str / 1e6),
+					"%.1f" % (total / t_stream / 1e6),
+					"%.2f" % (t_str / t_stream),
+				]), flush=True)
+	finally:
+		rmtree(work_dir)
+
+
+if __name__ == "__main__":
+	main()
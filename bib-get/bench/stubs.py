@@ -0,0 +1,284 @@
+#! /usr/bin/python3
+"""
+Local stand-ins for the ISTEX API and grobid-service (cf. bench.py)
+
+  - api    : /<route>/?q=... pages of hits (ids, fulltext, qualityIndicators)
+             /<route>/<ID>/fulltext/pdf (un faux PDF de taille donnée)
+  - grobid : /processReferencesViaUrl (GET) et /processReferences (POST)
+             avec une distribution de latences, un taux d'erreurs 500,
+             une taille de réponse (nombre de biblStruct) et un nombre
+             max de requêtes simultanées (au-delà: 503, comme
+             org.grobid.max.connections)
+
+Les IDs sont dérivés de leur rang (sha1), rien n'est gardé en mémoire:
+le même n_docs donne toujours les mêmes documents.
+
+Usage autonome:
+   python3 stubs.py api --port 18071 --n_docs 100000
+   python3 stubs.py grobid --port 18070 --latency lognormal:0.8,0.5 --slots 8
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from sys             import stderr
+from argparse        import ArgumentParser
+from json            import dumps
+from hashlib         import sha1
+from random          import Random
+from math            import log
+from time            import sleep
+from threading       import Thread, Lock
+from urllib.parse    import urlparse, parse_qs
+from http.server     import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def bench_id(rank):
+	"""
+	rank => a stable fake ISTEX id (40 hex chars)
+	"""
+	return sha1(("bench-%i" % rank).encode('ascii')).hexdigest().upper()
+
+
+def id_random(istex_id):
+	"""
+	Random generator seeded by a document (same doc => same draws)
+	"""
+	return Random(int(istex_id[0:16], 16))
+
+
+def parse_latency(spec):
+	"""
+	Latency distribution spec => function(rand) returning seconds
+
+	   const:0.5          -- always 0.5s
+	   uniform:0.2,2      -- between 0.2 and 2s
+	   exp:1.0            -- exponential of mean 1s
+	   lognormal:0.8,0.5  -- lognormal of median 0.8s and sigma 0.5
+	                         (long tail, closest to real PDFs)
+	"""
+	(law, _, params) = spec.partition(':')
+	values = [float(x) for x in params.split(',')] if params else []
+	if law == 'const' and len(values) == 1:
+		return lambda rand: values[0]
+	elif law == 'uniform' and len(values) == 2:
+		return lambda rand: rand.uniform(values[0], values[1])
+	elif law == 'exp' and len(values) == 1:
+		return lambda rand: rand.expovariate(1.0 / values[0])
+	elif law == 'lognormal' and len(values) == 2:
+		return lambda rand: rand.lognormvariate(log(values[0]), values[1])
+	raise ValueError("bad latency spec '%s' (const:s|uniform:a,b|exp:mean|lognormal:median,sigma)" % spec)
+
+
+def stub_tei(istex_id, n_bibs):
+	"""
+	A grobid-like TEI answer with n_bibs biblStruct (bytes)
+
+	(même racine et indentation par tabulations que grobid: 0 bibs
+	 donne un <listBibl> vide)
+	"""
+	bibs = "".join(
+		'\n\t\t\t\t<biblStruct xml:id="b%i">\n\t\t\t\t\t<analytic><title level="a" type="main">'
+		'Stub reference %i of %s</title></analytic>\n\t\t\t\t</biblStruct>' % (k, k, istex_id)
+		for k in range(n_bibs))
+	return ('<?xml version="1.0"?>\n<TEI xmlns="http://www.tei-c.org/ns/1.0" xmlns:xlink="http://www.w3.org/1999/xlink" \n'
+	        ' xmlns:mml="http://www.w3.org/1998/Math/MathML">\n\t<text>\n\t\t<back>\n\t\t\t<listBibl>%s\n'
+	        '\t\t\t</listBibl>\n\t\t</back>\n\t</text>\n</TEI>\n' % bibs).encode('UTF-8')
+
+
+class StubServer(ThreadingHTTPServer):
+	# (plusieurs dizaines de connexions simultanées en mode async)
+	request_queue_size = 256
+	daemon_threads = True
+
+
+class StubHandler(BaseHTTPRequestHandler):
+	# keep-alive comme les vrais services
+	protocol_version = 'HTTP/1.1'
+	# en-têtes et corps partent en 2 écritures: sans TCP_NODELAY l'ACK
+	# retardé du client ajoute ~40ms à chaque réponse
+	disable_nagle_algorithm = True
+
+	def send(self, status, body, content_type='application/json'):
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+class ApiHandler(StubHandler):
+	"""
+	ISTEX API stand-in (server attributes: route, n_docs, pdf_size, page_delay)
+	"""
+	def hit(self, istex_id, output):
+		rand = id_random(istex_id)
+		hit = {'id': istex_id}
+		if 'fulltext' in output:
+			hit['fulltext'] = [{'extension': 'pdf',
+			                    'uri': "%s/fulltext/pdf" % istex_id}]
+		if 'qualityIndicators' in output:
+			pages = max(1, int(rand.lognormvariate(log(10), 0.6)))
+			hit['qualityIndicators'] = {'pdfPageCount': pages,
+			                            'pdfWordCount': 500 * pages,
+			                            'pdfCharCount': 3000 * pages}
+		return hit
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		parts = url.path.strip('/').split('/')
+		srv = self.server
+
+		if len(parts) == 4 and parts[2:] == ['fulltext', 'pdf']:
+			body = b"%PDF-1.4\n" + b"%" * max(0, srv.pdf_size - 9)
+			self.send(200, body, 'application/pdf')
+			return
+
+		if parts != [srv.route]:
+			self.send(404, b'{"error": "not found"}')
+			return
+
+		query = parse_qs(url.query)
+		q = query.get('q', [''])[0]
+		size = int(query.get('size', ['10'])[0])
+		start = int(query.get('from', ['0'])[0])
+		output = query.get('output', [''])[0]
+
+		if q.startswith('id:('):
+			# (ordonnancement de bib-get: tailles d'une liste d'IDs)
+			ids = q[4:-1].split(' OR ')
+			total = len(ids)
+		else:
+			ids = [bench_id(k) for k in range(start, min(start + size, srv.n_docs))]
+			total = srv.n_docs
+		sleep(srv.page_delay)
+		self.send(200, dumps({'total': total,
+		                      'hits': [self.hit(i, output) for i in ids]}).encode('UTF-8'))
+
+
+class GrobidHandler(StubHandler):
+	"""
+	grobid-service stand-in (server attributes: latency, error_rate,
+	n_bibs, slots, and inflight + lock for the 503)
+	"""
+	MODELS = ("<modelconfig>"
+	          "<property><key>seg</key><value>stub_segmentation</value></property>"
+	          "<property><key>cit</key><value>stub_citation</value></property>"
+	          "</modelconfig>").encode('UTF-8')
+
+	def process(self, istex_id):
+		srv = self.server
+		with srv.lock:
+			if srv.inflight >= srv.slots:
+				overloaded = True
+			else:
+				overloaded = False
+				srv.inflight += 1
+		if overloaded:
+			self.send(503, b"", 'text/plain')
+			return
+		try:
+			# même document => même latence et même réponse,
+			# mais les erreurs sont tirées à chaque requête
+			rand = id_random(istex_id)
+			sleep(srv.latency(rand))
+			if srv.error_rate and srv.rand.random() < srv.error_rate:
+				self.send(500, b"stub error", 'text/plain')
+			else:
+				n_bibs = max(0, int(rand.gauss(srv.n_bibs, srv.n_bibs / 3.0)))
+				self.send(200, stub_tei(istex_id, n_bibs), 'application/xml')
+		finally:
+			with srv.lock:
+				srv.inflight -= 1
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		if url.path in ('', '/'):
+			self.send(200, b"grobid stub", 'text/plain')
+		elif url.path == '/modelsProperties':
+			self.send(200, self.MODELS, 'application/xml')
+		elif url.path == '/processReferencesViaUrl':
+			pdf_url = parse_qs(url.query).get('pdf_url', [''])[0]
+			# .../<ID>/fulltext/pdf
+			self.process(pdf_url.split('/')[-3] if pdf_url.count('/') >= 3 else '0' * 40)
+		else:
+			self.send(404, b"", 'text/plain')
+
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		if urlparse(self.path).path != '/processReferences':
+			self.send(404, b"", 'text/plain')
+			return
+		# filename="<ID>.pdf" dans l'en-tête de la partie multipart
+		name_at = body.find(b'filename="')
+		istex_id = body[name_at+10:name_at+50].decode('ascii', 'replace') if name_at >= 0 else '0' * 40
+		if b"%PDF" not in body:
+			self.send(500, b"no pdf in request", 'text/plain')
+			return
+		self.process(istex_id)
+
+
+def start_api(port=0, route='document', n_docs=10000, pdf_size=200000, page_delay=0.0):
+	"""
+	Starts the API stub in a daemon thread => the server (port: .server_port)
+	"""
+	srv = StubServer(('127.0.0.1', port), ApiHandler)
+	srv.route = route
+	srv.n_docs = n_docs
+	srv.pdf_size = pdf_size
+	srv.page_delay = page_delay
+	Thread(target=srv.serve_forever, daemon=True).start()
+	return srv
+
+
+def start_grobid(port=0, latency='lognormal:0.5,0.5', error_rate=0.0, n_bibs=30,
+                 slots=8, seed=1):
+	"""
+	Starts the grobid stub in a daemon thread => the server (port: .server_port)
+	"""
+	srv = StubServer(('127.0.0.1', port), GrobidHandler)
+	srv.latency = parse_latency(latency)
+	srv.error_rate = error_rate
+	srv.n_bibs = n_bibs
+	srv.slots = slots
+	srv.rand = Random(seed)
+	srv.lock = Lock()
+	srv.inflight = 0
+	Thread(target=srv.serve_forever, daemon=True).start()
+	return srv
+
+
+def main():
+	parser = ArgumentParser(description="Stub ISTEX API or grobid-service for offline benchmarks")
+	parser.add_argument('stub', choices=['api', 'grobid'])
+	parser.add_argument('--port', type=int, required=True)
+	parser.add_argument('--n_docs', type=int, default=10000, help="api: number of hits")
+	parser.add_argument('--pdf_size', type=int, default=200000, help="api: bytes per PDF")
+	parser.add_argument('--page_delay', type=float, default=0.0, help="api: seconds per page of hits")
+	parser.add_argument('--latency', default='lognormal:0.5,0.5', help="grobid: latency distribution (cf. parse_latency)")
+	parser.add_argument('--error_rate', type=float, default=0.0, help="grobid: fraction of 500 answers")
+	parser.add_argument('--n_bibs', type=int, default=30, help="grobid: mean biblStruct per document")
+	parser.add_argument('--slots', type=int, default=8, help="grobid: max simultaneous requests (then 503)")
+	args = parser.parse_args()
+
+	if args.stub == 'api':
+		srv = start_api(args.port, n_docs=args.n_docs, pdf_size=args.pdf_size,
+		                page_delay=args.page_delay)
+	else:
+		srv = start_grobid(args.port, args.latency, args.error_rate, args.n_bibs, args.slots)
+	print("%s stub on 127.0.0.1:%i" % (args.stub, srv.server_port), file=stderr)
+	try:
+		while True:
+			sleep(3600)
+	except KeyboardInterrupt:
+		srv.shutdown()
+
+
+if __name__ == "__main__":
+	main()
@@ -13,29 +13,84 @@ __status__    = "Integration"
 
 # TODO search with proxy transmettre params de conf => gro
 from sys             import argv, stderr
-from os              import path, mkdir, remove
+from os              import path, mkdir, remove, getpid
 from argparse        import ArgumentParser, RawDescriptionHelpFormatter
 from configparser    import ConfigParser
 from tempfile        import NamedTemporaryFile
-from re              import sub, search, compile, MULTILINE
+from re              import sub
 from json            import loads, dumps
 
 from urllib.parse    import quote
 from urllib.request  import urlopen
-from urllib.error    import HTTPError, URLError
+from urllib.error    import URLError
 
 # Pool pour le traitement multitache lui-même
 from multiprocessing import Pool
 
-# + Value et Lock et c_int pour le compteur global
-from multiprocessing import Value, Lock
-from ctypes          import c_int
+# + Lock pour l'enregistrement des résultats
+from multiprocessing import Lock
 
 from datetime        import datetime
+from array           import array
+from itertools       import chain
 from lxml            import etree    # pour lecture des infos de modèles
 
-# for identification of empty returns
-void_listBibl = compile(r"<listBibl>[\n\s]+</listBibl>", MULTILINE)
+# mode asynchrone: 1 seul processus + connexions keep-alive
+from libbibget       import aio_dispatch
+
+# journal des documents finis (pour --resume)
+from libbibget       import journal
+
+# mode flux: pagination API et workers en parallèle
+from libbibget       import streaming
+
+# liste compacte des IDs à traiter (20 octets par ID)
+from libbibget.idstore import IdStore
+
+# répartition des requêtes sur un ou plusieurs grobid-service
+from libbibget.balancer import Balancer, Backend, parse_backends
+
+# limite adaptative du nombre de requêtes simultanées
+from libbibget.concurrency import AIMDLimiter
+
+# mode upload: cache local des PDF et préchargement
+from libbibget.pdfcache import PdfCache, prefetch
+
+# sortie groupée (-g) écrite au fil de l'eau
+from libbibget       import teicorpus
+
+# sous-dossiers AB/CD/ pour les fichiers TEI individuels
+from libbibget.layout  import shard_path
+
+# résultats déjà obtenus avec les mêmes modèles
+from libbibget.resultcache import ResultCache
+
+# nouvelles tentatives selon le type d'erreur
+from libbibget.retry   import RetryPolicies, PdfError, classify_status, classify_exception, describe
+
+# requêtes grobid (aussi utilisables comme bibliothèque)
+from libbibget.extract import Extractor, upload_pdf_size
+
+# post-traitement TEI en une passe, écrit directement dans le fichier
+from libbibget.teistream import TeiFileSink
+
+# sortie optionnelle des refbibs en JSON lines (1 ligne par biblStruct)
+from libbibget.refbibs import RefbibShards, bib_records
+
+# débit, latences, erreurs et ETA mesurés pendant le run
+from libbibget.telemetry import Telemetry
+
+# 1 ligne par document (durées, tailles) + durée moyenne qui en découle
+from libbibget.ledger  import Ledger, MeanCost, find_ledger
+
+# ordonnancement optionnel: les plus gros PDF d'abord
+from libbibget.schedule import longest_first, hit_size, SIZE_INDICATORS
+
+# débit max vers l'API ISTEX (requêtes/s, octets/s), commun aux processus
+from libbibget.ratelimit import RateLimiter, default_state_path, read_limited
+
+# mode lot (-b): plusieurs requêtes/listes en un seul run, sorties par job
+from libbibget       import batch
 
 def my_parse_args():
 	"""Preparation du hash des arguments ligne de commande pour main()"""
@@ -68,6 +123,13 @@ An ISTEX client for grobid-service, the bibliographical annotator.
 		required=False,
 		action='store')
 	
+	parser.add_argument('-b','--batch',
+		metavar='jobs_manifest.ini',
+		help="an alternative input: a manifest of several jobs (one [section] per job with a lucene query 'q' or an ID list 'list', and optional 'maxi' and 'out' dir), processed together in one run then split back per job",
+		type=str,
+		required=False,
+		action='store')
+	
 	parser.add_argument('-m','--maxi',
 		metavar='100',
 		help="a maximum limit of processed docs (if the query returned more hits, the remainder will be ignored)",
@@ -102,27 +164,70 @@ An ISTEX client for grobid-service, the bibliographical annotator.
 		required=False,
 		action='store_true') # bool
 	
+	parser.add_argument('-a', '--async_mode',
+		help="dispatch all grobid requests from a single asyncio process over a pool of keep-alive connections (size: 'async-conns' in config) instead of the process pool",
+		default=False,
+		required=False,
+		action='store_true') # bool
+	
+	parser.add_argument('-r', '--resume',
+		metavar='2015-12-01_10h30-output_bibs.dir',
+		help="resume an interrupted run: reads the todo list and journal saved in this output dir and only processes the documents not done yet",
+		type=str,
+		required=False,
+		action='store')
+	
+	parser.add_argument('-f', '--retry-failed',
+		dest="retry_failed",
+		metavar='2015-12-01_10h30-output_bibs.dir',
+		help="reprocess only the documents of this earlier output dir that still failed after all their retries (its dead-letter file run.failed)",
+		type=str,
+		required=False,
+		action='store')
+	
+	parser.add_argument('-s', '--stream',
+		help="with -q: start sending documents to grobid as soon as the first page of API hits arrives (pages are fetched in a background thread through a bounded queue instead of being all gathered first)",
+		default=False,
+		required=False,
+		action='store_true') # bool
+	
 	args = parser.parse_args(argv[1:])
 	
 	# coherence checks:
 	#  we want a single input triggering option on, all the others off
 	if (bool(args.query) 
 	     + bool(args.list_in)
+	      + bool(args.batch)
+	       + bool(args.resume)
+	        + bool(args.retry_failed)
 	         + bool(args.just_print_conf) != 1):
 		print ("""ERROR
 Please choose one single input option among:
    -q 'a lucene query'
    -l an_ID_list.txt
+   -b a_jobs_manifest.ini
+   -r an_earlier_output_dir (to resume)
+   -f an_earlier_output_dir (to retry its failed documents)
 (or choose to print conf with -p or print help with -h)
 """, 
 		file=stderr)
 		exit(1)
 	
+	if args.stream and not args.query:
+		print ("ERROR: --stream only applies to the -q input option", file=stderr)
+		exit(1)
+	
 	return args
 
 
 def get(my_url):
-	"""Get remote url *that contains a json* and parse it"""
+	"""Get remote url *that contains a json* and parse it
+	
+	(à la vitesse permise par [istex-api] max-requests-per-sec et
+	 max-bytes-per-sec, cf. api_limiter)
+	"""
+	if api_limiter is not None:
+		api_limiter.acquire()
 	try:
 		remote_file = urlopen(my_url)
 		
@@ -134,7 +239,7 @@ def get(my_url):
 		# print ("ERR.info(): \n %s" % url_e.info(), file=stderr)
 		exit(1)
 	try:
-		response = remote_file.read()
+		response = read_limited(remote_file, api_limiter)
 	except httplib.IncompleteRead as ir_e:
 		response = ir_e.partial
 		print("WARN: IncompleteRead '%s' but 'partial' content has page" 
@@ -147,64 +252,57 @@ def get(my_url):
 
 
 
-def api_search(q, limit=None):
+def api_base_url(q, output="fulltext"):
 	"""
-	Get concatenated hits array from json results of a lucene query on ISTEX api.
-	(Returns a path to temporary file containing all hits)
-	
-	Keyword arguments:
-	   q       -- a lucene query
-	              ex: "hawking AND corpusName:nature AND pubdate:[1970 TO *]"
-	
-	Global var:
-	   CONF    -- dict of config sections/values as in './bib-get.ini'
-	
-	the config dict should contain at least the 2 following values:
-	   CONF['istex-api']['host']    -- ex: "api.istex.fr"
-	   CONF['istex-api']['route']   -- ex: "document"
+	Search URL on ISTEX api for a lucene query (hits with their fulltext infos)
 	
-	Output format is a parsed json with a total value and a hit list:
-	{ 'hits': [ { 'id': '21B88F4EFBA46DC85E863709CA9824DEED7B7BFC',
-				  'title': 'Recovering information borne by quanta that '
-						   'crossed the black hole event horizon'},
-				{ 'id': 'C095E6F0A43EBE3E98E2E6E17DD8775617636034',
-				  'title': 'Holographic insights and puzzles'}],
-	  'total': 2}
+	(output: champs demandés pour chaque hit, ex: "fulltext,qualityIndicators")
 	"""
-	
 	# préparation requête
 	url_encoded_lucene_query = quote(q)
 	
 	# construction de l'URL
-	base_url = 'https:' + '//' + CONF['istex-api']['host']  + '/' + CONF['istex-api']['route'] + '/' + '?' + 'q=' + url_encoded_lucene_query + '&output=' + "fulltext"
-	
+	return CONF['istex-api'].get('scheme', 'https') + ':' + '//' + CONF['istex-api']['host']  + '/' + CONF['istex-api']['route'] + '/' + '?' + 'q=' + url_encoded_lucene_query + '&output=' + output
+
+
+def api_count(q):
+	"""
+	Total number of hits for a lucene query on ISTEX api.
+	"""
 	# requête initiale pour le décompte
-	count_url = base_url + '&size=1'
+	count_url = api_base_url(q) + '&size=1'
 	json_values = get(count_url)
-	n_docs = int(json_values['total'])
-	print('%s documents trouvés' % n_docs, file=stderr)
+	return int(json_values['total'])
+
+
+def api_iter_hits(q, limit=None, n_docs=None, output="fulltext"):
+	"""
+	Generator over the hits of a lucene query on ISTEX api, page by page
+	(a page of 5000 hits is only fetched when the previous one is consumed)
+	
+	Keyword arguments:
+	   q       -- a lucene query
+	   limit   -- max number of hits (cf. --maxi)
+	   n_docs  -- total hits if already counted (otherwise counted here)
+	   output  -- fields of each hit (cf. api_base_url)
+	"""
+	base_url = api_base_url(q, output)
+	
+	if n_docs is None:
+		n_docs = api_count(q)
+		print('%s documents trouvés' % n_docs, file=stderr)
 	
 	# limitation éventuelle fournie par le switch --maxi
 	if limit is not None:
 		n_docs = limit
 	
-	# le document temporaire renvoyé contiendra la liste des résultats
-	tempfile = NamedTemporaryFile(
-	                         mode='w', 
-	                         encoding="UTF-8",
-	                         prefix='tmp_api_hits_',
-	                         suffix='.jsonlist', 
-	                         dir=None,
-	                         delete=False   # /!\
-	                       )
-	
 	# ensuite 2 cas de figure : 1 requête ou plusieurs
 	if n_docs <= 5000:
 		# requête simple
 		my_url = base_url + '&size=%i' % n_docs
 		json_values = get(my_url)
 		for hit in json_values['hits']:
-			tempfile.write(dumps(hit)+"\n")
+			yield hit
 	
 	else:
 		# requêtes paginées pour les tailles > 5000
@@ -218,9 +316,77 @@ def api_search(q, limit=None):
 				local_counter += 1
 				# si on a une limite par ex 7500 et que k va jq'à 10000
 				if local_counter > n_docs:
-					break
+					return
 				else:
-					tempfile.write(dumps(hit)+"\n")
+					yield hit
+
+
+def hit_has_pdf(hit):
+	"""
+	Vérification s'il y a du PDF dans les infos fulltext d'un hit
+	"""
+	for file_meta in hit['fulltext']:
+		if file_meta['extension'] == 'pdf':
+			return True
+	return False
+
+
+def stream_pdf_ids(q, limit=None, n_docs=None):
+	"""
+	Generator of the ids of the hits that have a pdf (for --stream)
+	
+	(tourne dans le thread producteur: le bilan est affiché en fin de flux)
+	"""
+	n_got = 0
+	n_sans_pdf = 0
+	for hit in api_iter_hits(q, limit, n_docs):
+		n_got += 1
+		if hit_has_pdf(hit):
+			yield hit['id']
+		else:
+			n_sans_pdf += 1
+	
+	print("%s récupérés\n  dont %s sans pdf" % 
+		  (n_got,           n_sans_pdf), file=stderr)
+
+
+def api_search(q, limit=None, output="fulltext"):
+	"""
+	Get concatenated hits array from json results of a lucene query on ISTEX api.
+	(Returns a path to temporary file containing all hits)
+	
+	Keyword arguments:
+	   q       -- a lucene query
+	              ex: "hawking AND corpusName:nature AND pubdate:[1970 TO *]"
+	
+	Global var:
+	   CONF    -- dict of config sections/values as in './bib-get.ini'
+	
+	the config dict should contain at least the 2 following values:
+	   CONF['istex-api']['host']    -- ex: "api.istex.fr"
+	   CONF['istex-api']['route']   -- ex: "document"
+	
+	Output format is a parsed json with a total value and a hit list:
+	{ 'hits': [ { 'id': '21B88F4EFBA46DC85E863709CA9824DEED7B7BFC',
+				  'title': 'Recovering information borne by quanta that '
+						   'crossed the black hole event horizon'},
+				{ 'id': 'C095E6F0A43EBE3E98E2E6E17DD8775617636034',
+				  'title': 'Holographic insights and puzzles'}],
+	  'total': 2}
+	"""
+	
+	# le document temporaire renvoyé contiendra la liste des résultats
+	tempfile = NamedTemporaryFile(
+	                         mode='w', 
+	                         encoding="UTF-8",
+	                         prefix='tmp_api_hits_',
+	                         suffix='.jsonlist', 
+	                         dir=None,
+	                         delete=False   # /!\
+	                       )
+	
+	for hit in api_iter_hits(q, limit, output=output):
+		tempfile.write(dumps(hit)+"\n")
 	
 	# cache file now contains one json hit (id + fulltext infos) per line
 	tempfile.close()
@@ -229,6 +395,25 @@ def api_search(q, limit=None):
 
 
 
+def api_sizes_for_ids(ids, indicator='pdfPageCount', batch_size=100):
+	"""
+	Size indicators of known ids, asked to ISTEX api by batches
+	(for the scheduler when the ids don't come from a search, cf. -l)
+	
+	Returns an array of sizes aligned with ids (-1 if unknown)
+	"""
+	sizes = array('l')
+	for chunk in ids.chunks(batch_size):
+		chunk_sizes = {}
+		batch_url = (api_base_url("id:(%s)" % " OR ".join(chunk),
+		                          "qualityIndicators")
+		             + '&size=%i' % len(chunk))
+		for hit in get(batch_url)['hits']:
+			chunk_sizes[hit['id'].upper()] = hit_size(hit, indicator)
+		sizes.extend(chunk_sizes.get(istex_id, -1) for istex_id in chunk)
+	return sizes
+
+
 def seconds_to_pstr(sec):
 	"""
 	seconds => human readable delay string
@@ -277,7 +462,7 @@ def seconds_to_pstr(sec):
 
 
 
-def grobid_models_info():
+def grobid_models_info(gb_base_url):
 	"""
 	Returns human readable string about grobid's CRF models.
 	
@@ -289,16 +474,13 @@ def grobid_models_info():
 	(and in the header of the teiCorpus if -g)
 	"""
 	
-	properties_url = "http://%s:%s/modelsProperties" % (
-	      CONF['grobid-service']['host'],
-	      CONF['grobid-service']['port'],
-	      )
+	properties_url = "%s/modelsProperties" % gb_base_url
 	try:
 		properties = urlopen(properties_url)
 		xml_response = properties.read()
 	except Exception as e:
 		# print("Grobid's models info couldn't be retrieved (just used for logging)", file=stderr)
-		return "NO SPECIFIC INFO ABOUT CRF MODELS"
+		return ["NO SPECIFIC INFO ABOUT CRF MODELS"]
 	
 	tree = etree.fromstring(xml_response)
 	my_infos = []
@@ -312,6 +494,91 @@ def grobid_models_info():
 	model_names = sorted(my_infos, reverse=True)
 	return model_names
 
+def tei_path(istex_id):
+	"""
+	Path of the individual output file of a document
+	
+	(à plat dans outdir ou bien dans des sous-dossiers d'après le début
+	 de l'ID si shard_levels > 0, ex: outdir/AB/CD/ABCD...refbibs.tei.xml)
+	"""
+	return shard_path(outdir, istex_id, CONF['output']['tei_ext'],
+	                  int(CONF['output'].get('shard_levels', 0)))
+
+
+def tei_sink(istex_id):
+	"""
+	SORTIE > fichier tei individuel  ID.refbibs.tei.xml
+	
+	Returns a TeiFileSink: the grobid answer is post-processed in one
+	pass over its bytes as it comes, straight into the file
+	(écrit d'abord un .part puis renommé: un fichier TEI présent est
+	 toujours complet, ce qui permet de s'y fier pour --resume)
+	"""
+	return TeiFileSink(tei_path(istex_id), istex_id)
+
+
+def save_result(istex_id, result, stats=None, to_cache=True):
+	"""
+	Raw grobid answer => result cache + individual TEI file
+	                     (+ refbibs JSON lines if refbibs_shards)
+	
+	(+ tailles pour le ledger dans stats si fourni)
+	"""
+	if to_cache and result_cache is not None:
+		result_cache.put(istex_id, result)
+	sink = tei_sink(istex_id)
+	sink.begin()
+	sink.feed(result)
+	if refbib_shards is not None:
+		# (la TEI brute: 1 seul parsing, dans le worker)
+		# NB: avant le commit de la TEI, que --resume prend pour "fait":
+		#     un arrêt entre les deux donne au pire des doublons
+		try:
+			refbib_shards.write_doc(istex_id, bib_records(istex_id, result))
+		except etree.XMLSyntaxError as e:
+			print("WARN: refbibs JSON: TEI illisible pour %s (%s)" % (istex_id, e), file=stderr)
+		except:
+			sink.abort()
+			raise
+	sink.commit(stats)
+
+
+def record_result(istex_id, failure=None, stats=None):
+	"""
+	Bookkeeping for each finished document (in the main process only,
+	but possibly from several threads, cf. serve_from_cache)
+	  - ligne OK ou ERR dans le journal du run
+	    (+ dead-letter run.failed si échec après toutes les tentatives)
+	  - ajout au teiCorpus si -g
+	  - télémétrie (débit, latences, erreurs)
+	  - ligne du ledger si [ledger] format
+	
+	failure -- None if ok, else (err_class, err_info)
+	stats   -- optional measures of the last try (cf. Telemetry.record)
+	"""
+	with results_lock:
+		if failure is None:
+			run_journal.done(istex_id)
+		else:
+			run_journal.failed(istex_id, failure[1], failure[0])
+		if corpus_writer is not None:
+			add_to_corpus(istex_id)
+		telemetry.record(None if failure is None else failure[0], stats)
+		if run_ledger is not None:
+			run_ledger.write(istex_id, failure, stats)
+
+
+def add_to_corpus(istex_id):
+	"""
+	Appends a document to the teiCorpus (-g), as an empty <TEI/> if absent
+	"""
+	this_path = tei_path(istex_id)
+	if path.exists(this_path):
+		corpus_writer.add_file(istex_id, this_path)
+	else:
+		corpus_writer.add_empty(istex_id)
+
+
 def get_grobid_bibs_on_api_docs(istex_id):
 	"""
 	Calls grobid-service GET route /processReferencesViaUrl?pdf_url= allowing to process remote PDFs (eg from istex api)
@@ -322,68 +589,130 @@ def get_grobid_bibs_on_api_docs(istex_id):
 	Unique non-kw argument:
 	   istex_id  -- ex:21B88F4EFBA46DC85E863709CA9824DEED7B7BFC
 	
-	Returns the TEI generated by grobid-service annotator
+	(in upload mode: POSTs the PDF itself to /processReferences instead,
+	 from the local pdf cache if there is one)
+	
+	Failed tries are retried according to the policy of their error
+	class (cf. [retry] in config), after a randomized exponential delay
+	(cf. libbibget.extract.Extractor.process)
+	
+	Writes the TEI generated by grobid-service annotator
+	and returns a tuple (istex_id, failure, stats) for the journal
+	(failure is None if ok, else (err_class, err_info) ;
+	 stats: measures of the last try, + 'tries', 'worker', sizes)
+	
+	(sans cache de résultats ni refbibs JSON, la réponse n'est jamais
+	 entière en mémoire: elle va de la socket au fichier TEI, cf. tei_sink)
+	"""
+	sink = None
+	if result_cache is None and refbib_shards is None:
+		sink = tei_sink(istex_id)
+	(istex_id, result, failure, stats) = extractor.process(istex_id, sink)
+	stats['worker'] = getpid()
+	try:
+		if failure is None and sink is None:
+			save_result(istex_id, result, stats)
+		elif failure is None:
+			sink.commit(stats)
+		elif sink is not None:
+			sink.abort()
+	except Exception as e:
+		# rien ne doit tuer le worker du Pool
+		failure = ('other', "error (%s)" % e)
+	return (istex_id, failure, stats)
+
+
+
+def on_async_result(istex_id, status, content, err=None, stats=None):
 	"""
+	Callback of the asyncio dispatcher (--async_mode) for each document
+	(after its last try, in the dispatcher's writer thread)
 	
-	# ID => PDF URL sur l'api
-	the_pdf_url = "https://%s/%s/%s/fulltext/pdf" % (
-	          CONF['istex-api']['host'], 
-	          CONF['istex-api']['route'],
-	          istex_id
-	         )
+	(même traitement que get_grobid_bibs_on_api_docs après la réponse)
+	"""
+	failure = None
+	if stats is not None:
+		stats['status'] = status
+		if content is not None:
+			stats['bytes_in'] = len(content)
+		if upload_mode and stats.get('bytes_out'):
+			stats['pdf_bytes'] = upload_pdf_size(istex_id, stats['bytes_out'])
+	if err is not None:
+		err_class = classify_exception(err)
+		failure = (err_class, str(err) if isinstance(err, PdfError)
+		                      else "%s error (%s)" % (err_class, describe(err)))
+	elif status != 200:
+		failure = (classify_status(status), "HTTP %s" % status)
+	else:
+		try:
+			save_result(istex_id, content, stats)
+		except Exception as e:
+			failure = ('other', "error (%s)" % e)
 	
-	# route pour interroger grobid
-	grobid_base = "http://%s:%s/%s" % (
-	          CONF['grobid-service']['host'], 
-	          CONF['grobid-service']['port'], 
-	          CONF['grobid-service']['route']
-	          )
+	if failure is not None:
+		print ("%s on %s: skip" % (failure[1], istex_id), file=stderr)
 	
-	# requête à envoyer à grobid
-	get_tei_url = "%s?pdf_url=%s" % (grobid_base, the_pdf_url)
+	record_result(istex_id, failure, stats)
+
+
+def serve_from_cache(ids):
+	"""
+	Passes through the ids without a cached result for the current models
 	
-	try:
-		# interrogation ============================
-		grobid_answer_content = urlopen(get_tei_url)
-		# ==========================================
-		
-		# urlopen a renvoyé un objet file-like
-		result = grobid_answer_content.read()
-		grobid_answer_content.close()
-		result_tei = result.decode('UTF-8')
-		
-		# --- post-traitements optionels sur chaque TEI ---------->8-----
-		# on simplifie l'entête avant d'écrire le fichier
-		if len(result_tei) and not search(void_listBibl, result_tei):
-			result_tei = sub('<TEI xmlns="http://www.tei-c.org/ns/1.0" xmlns:xlink="http://www.w3.org/1999/xlink" \n xmlns:mml="http://www.w3.org/1998/Math/MathML">', 
-			                    '<TEI xml:id="istex-%s">' % istex_id,
-			                    result_tei)
-			
-			# on simplifie l'indentation
-			result_tei = sub("\t", " ", result_tei)
-		# tei vide de bibs
+	(les autres sont écrits et journalisés tout de suite, sans grobid)
+	"""
+	for istex_id in ids:
+		cached = result_cache.get(istex_id)
+		if cached is None:
+			yield istex_id
 		else:
-			# si 0 refbibs trouvées on ferme la balise TEI tout de suite
-			result_tei = '<TEI xml:id="istex-%s"/>' % istex_id
-		# -------------------------------------------------------->8-----
-		
-		# SORTIE > fichier tei individuel  ID.refbibs.tei.xml
-		out_path = path.join(
-							outdir,
-							istex_id + CONF['output']['tei_ext']
-						)
-		out_file = open(out_path, 'w')
-		out_file.write(result_tei)
-		out_file.close()
-		
-	except HTTPError as e:
-		print ("HTTP error %s on %s: skip" % (e.code, istex_id),
-		        file=stderr)
+			stats = {'cached': True}
+			save_result(istex_id, cached, stats, to_cache=False)
+			record_result(istex_id, stats=stats)
+
+
+def corpus_source_infos(args, n_docs, job=None):
+	"""
+	Origin of the documents, for the teiCorpus header
 	
-	# ++ shared counter with lock
-	increment()
-	if counter.value%500 == 0:
-		print("done: %i" % counter.value)
+	(job: en mode lot, le teiCorpus d'un job)
+	"""
+	if job is not None:
+		return "%s documents obtenus par le job '%s' d'un lot (%s)" % (n_docs, job.name, job.source())
+	elif args.list_in:
+		return "%s documents obtenus par liste d'identifiants préparé (sous %s)" % (n_docs, args.list_in)
+	elif args.resume or args.retry_failed:
+		return "%s documents obtenus par reprise du run %s" % (n_docs, args.resume or args.retry_failed)
+	else:
+		return "%s documents obtenus par requête sur l'API ISTEX (q=%s)" % (n_docs, args.query)
+
+
+def corpus_header(timestamp, model_names, source_infos):
+	"""
+	teiCorpus header for -g (one for all documents)
+	"""
+	model_infos = "models:" + "/".join(model_names)
+	return """<?xml version="1.0" encoding="UTF-8" ?>
+<teiCorpus xml:id="%s">
+ <teiHeader type="corpus">
+  <fileDesc>
+   <titleStmt>
+    <respStmt>
+     <resp>Extraction Refbib</resp>
+     <name>
+       grobid.v.0.3.4 (via bib-get.py v.%s)
+       %s
+     </name>
+    </respStmt>
+    <extent>%s</extent>
+   </titleStmt>
+   <publicationStmt>
+    <distributor>ISTEX</distributor>
+   </publicationStmt>
+  </fileDesc>
+ </teiHeader>""" % ("refbibs-enrich-"+timestamp,
+                    __version__,
+                    model_infos, source_infos)
 
 
 ########################################################################
@@ -414,96 +743,399 @@ if __name__ == '__main__':
 		exit(0)
 	
 	# -- vérification de l'existence de lieux de sortie ------------
-	timestamp = datetime.now().strftime("%Y-%m-%d_%Hh%M")
-	
-	outdir = "%s-%s" % (timestamp, CONF['output']['dir'])
-	if not path.isdir(outdir):
-		print ("Création du dossier de sortie '%s'." % outdir, file=stderr)
-		mkdir(outdir)
+	resume_stream = None
+	if args.resume or args.retry_failed:
+		# reprise: on réutilise le dossier (et son timestamp)
+		outdir = (args.resume or args.retry_failed).rstrip('/')
+		if not path.isfile(path.join(outdir, journal.TODO_NAME)):
+			print ("ERROR: '%s' n'est pas un dossier de sortie reprenable (pas de %s)" % (outdir, journal.TODO_NAME), file=stderr)
+			exit(1)
+		print ("Reprise dans le dossier de sortie '%s'." % outdir, file=stderr)
+		timestamp = sub("-%s$" % CONF['output']['dir'], "", path.basename(outdir))
+		# run en mode flux arrêté avant la fin du flux: run.todo incomplet
+		stream_state = journal.read_stream_state(outdir)
+		if stream_state is not None and not stream_state['complete']:
+			if args.resume:
+				resume_stream = stream_state
+				print ("Flux interrompu (q=%s): la pagination sera reprise." % stream_state['q'], file=stderr)
+			else:
+				print ("WARN: le flux de ce run n'a pas été lu jusqu'au bout: seuls les échecs sont relancés (-r pour finir le flux)", file=stderr)
+	else:
+		timestamp = datetime.now().strftime("%Y-%m-%d_%Hh%M")
+		
+		outdir = "%s-%s" % (timestamp, CONF['output']['dir'])
+	
+	# -- mode lot: les jobs du manifeste ou ceux du run repris -----
+	#  (sorties des jobs sans 'out': <timestamp>-jobs/<nom du job>, à côté
+	#   de outdir et non dedans: les lecteurs récursifs de outdir, comme
+	#   le resolver, ne doivent pas voir les TEI des jobs en double)
+	jobs = None
+	if args.batch:
+		try:
+			jobs = batch.read_manifest(args.batch, "%s-jobs" % timestamp)
+		except (ValueError, OSError) as err:
+			print ("ERROR: manifeste '%s' invalide: %s" % (args.batch, err), file=stderr)
+			exit(1)
+		print ("Lot de %i jobs: %s" % (len(jobs), ", ".join(job.name for job in jobs)), file=stderr)
+	elif (args.resume or args.retry_failed) and batch.has_jobs(outdir):
+		jobs = batch.read_jobs(outdir)
+		print ("Reprise d'un lot de %i jobs." % len(jobs), file=stderr)
+	
+	if not (args.resume or args.retry_failed):
+		if not path.isdir(outdir):
+			print ("Création du dossier de sortie '%s'." % outdir, file=stderr)
+			mkdir(outdir)
 	
 	outfile = None
+	corpus_writer = None
+	
+	# -- politesse envers l'API ISTEX -------------------------------
+	#  (pages de hits et PDF du mode upload; les requêtes grobid ne sont
+	#   pas limitées. Budget commun à tous les processus qui utilisent le
+	#   même fichier d'état: workers du Pool, autres bib-get, libconsulte)
+	apicf = CONF['istex-api']
+	api_limiter = None
+	max_rps = float(apicf.get('max-requests-per-sec') or 0)
+	max_bps = float(apicf.get('max-bytes-per-sec') or 0)
+	if max_rps or max_bps:
+		api_limiter = RateLimiter(apicf.get('ratelimit-file') or default_state_path(apicf['host']),
+		                          rate=max_rps, bytes_rate=max_bps)
+		print("Débit vers l'API limité à %s requêtes/s et %s octets/s (état partagé: '%s')."
+		      % (max_rps or "∞", int(max_bps) or "∞", api_limiter.state_path), file=stderr)
+	
+	# refbibs en JSON lines: outdir/refbibs/refbibs-XX.jsonl
+	# (NB: créé avant le Pool, chaque worker y écrit directement)
+	refbib_shards = None
+	if int(CONF['output'].get('refbibs_shards', 0)) > 0:
+		refbib_shards = RefbibShards(path.join(outdir, 'refbibs'),
+		                             int(CONF['output']['refbibs_shards']))
 	if args.group_output:
-		outfile = "%s-%s" % (timestamp, CONF['output']['corpusfile'])
-		print ("Fichier groupé de sortie: '%s'." % outdir, file=stderr)
+		# compression optionnelle (zstd: module zstandard)
+		corpus_compression = CONF['output'].get('corpus_compression', 'none')
+		if corpus_compression not in teicorpus.COMPRESSION_EXT:
+			print ("ERROR: corpus_compression doit être none, gzip ou zstd", file=stderr)
+			exit(1)
+		if corpus_compression == 'zstd' and teicorpus.zstandard is None:
+			print ("ERROR: corpus_compression=zstd nécessite le module zstandard (pip3 install zstandard)", file=stderr)
+			exit(1)
+		# done: ordre d'arrivée / input: passe finale dans l'ordre d'entrée
+		corpus_ordered = (CONF['output'].get('corpus_order', 'done') == 'input')
+		
+		outfile = "%s-%s%s" % (timestamp, CONF['output']['corpusfile'],
+		                       teicorpus.COMPRESSION_EXT[corpus_compression])
+		if jobs is None:
+			print ("Fichier groupé de sortie: '%s'." % outfile, file=stderr)
+		else:
+			# mode lot: 1 teiCorpus par job, écrit en fin de run
+			print ("Fichiers groupés de sortie: '%s' dans le dossier de chaque job." % outfile, file=stderr)
 	
-	# -- vérification de la connectivité avec un service grobid ----
+	# -- backends grobid et vérification de la connectivité --------
 	gbcf = CONF['grobid-service']
-	gburl = "http://%s:%s" % (gbcf['host'],gbcf['port'])
 	
-	try:
-		gb_resp = urlopen(gburl)
-		gb_resp.close()
-	except URLError as url_e:
-		print("Impossible de se connecter au service grobid. Veuillez vérifier qu'il tourne bien sur %s" % gburl)
+	# capacité par défaut: requêtes simultanées sur un backend
+	#  (en mode adaptatif: le maximum que la limite peut atteindre)
+	adaptive = (CONF['process'].get('concurrency', 'static') == 'adaptive')
+	if adaptive:
+		default_capacity = int(CONF['process'].get('adaptive-max', 32))
+	elif args.async_mode:
+		default_capacity = int(CONF['process'].get('async-conns', 100))
+	else:
+		default_capacity = int(CONF['process']['service-ncpu'])
+	
+	if 'backends' in gbcf:
+		# plusieurs grobid-service (1 par ligne: host:port [poids] [capacité])
+		backends = parse_backends(gbcf['backends'], default_capacity)
+	else:
+		backends = [Backend(gbcf['host'], gbcf['port'], 1, default_capacity)]
+	
+	# contrôle adaptatif: départ à service-ncpu puis ajustement
+	#                     selon latences et 503 (cf. concurrency.py)
+	limiter = None
+	if adaptive:
+		limiter = AIMDLimiter(
+			[b.capacity for b in backends],
+			initial = int(CONF['process']['service-ncpu']),
+			min_limit = int(CONF['process'].get('adaptive-min', 1))
+			)
+	
+	# NB: à créer avant le Pool (état partagé entre processus)
+	gb_balancer = Balancer(backends, limiter)
+	gb_balancer.probe()
+	alive = gb_balancer.alive_indices()
+	
+	if not alive:
+		print("Impossible de se connecter au service grobid. Veuillez vérifier qu'il tourne bien sur %s" % " ou ".join(b.base_url() for b in backends))
 		exit(1)
 	
-	print("Connection au service grobid sur #%s#" % gbcf['host'])
+	print("Connection au service grobid sur #%s#" % "#, #".join(backends[i].host for i in alive))
+	
+	# sondes périodiques: retrait/réintégration des backends
+	gb_balancer.start_probes(int(gbcf.get('health-probe', 30)))
+	
+	# -- mode upload et cache local des PDF ------------------------
+	upload_mode = (gbcf.get('mode', 'url') == 'upload')
+	pdf_cache = None
+	if CONF.has_section('pdf-cache') and CONF['pdf-cache'].get('dir'):
+		if upload_mode:
+			pdf_cache = PdfCache(CONF['pdf-cache']['dir'], limiter=api_limiter)
+			print("Cache local des PDF: '%s'." % CONF['pdf-cache']['dir'], file=stderr)
+		else:
+			print("WARN: le cache [pdf-cache] ne sert qu'avec mode=upload dans [grobid-service]: ignoré", file=stderr)
 	
 	# -- todo list: large ID + meta file ---------------------------
-	# (RAM: ~ 1GB for 10 millions docs)
-	ids_ok = []
+	# (RAM: 20 bytes per ID in IdStore, ~ 200MB for 10 millions docs
+	#  + the membership index if used, cf. --resume)
+	ids_ok = IdStore()
+	
+	# -- ordonnancement: ordre de l'API ou plus gros PDF d'abord -----
+	#  (taille d'après les qualityIndicators de l'API, cf. schedule.py)
+	schedule = CONF['process'].get('schedule', 'api-order')
+	size_indicator = CONF['process'].get('size-indicator', 'pdfPageCount')
+	if schedule not in ('api-order', 'longest-first'):
+		print("ERR: schedule=%s inconnu (api-order|longest-first)" % schedule, file=stderr)
+		exit(1)
+	if size_indicator not in SIZE_INDICATORS:
+		print("ERR: size-indicator=%s inconnu (%s)" % (size_indicator, "|".join(SIZE_INDICATORS)), file=stderr)
+		exit(1)
+	if schedule == 'longest-first' and args.stream:
+		print("WARN: schedule=longest-first ignoré en mode flux (--stream): il faut la liste complète", file=stderr)
+		schedule = 'api-order'
+	# tailles alignées sur ids_ok quand elles viennent de la recherche
+	ids_sizes = None
 	
-	# -- init global counter ---------------------------------------
-	counter = Value(c_int)  # defaults to 0
-	# borrowed from stackoverflow.com/questions/1233222/
-	counter_lock = Lock()
-	def increment():
-		with counter_lock:
-			counter.value += 1
+	# résultats enregistrés par le processus principal: boucle de
+	# résultats du Pool + éventuellement serve_from_cache (autre thread)
+	results_lock = Lock()
 	
 	# -- input list preparation ------------------------------------
+	#  > Mode 1bis: an ES query streams us the input IDs
+	#               (pas de liste complète en mémoire: le thread
+	#                producteur ne démarre qu'au lancement du traitement)
+	if args.query and args.stream:
+		n_found = api_count(args.query)
+		print('%s documents trouvés' % n_found, file=stderr)
+		n_docs = n_found if args.maxi is None else min(n_found, args.maxi)
+		# requête gardée pour une reprise (flux marqué complet à la fin)
+		journal.save_stream_state(outdir, args.query, args.maxi)
+		ids_todo = journal.tee_todo(
+			outdir,
+			streaming.threaded_iter(
+				stream_pdf_ids(args.query, args.maxi, n_found),
+				int(CONF['process'].get('stream-queue', 10000))
+				)
+			)
+	
 	#  > Mode 1: an ES query gets us the input IDs
-	if args.query:
-		hit_file_path = api_search(q=args.query, limit=args.maxi)
+	elif args.query:
+		if schedule == 'longest-first':
+			hit_file_path = api_search(q=args.query, limit=args.maxi,
+			                           output="fulltext,qualityIndicators")
+			ids_sizes = array('l')
+		else:
+			hit_file_path = api_search(q=args.query, limit=args.maxi)
 		
 		hit_file = open(hit_file_path)
 		
 		# on lit/vérifie les réponses et s'il y a du PDF on les garde
 		n_got = 0
-		ids_sans_pdf = []
+		n_sans_pdf = 0
 		
 		for line in hit_file:
 			n_got += 1
 			hit = loads(line)
 			mon_id = hit['id']
-			has_pdf = False
 			# vérification s'il y a du PDF ?
-			for file_meta in hit['fulltext']:
-				if file_meta['extension'] == 'pdf':
-					has_pdf = True
-					break
-			if has_pdf:
+			if hit_has_pdf(hit):
 				ids_ok.append(mon_id)
+				if ids_sizes is not None:
+					ids_sizes.append(hit_size(hit, size_indicator))
 			else:
-				ids_sans_pdf.append(mon_id)
+				n_sans_pdf += 1
 		
 		print("%s récupérés\n  dont %s sans pdf" % 
-			  (n_got,           len(ids_sans_pdf)), file=stderr)
+			  (n_got,           n_sans_pdf), file=stderr)
 		
 		# fermeture et suppression définitive du fichier tempo
 		hit_file.close()
 		remove(hit_file_path)
 	
 	#  > Mode 2: the IDs are provided on external list
-	#             (no checks)
+	#             (only checks: 40 hex chars per line)
 	elif args.list_in:
 		filehandle = open(args.list_in)
-		ids_ok = [line.rstrip() for line in filehandle]
+		ids_ok = IdStore.from_lines(
+			filehandle,
+			on_error=lambda line: print("WARN: ligne ignorée (pas un ID ISTEX): '%s'" % line, file=stderr)
+			)
 		filehandle.close()
 	
+	#  > Mode 3: resume => the IDs are those of the earlier run
+	#             (retry-failed: idem, mais seuls ceux de run.failed
+	#              seront renvoyés à grobid)
+	elif args.resume or args.retry_failed:
+		ids_ok = journal.read_todo(outdir)
+	
+	#  > Mode 4: a batch manifest => the IDs of all its jobs
+	#             (requêtes et listes résolues job par job, puis une seule
+	#              liste sans doublons pour un seul Pool)
+	elif args.batch:
+		for job in jobs:
+			if job.query is not None:
+				hit_file_path = api_search(q=job.query, limit=job.maxi or args.maxi)
+				hit_file = open(hit_file_path)
+				job.ids = IdStore(hit['id'] for hit in map(loads, hit_file)
+				                  if hit_has_pdf(hit))
+				hit_file.close()
+				remove(hit_file_path)
+			else:
+				filehandle = open(job.list_path)
+				job.ids = IdStore.from_lines(
+					filehandle,
+					on_error=lambda line: print("WARN: ligne ignorée (pas un ID ISTEX): '%s'" % line, file=stderr)
+					)
+				filehandle.close()
+				if job.maxi:
+					job.ids = job.ids[0:job.maxi]
+			print("job %s: %i documents avec pdf" % (job.name, len(job.ids)), file=stderr)
+		(ids_ok, n_total) = batch.merge_ids(jobs)
+		print("lot: %i documents dans les jobs, dont %i distincts" % (n_total, len(ids_ok)), file=stderr)
+		batch.save_jobs(outdir, jobs)
+	
+	# -- journal: what remains to be done -------------------------
+	# ids_ok   : tous les documents du run (pour le teiCorpus)
+	# ids_todo : ceux qu'il reste à envoyer à grobid
+	if args.resume:
+		(ok_ids, failed) = journal.read_journal(outdir)
+		ids_todo = IdStore(idi for idi in ids_ok
+		               if idi not in ok_ids and not path.exists(tei_path(idi)))
+		print("reprise: %i déjà faits, %i à relancer (dont %i en erreur au run précédent)" %
+		      (len(ids_ok) - len(ids_todo), len(ids_todo),
+		       len([idi for idi in ids_todo if idi in failed])), file=stderr)
+		del ok_ids
+	elif args.retry_failed:
+		(ok_ids, failed) = journal.read_journal(outdir)
+		ids_todo = IdStore(idi for idi in journal.read_dead_letter(outdir)
+		                   if idi not in ok_ids)
+		print("reprise des échecs: %i documents à relancer" % len(ids_todo), file=stderr)
+		del ok_ids
+	elif not args.stream:
+		journal.save_todo(outdir, ids_ok)
+		ids_todo = ids_ok
+	
+	# plus gros PDF d'abord: la fin du run n'a plus que des petits
+	# documents, bien répartis sur tous les workers
+	if schedule == 'longest-first' and len(ids_todo):
+		if ids_sizes is None or ids_todo is not ids_ok:
+			# -l, reprise...: tailles demandées à l'API par lots
+			print("ordonnancement: lecture des %s sur l'API..." % size_indicator, file=stderr)
+			ids_sizes = api_sizes_for_ids(ids_todo, size_indicator)
+		ids_todo = longest_first(ids_todo, ids_sizes)
+		print("ordonnancement: plus gros documents d'abord (%s, %i tailles inconnues)"
+		      % (size_indicator, ids_sizes.count(-1)), file=stderr)
+		del ids_sizes
+	
+	# reprise d'un flux interrompu: run.todo n'en a qu'une partie
+	#  => la pagination est refaite, sans les IDs déjà dans run.todo
+	#     (ajoutés ensuite à run.todo au fil de l'eau, comme en -s)
+	ids_stream_rest = None
+	if resume_stream is not None:
+		n_found = api_count(resume_stream['q'])
+		n_expected = n_found if resume_stream['maxi'] is None else min(n_found, resume_stream['maxi'])
+		print("reprise du flux: %i IDs déjà reçus sur ~%i attendus" % (len(ids_ok), n_expected), file=stderr)
+		ids_stream_rest = journal.tee_todo(
+			outdir,
+			streaming.threaded_iter(
+				(idi for idi in stream_pdf_ids(resume_stream['q'], resume_stream['maxi'], n_found)
+				     if idi not in ids_ok),
+				int(CONF['process'].get('stream-queue', 10000))
+				),
+			append=True
+			)
+	
+	run_journal = journal.RunJournal(outdir, new_dead_letter=bool(args.retry_failed))
+	
+	# -- ledger: 1 ligne par document (durées, tailles) -------------
+	#  + durée moyenne par document pour l'estimation du temps de traitement,
+	#    d'après les ledgers d'autres runs (cost-from) et celui
+	#    de ce run en cas de reprise
+	ldcf = CONF['ledger'] if CONF.has_section('ledger') else {}
+	cost_sources = (ldcf.get('cost-from') or "").split()
+	if find_ledger(outdir):
+		cost_sources.append(find_ledger(outdir))
+	mean_cost = MeanCost.from_ledgers(cost_sources) if cost_sources else None
+	run_ledger = None
+	if ldcf.get('format', 'none') not in ('', 'none'):
+		run_ledger = Ledger(outdir, ldcf['format'])
+	
+	# -- nouvelles tentatives et timeouts ---------------------------
+	retry_policies = RetryPolicies()
+	request_timeout = None
+	if CONF.has_section('retry'):
+		retry_policies = RetryPolicies.from_config(CONF['retry'])
+		if CONF['retry'].get('request-timeout'):
+			request_timeout = float(CONF['retry']['request-timeout'])
+	
+	# requêtes grobid avec leurs tentatives (hérité par les workers du Pool)
+	#  NB: le cache des résultats est géré à part (serve_from_cache et
+	#      save_result) pour que les TEI servies par le cache soient écrites
+	#      sans passer par les workers
+	extractor = Extractor(
+		gb_balancer,
+		api_host = CONF['istex-api']['host'],
+		api_route = CONF['istex-api']['route'],
+		api_scheme = CONF['istex-api'].get('scheme', 'https'),
+		route = gbcf['route'],
+		mode = 'upload' if upload_mode else 'url',
+		upload_route = gbcf.get('upload-route', 'processReferences'),
+		pdf_cache = pdf_cache,
+		api_limiter = api_limiter,
+		retry = retry_policies,
+		timeout = request_timeout
+		)
+	
 	# -- runtime details -------------------------------------------
 	
 	# basic info
-	n_docs       = len(ids_ok)
-	model_names  = grobid_models_info()
+	#  (en mode flux n_docs est déjà estimé d'après le décompte API)
+	if not args.stream:
+		n_docs   = len(ids_todo)
+	if ids_stream_rest is not None:
+		n_docs  += max(0, n_expected - len(ids_ok))
+	model_names  = grobid_models_info(gb_balancer.base_url(alive[0]))
+	
+	# cache des résultats: clé = (empreinte des modèles, ID)
+	#  => seuls les documents jamais traités avec ces modèles vont à grobid
+	#  NB: avec plusieurs backends ils doivent avoir les mêmes modèles
+	result_cache = None
+	if CONF.has_section('result-cache') and CONF['result-cache'].get('dir'):
+		if model_names == ["NO SPECIFIC INFO ABOUT CRF MODELS"]:
+			print("WARN: modèles grobid inconnus: pas de cache des résultats", file=stderr)
+		else:
+			result_cache = ResultCache(CONF['result-cache']['dir'], model_names,
+			                           gbcf['route'])
+			print("Cache des résultats: '%s'." % result_cache.base_dir, file=stderr)
 	
 	# estimated processing time = n_docs / (ncpu * avg_docs_per_sec_per_cpu)
-	estim_ptime = n_docs/(int(CONF['process']['service-ncpu']) * 1.025)
+	#  (une première estimation: le débit réel est mesuré pendant le run)
+	#  (ncpu: sum of the backends capacities if several grobid-services)
+	if 'backends' in gbcf:
+		n_gb_cpu = gb_balancer.total_capacity()
+	else:
+		n_gb_cpu = int(CONF['process']['service-ncpu'])
+	if mean_cost is not None:
+		# mieux: durée moyenne mesurée par document x n_docs / ncpu
+		estim_ptime = mean_cost.estimate(n_docs, n_gb_cpu)
+		estim_basis = "d'après %i documents déjà mesurés" % mean_cost.n_rows
+	else:
+		estim_ptime = n_docs/(n_gb_cpu * float(CONF['process'].get('docs-per-sec-per-cpu', 1.025)))
+		estim_basis = "sans mesures antérieures"
 	
 	# output format details
 	out_mode = None
-	if args.group_output:
-		out_mode = "1 grand fichier groupé \n                     > %s-output_bibs.teiCorpus.xml" % timestamp
+	if args.group_output and jobs is not None:
+		out_mode = "1 fichier groupé par job \n                     > <dossier du job>/%s" % outfile
+	elif args.group_output:
+		out_mode = "1 grand fichier groupé \n                     > %s" % outfile
 	else:
 		out_mode = "1 fichier par document \n                     > %s-output_bibs_dir/* " % timestamp
 	
@@ -514,7 +1146,7 @@ if __name__ == '__main__':
 	print("-> modèles de balisage: \n    %s" % "\n    ".join(model_names))
 	print("-> type de sortie:   %s" % out_mode)
 	print('--------------------------')
-	print("TEMPS DE TRAITEMENT APPROXIMATIF: %s" % seconds_to_pstr(estim_ptime))
+	print("TEMPS DE TRAITEMENT APPROXIMATIF: %s (%s)" % (seconds_to_pstr(estim_ptime), estim_basis))
 	
 	# ask user for approval before run
 	if args.yes:
@@ -524,6 +1156,23 @@ if __name__ == '__main__':
 	
 	if utilisateur in ['y', 'Y', 'yes']:
 		
+		# teiCorpus (-g) alimenté au fil des documents finis
+		# (en mode flux le nombre de documents n'est qu'une estimation)
+		# (en mode lot: teiCorpus des jobs à la fin, cf. plus bas)
+		if args.group_output and jobs is None:
+			corpus_writer = teicorpus.TeiCorpusWriter(
+				outfile,
+				corpus_header(timestamp, model_names,
+				              corpus_source_infos(args, n_docs if args.stream or resume_stream else len(ids_ok))),
+				corpus_compression,
+				corpus_ordered
+				)
+			# reprise: d'abord les documents faits aux runs précédents
+			if args.resume or args.retry_failed:
+				for idi in ids_ok:
+					if idi not in ids_todo:
+						add_to_corpus(idi)
+		
 		# dans tous les cas: traitement de la liste ids_ok
 		
 		# lancement ################################
@@ -536,68 +1185,109 @@ if __name__ == '__main__':
 		#    seulement 2 processeurs sur la machine client, je mets
 		#    service-ncpu = 5 dans la config !!!
 		
-		# ===== get_grobid_bibs_on_api_docs()  =============
-		process_pool = Pool(int(CONF['process']['service-ncpu']))
-		process_pool.map(get_grobid_bibs_on_api_docs, ids_ok)
-		process_pool.close()
-		# ==================================================
+		# télémétrie: ligne de progression toutes les interval secondes
+		#             (+ fichiers d'état JSON et/ou Prometheus)
+		tlcf = CONF['telemetry'] if CONF.has_section('telemetry') else {}
+		telemetry = Telemetry(n_total=n_docs, window=float(tlcf.get('window', 300)))
+		telemetry.start_reporter(
+			float(tlcf.get('interval', 30)),
+			tlcf.get('json') or None,
+			tlcf.get('prometheus') or None,
+			{'run': timestamp}
+			)
+		
+		# documents déjà extraits avec les mêmes modèles: pas de grobid
+		ids_to_send = ids_todo
+		if ids_stream_rest is not None:
+			ids_to_send = chain(ids_todo, ids_stream_rest)
+		if result_cache is not None:
+			ids_to_send = serve_from_cache(ids_to_send)
+		
+		# les PDF sont téléchargés dans le cache pendant l'extraction
+		# (au plus prefetch-ahead PDF d'avance sur les requêtes grobid)
+		if pdf_cache is not None:
+			ids_to_send = prefetch(
+				ids_to_send,
+				pdf_cache,
+				extractor.pdf_url,
+				int(CONF['pdf-cache'].get('prefetch-threads', 4)),
+				int(CONF['pdf-cache'].get('prefetch-ahead', 64))
+				)
+		
+		if args.async_mode:
+			# alternative: 1 seul processus et async-conns connexions
+			#              keep-alive => autant de requêtes en vol
+			#              (à accorder avec org.grobid.max.connections)
+			# ===== aio_dispatch.run_dispatch() ================
+			aio_dispatch.run_dispatch(
+				ids_to_send,
+				extractor.target,
+				gb_balancer,
+				on_async_result,
+				extractor.upload_body if upload_mode else None,
+				request_timeout,
+				retry_policies
+				)
+			# ==================================================
+		else:
+			# ===== get_grobid_bibs_on_api_docs()  =============
+			# (autant de processus que de places sur les backends)
+			process_pool = Pool(gb_balancer.total_capacity())
+			for (istex_id, failure, stats) in process_pool.imap_unordered(
+			                    get_grobid_bibs_on_api_docs, ids_to_send):
+				record_result(istex_id, failure, stats)
+			process_pool.close()
+			# ==================================================
+		
+		run_journal.close()
+		if refbib_shards is not None:
+			refbib_shards.close()
+		if run_ledger is not None:
+			run_ledger.close()
+		telemetry.stop()
+		
+		if result_cache is not None:
+			print("cache: %i documents déjà extraits avec ces modèles (sans appel à grobid)" % result_cache.n_hits, file=stderr)
+		
+		# en mode flux la liste complète n'existe qu'une fois le flux fini
+		if args.stream or resume_stream is not None:
+			ids_ok = journal.read_todo(outdir)
+			n_docs = len(ids_ok)
 	
 	# toute autre réponse utilisateur que y, Y, yes
 	else:
 		print("Traitement annulé", file=stderr)
 		exit()
 	
-	# a posteriori: optional concatenation of XMLs >> TEICorpus
-	if args.group_output:
-		
-		model_infos = "models:" + "/".join(model_names)
-		source_infos = None
-		if args.list_in:
-			source_infos = "%s documents obtenus par liste d'identifiants préparé (sous %s)" % (n_docs, args.list_in)
-		else:
-			source_infos = "%s documents obtenus par requête sur l'API ISTEX (q=%s)" % (n_docs, args.query)
-		
-		teico = open(outfile, "w")
-		# un header pour tous
-		global_header = """<?xml version="1.0" encoding="UTF-8" ?>
-<teiCorpus xml:id="%s">
- <teiHeader type="corpus">
-  <fileDesc>
-   <titleStmt>
-    <respStmt>
-     <resp>Extraction Refbib</resp>
-     <name>
-       grobid.v.0.3.4 (via bib-get.py v.%s)
-       %s
-     </name>
-    </respStmt>
-    <extent>%s</extent>
-   </titleStmt>
-   <publicationStmt>
-    <distributor>ISTEX</distributor>
-   </publicationStmt>
-  </fileDesc>
- </teiHeader>""" % ("refbibs-enrich-"+timestamp,
-                    __version__,
-                    model_infos, source_infos)
-		print(global_header, file=teico)
-		for idi in ids_ok:
-			this_path = path.join(outdir, idi+CONF['output']['tei_ext'])
-			try:
-				this_tei = open(this_path, 'r')
-			except FileNotFoundError as fnfe:
-				# ECRITURE BALISE <TEI/> VIDE SI DOCUMENT ABSENT
-				print(" <TEI xml:id=\"istex-%s\"/>" % idi, file=teico)
-				continue
-			# COPIE SI DOCUMENT PLEIN
-			teico.write(this_tei.read())
-			this_tei.close()
-		
-		# footer
-		print("</teiCorpus>", file=teico)
-		
-		# voilà
-		teico.close()
+	# mode lot: répartition des résultats dans les dossiers des jobs
+	#  (liens vers les TEI du run, IDs du job et IDs sans TEI)
+	#  + avec -g un teiCorpus par job, dans l'ordre de ses IDs
+	if jobs is not None:
+		print("OK:")
+		for (job, n_tei, n_missing) in batch.split_results(jobs, outdir, tei_path):
+			print("  job %s: %i TEI, %i sans résultat ----> %s" % (job.name, n_tei, n_missing, job.out))
+			if args.group_output:
+				job_corpus = teicorpus.TeiCorpusWriter(
+					path.join(job.out, outfile),
+					corpus_header(timestamp, model_names,
+					              corpus_source_infos(args, len(job.ids), job)),
+					corpus_compression
+					)
+				for idi in job.ids:
+					this_path = tei_path(idi)
+					if path.exists(this_path):
+						job_corpus.add_file(idi, this_path)
+					else:
+						job_corpus.add_empty(idi)
+				job_corpus.close()
+	
+	# fin du teiCorpus (+ passe finale de tri si corpus_order=input)
+	elif args.group_output:
+		corpus_writer.close(
+			order = ids_ok,
+			header = corpus_header(timestamp, model_names,
+			                       corpus_source_infos(args, len(ids_ok)))
+			)
 		
 		print("OK:")
 		print("  teiCorpus créé avec succès ----> %s" % outfile)
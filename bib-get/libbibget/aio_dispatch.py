@@ -0,0 +1,341 @@
+#! /usr/bin/python3
+"""
+Asyncio dispatcher for grobid-service requests
+
+Alternative au Pool de processus de bib-get.py : un seul processus
+client garde un pool borné de connexions HTTP/1.1 keep-alive vers
+grobid-service et peut avoir des centaines de requêtes en vol.
+
+(stdlib uniquement: asyncio streams + un mini client HTTP/1.1)
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+import asyncio
+from sys             import stderr
+from collections     import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools       import partial
+from itertools       import islice
+from time            import time
+
+from libbibget.retry import classify_status, classify_exception, describe, is_refused
+
+
+class KeepAliveConn(object):
+	"""
+	One persistent HTTP/1.1 connection (a reader/writer stream pair)
+	"""
+	def __init__(self, reader, writer):
+		self.reader = reader
+		self.writer = writer
+		# passe à False si le serveur a répondu 'Connection: close'
+		# ou si la réponse n'était pas délimitée (lecture jusqu'à EOF)
+		self.reusable = True
+		# nombre de requêtes déjà passées sur cette connexion
+		self.n_requests = 0
+
+	async def request(self, method, target, host, body=None, headers=None):
+		"""
+		Sends one request and reads the whole response
+
+		Returns (status, headers_dict, body_bytes)
+		"""
+		lines = ["%s %s HTTP/1.1" % (method, target),
+		         "Host: %s" % host,
+		         "Connection: keep-alive"]
+		if headers:
+			for k in headers:
+				lines.append("%s: %s" % (k, headers[k]))
+		if body is not None:
+			lines.append("Content-Length: %i" % len(body))
+		head = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+		self.n_requests += 1
+
+		self.writer.write(head)
+		if body is not None:
+			self.writer.write(body)
+		await self.writer.drain()
+
+		# status line: "HTTP/1.1 200 OK"
+		status_line = await self.reader.readline()
+		if not status_line:
+			raise ConnectionResetError("connection closed by grobid-service")
+		status = int(status_line.split()[1])
+
+		# headers (noms en minuscules)
+		resp_headers = {}
+		while True:
+			line = await self.reader.readline()
+			if line in (b"\r\n", b"\n", b""):
+				break
+			k, _, v = line.decode('latin-1').partition(":")
+			resp_headers[k.strip().lower()] = v.strip()
+
+		if resp_headers.get('connection', '').lower() == 'close':
+			self.reusable = False
+
+		# corps de la réponse: 3 cas de délimitation
+		if method == 'HEAD' or status in (204, 304):
+			content = b""
+		elif resp_headers.get('transfer-encoding', '').lower() == 'chunked':
+			content = await self._read_chunked()
+		elif 'content-length' in resp_headers:
+			content = await self.reader.readexactly(
+			                      int(resp_headers['content-length']))
+		else:
+			content = await self.reader.read()
+			self.reusable = False
+
+		return (status, resp_headers, content)
+
+	async def _read_chunked(self):
+		chunks = []
+		while True:
+			size_line = await self.reader.readline()
+			size = int(size_line.split(b";")[0].strip(), 16)
+			if size == 0:
+				# trailers éventuels jusqu'à la ligne vide
+				while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+					pass
+				break
+			chunks.append(await self.reader.readexactly(size))
+			await self.reader.readline()    # CRLF après chaque chunk
+		return b"".join(chunks)
+
+	def close(self):
+		self.reusable = False
+		self.writer.close()
+
+
+class KeepAlivePool(object):
+	"""
+	Bounded pool of keep-alive connections towards one host:port
+
+	 - au plus maxconn connexions ouvertes en même temps
+	 - les connexions libres sont réutilisées (pas de handshake TCP)
+	 - une connexion cassée est jetée et remplacée à la demande
+	"""
+	def __init__(self, host, port, maxconn=100):
+		self.host = host
+		self.port = int(port)
+		self.maxconn = maxconn
+		self._idle = deque()
+		self._slots = asyncio.Semaphore(maxconn)
+
+	async def _acquire(self):
+		await self._slots.acquire()
+		if self._idle:
+			return self._idle.pop()
+		try:
+			reader, writer = await asyncio.open_connection(self.host, self.port)
+		except:
+			self._slots.release()
+			raise
+		return KeepAliveConn(reader, writer)
+
+	def _release(self, conn):
+		if conn.reusable:
+			self._idle.append(conn)
+		else:
+			conn.close()
+		self._slots.release()
+
+	async def request(self, method, target, body=None, headers=None):
+		"""
+		Returns (status, headers_dict, body_bytes) for one request
+
+		NB: si une connexion réutilisée s'avère fermée côté serveur
+		    (timeout keep-alive de jetty) on réessaye une fois sur
+		    une connexion neuve
+		"""
+		host_header = "%s:%i" % (self.host, self.port)
+		for attempt in (1, 2):
+			conn = await self._acquire()
+			fresh = (conn.n_requests == 0)
+			try:
+				answer = await conn.request(method, target, host_header,
+				                            body=body, headers=headers)
+			except (ConnectionError, asyncio.IncompleteReadError):
+				conn.close()
+				self._release(conn)
+				if fresh or attempt == 2:
+					raise
+				continue
+			except:
+				conn.close()
+				self._release(conn)
+				raise
+			self._release(conn)
+			return answer
+
+	async def get(self, target):
+		return await self.request('GET', target)
+
+	def close(self):
+		while self._idle:
+			self._idle.pop().close()
+
+
+async def _dispatch(ids, target_for_id, balancer, on_result, body_for_id=None,
+                    timeout=None, retry=None):
+	"""
+	Feeder + N workers around an asyncio.Queue
+
+	(la queue est bornée pour ne pas matérialiser toute la liste d'IDs)
+	"""
+	loop = asyncio.get_running_loop()
+	
+	# on_result (écritures disque, parsing...) hors de la boucle
+	# d'événements, dans un seul thread: un document à la fois
+	writer = ThreadPoolExecutor(max_workers=1)
+	
+	# un pool de connexions par backend, à sa capacité
+	pools = [KeepAlivePool(b.host, b.port, b.capacity) for b in balancer.backends]
+	n_workers = balancer.total_capacity()
+	todo = asyncio.Queue(maxsize=2*n_workers)
+	
+	# réveil des workers en attente quand une place se libère
+	slot_freed = asyncio.Condition()
+	
+	async def get_slot():
+		# choix du backend (attente si tous occupés ou tombés)
+		i = balancer.acquire(block=False)
+		while i is None:
+			async with slot_freed:
+				try:
+					# (timeout: les sondes peuvent aussi rendre des places)
+					await asyncio.wait_for(slot_freed.wait(), 0.5)
+				except asyncio.TimeoutError:
+					pass
+			i = balancer.acquire(block=False)
+		return i
+	
+	async def free_slot(i, latency=None, overload=False):
+		balancer.release(i, latency, overload)
+		async with slot_freed:
+			slot_freed.notify_all()
+
+	async def feeder():
+		# les ids sont tirés par lots dans un thread annexe car
+		# l'itérable peut bloquer (ex: flux de pages de l'API)
+		ids_iter = iter(ids)
+		while True:
+			batch = await loop.run_in_executor(None, list, islice(ids_iter, 64))
+			if not batch:
+				break
+			for istex_id in batch:
+				await todo.put(istex_id)
+		for i in range(n_workers):
+			await todo.put(None)
+
+	async def attempt(istex_id):
+		# un essai => (status, content, err, stats)
+		method, body, headers = 'GET', None, None
+		stats = {'latency': None, 'bytes_out': 0}
+		if body_for_id is not None:
+			# corps de la requête: dans un thread (lecture disque,
+			# voire téléchargement du PDF)
+			try:
+				body, headers = await loop.run_in_executor(None, body_for_id, istex_id)
+			except Exception as e:
+				return (None, None, e, stats)
+			method = 'POST'
+			stats['bytes_out'] = len(body)
+		i = await get_slot()
+		stats['backend'] = "%s:%i" % (balancer.backends[i].host, balancer.backends[i].port)
+		t0 = time()
+		try:
+			# interrogation ============================
+			status, resp_headers, content = await asyncio.wait_for(
+			        pools[i].request(method, target_for_id(istex_id), body, headers),
+			        timeout)
+			# ==========================================
+		except asyncio.TimeoutError as e:
+			# (avant OSError: TimeoutError en hérite depuis python 3.11)
+			await free_slot(i, overload=True)
+			return (None, None, e, stats)
+		except OSError as e:
+			# retiré si refusé ou plusieurs erreurs d'affilée
+			balancer.connect_failed(i, is_refused(e))
+			await free_slot(i)
+			return (None, None, e, stats)
+		except (asyncio.IncompleteReadError, ValueError) as e:
+			await free_slot(i)
+			return (None, None, e, stats)
+		except:
+			await free_slot(i)
+			raise
+		stats['latency'] = time() - t0
+		await free_slot(i, stats['latency'], overload=(status == 503))
+		return (status, content, None, stats)
+
+	async def worker(n):
+		while True:
+			istex_id = await todo.get()
+			if istex_id is None:
+				break
+			n_tries = 0
+			while True:
+				n_tries += 1
+				status, content, err, stats = await attempt(istex_id)
+				if retry is None:
+					break
+				err_class = classify_status(status) if err is None else classify_exception(err)
+				if err_class is None:
+					break
+				delay = retry.delay(err_class, n_tries)
+				if delay is None:
+					break
+				info = ("HTTP %s" % status) if err is None else ("%s error (%s)" % (err_class, describe(err)))
+				print("%s on %s: retry in %.1fs" % (info, istex_id, delay), file=stderr)
+				await asyncio.sleep(delay)
+			stats['tries'] = n_tries
+			stats['worker'] = "aio-%i" % n
+			await loop.run_in_executor(
+			        writer,
+			        partial(on_result, istex_id, status, content, err=err, stats=stats))
+
+	try:
+		await asyncio.gather(feeder(), *[worker(n) for n in range(n_workers)])
+	finally:
+		writer.shutdown(wait=True)
+		for pool in pools:
+			pool.close()
+
+
+def run_dispatch(ids, target_for_id, balancer, on_result, body_for_id=None,
+                 timeout=None, retry=None):
+	"""
+	Sends one request per istex_id to the grobid backends from a single process
+
+	args:
+	   ids           -- iterable of istex_ids (may block, eg a stream)
+	   target_for_id -- function istex_id => request target
+	                    (ex: "/processReferencesViaUrl?pdf_url=...")
+	   balancer      -- a libbibget.balancer.Balancer: each backend gets
+	                    a pool of keep-alive connections of its capacity
+	                    (total capacity <=> requests in flight)
+	   on_result     -- callback(istex_id, status, content, err=None, stats=None)
+	                    called for each document in a dedicated
+	                    thread (one call at a time, off the event loop)
+	                    (status and content are None if err; stats
+	                     of the last try: 'latency', 'bytes_out', 'tries',
+	                     'backend', 'worker')
+	   body_for_id   -- optional function istex_id => (body, headers)
+	                    for POST requests (ex: PDF upload), run in a
+	                    thread; its exceptions are passed to on_result
+	                    as err (GET requests without body if None)
+	   timeout       -- seconds before a request is abandoned (None: no limit)
+	   retry         -- optional libbibget.retry.RetryPolicies: failed
+	                    tries are retried after its delays and on_result
+	                    only gets the outcome of the last one
+	"""
+	asyncio.run(
+		_dispatch(ids, target_for_id, balancer, on_result, body_for_id,
+		          timeout, retry)
+	)
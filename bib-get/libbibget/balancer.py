@@ -0,0 +1,207 @@
+#! /usr/bin/python3
+"""
+Least-outstanding-requests load balancer over several grobid-service backends
+
+Chaque backend a un poids et une capacité (nombre max de requêtes en vol).
+L'état (requêtes en cours, backend vivant ou non) est en mémoire partagée
+multiprocessing, comme le compteur global de bib-get.py : il est donc
+commun à tous les processus du Pool (créé avant le fork).
+
+Format de la config (clé 'backends' de la section [grobid-service]):
+   backends=
+      vp-istex-grobid.intra.inist.fr:8080   1  9
+      vp-istex-grobid2.intra.inist.fr:8080  2  18
+   (une ligne par backend: host:port [poids] [capacité])
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from sys             import stderr
+from time            import sleep
+from threading       import Thread
+from urllib.request  import urlopen
+
+from multiprocessing import Array, Condition
+from ctypes          import c_int
+
+
+class Backend(object):
+	"""
+	One grobid-service location with its weight and capacity
+	"""
+	def __init__(self, host, port, weight=1, capacity=1):
+		self.host = host
+		self.port = int(port)
+		self.weight = float(weight)
+		self.capacity = int(capacity)
+		if self.weight <= 0 or self.capacity < 1:
+			raise ValueError("backend %s:%s: weight and capacity must be > 0" % (host, port))
+
+	def base_url(self):
+		return "http://%s:%i" % (self.host, self.port)
+
+	def __repr__(self):
+		return "%s:%i (w=%g, cap=%i)" % (self.host, self.port, self.weight, self.capacity)
+
+
+def parse_backends(backends_str, default_capacity=1):
+	"""
+	Multiline config value => list of Backend
+
+	chaque ligne: "host:port [weight] [capacity]"
+	"""
+	backends = []
+	for line in backends_str.splitlines():
+		fields = line.split()
+		if not fields or fields[0].startswith('#'):
+			continue
+		host, _, port = fields[0].rpartition(':')
+		if not host or not port.isdigit():
+			raise ValueError("backend line should start with host:port: '%s'" % line.strip())
+		weight = fields[1] if len(fields) > 1 else 1
+		capacity = fields[2] if len(fields) > 2 else default_capacity
+		backends.append(Backend(host, port, weight, capacity))
+	if not backends:
+		raise ValueError("empty backends list")
+	return backends
+
+
+class Balancer(object):
+	"""
+	Picks a backend for each request: among the live backends below their
+	capacity, the one with the least outstanding requests per unit of weight
+	
+	Avec un limiter (cf. libbibget.concurrency) la limite d'un backend
+	n'est plus sa capacité fixe mais la limite adaptative courante.
+	
+	Un backend n'est retiré qu'après down_after erreurs de connexion
+	d'affilée (sans réponse entre elles) ou tout de suite si la
+	connexion est refusée (cf. connect_failed).
+	"""
+	def __init__(self, backends, limiter=None, down_after=3):
+		self.backends = backends
+		self.limiter = limiter
+		self.down_after = down_after
+		n = len(backends)
+		self._cond = Condition()
+		# mémoire partagée (protégée par le verrou de self._cond)
+		self._outstanding = Array(c_int, n, lock=False)
+		self._alive = Array(c_int, [1]*n, lock=False)
+		# erreurs de connexion consécutives par backend
+		self._conn_errors = Array(c_int, n, lock=False)
+
+	def total_capacity(self):
+		return sum(b.capacity for b in self.backends)
+
+	def _max_inflight(self, i):
+		if self.limiter is None:
+			return self.backends[i].capacity
+		return self.limiter.limit(i)
+
+	def _pick(self):
+		best = None
+		best_load = None
+		for i, b in enumerate(self.backends):
+			if not self._alive[i] or self._outstanding[i] >= self._max_inflight(i):
+				continue
+			load = (self._outstanding[i] + 1) / b.weight
+			if best is None or load < best_load:
+				best, best_load = i, load
+		return best
+
+	def acquire(self, block=True):
+		"""
+		Reserves a slot on a backend and returns its index
+		(blocks while all backends are busy or down, unless block=False
+		 in which case None is returned)
+		"""
+		with self._cond:
+			i = self._pick()
+			while i is None and block:
+				self._cond.wait()
+				i = self._pick()
+			if i is not None:
+				self._outstanding[i] += 1
+			return i
+
+	def release(self, i, latency=None, overload=False):
+		"""
+		Frees the slot of a finished request
+		
+		   latency  -- its duration in seconds (None if no answer)
+		   overload -- True if the backend said it was overloaded (503)
+		               or timed out (for the adaptive limiter)
+		"""
+		with self._cond:
+			self._outstanding[i] -= 1
+			if latency is not None:
+				# le backend a répondu
+				self._conn_errors[i] = 0
+			if self.limiter is None:
+				self._cond.notify()
+			else:
+				self.limiter.update(i, latency, overload, self._outstanding[i])
+				# la limite a pu augmenter: on réveille tout le monde
+				self._cond.notify_all()
+
+	def connect_failed(self, i, refused=False):
+		"""
+		Counts a connection error on a backend: removed if refused or
+		after down_after consecutive errors (otherwise just retried)
+		"""
+		with self._cond:
+			self._conn_errors[i] += 1
+			if not (refused or self._conn_errors[i] >= self.down_after):
+				return
+		self.mark_down(i)
+
+	def mark_down(self, i):
+		"""
+		Removes a backend after a connection failure (re-added by probes)
+		"""
+		with self._cond:
+			if self._alive[i]:
+				print("grobid backend %r down: removed" % self.backends[i], file=stderr)
+			self._alive[i] = 0
+
+	def base_url(self, i):
+		return self.backends[i].base_url()
+
+	def alive_indices(self):
+		with self._cond:
+			return [i for i in range(len(self.backends)) if self._alive[i]]
+
+	def probe(self, timeout=5):
+		"""
+		Health check of each backend (GET on its root url)
+		  => mark removed backends that answer again as alive and vice versa
+		"""
+		for i, b in enumerate(self.backends):
+			try:
+				resp = urlopen(b.base_url(), timeout=timeout)
+				resp.close()
+				ok = 1
+			except Exception:
+				ok = 0
+			with self._cond:
+				if ok and not self._alive[i]:
+					print("grobid backend %r up: (re)added" % b, file=stderr)
+					self._conn_errors[i] = 0
+				elif self._alive[i] and not ok:
+					print("grobid backend %r down: removed" % b, file=stderr)
+				self._alive[i] = ok
+				self._cond.notify_all()
+
+	def start_probes(self, interval):
+		"""
+		Periodic probes in a daemon thread of the main process
+		"""
+		def probe_loop():
+			while True:
+				sleep(interval)
+				self.probe()
+		Thread(target=probe_loop, daemon=True).start()
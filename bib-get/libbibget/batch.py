@@ -0,0 +1,214 @@
+#! /usr/bin/python3
+"""
+Batch mode of bib-get (-b): several queries / ID lists in one run
+
+Le manifeste est un fichier INI avec une section par job:
+
+   [nature-1990]
+   q = corpusName:nature AND publicationDate:1990
+   maxi = 500
+
+   [springer-gold]
+   list = lists/springer_gold.txt
+   out = /data/nightly/springer-gold
+
+   (q: une requête lucene, ou bien list: une liste d'IDs ;
+    maxi: optionnel, par défaut -m pour une requête ; out: dossier du job,
+    par défaut <timestamp du run>-jobs/<nom du job>, hors du dossier
+    du run pour que ses lecteurs récursifs ne voient pas les TEI 2 fois ;
+    chemins relatifs: par rapport au dossier du manifeste)
+
+Les IDs de tous les jobs sont dédoublonnés en une seule liste traitée
+par un seul Pool (un document présent dans plusieurs jobs n'est envoyé
+qu'une fois à grobid), puis les résultats sont répartis par job:
+liens (durs si possible, sinon copies) vers les TEI de ses documents
+dans son dossier 'out', avec la liste de ses IDs et celle de ses
+documents sans TEI.
+
+Les jobs et leurs IDs sont gardés dans le dossier du run (batch/)
+pour que --resume et --retry-failed refassent la répartition.
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from os              import path, makedirs, link, remove
+from re              import match
+from shutil          import copyfile
+from configparser    import ConfigParser, Error as ConfigError
+
+from libbibget.idstore import IdStore
+
+BATCH_DIR = 'batch'
+JOBS_NAME = 'jobs.ini'
+
+# dans le dossier de sortie de chaque job
+JOB_IDS_NAME = 'job.ids'
+JOB_MISSING_NAME = 'job.missing'
+
+
+class Job(object):
+	"""
+	One entry of the manifest (+ its ids once resolved)
+	"""
+	def __init__(self, name, query=None, list_path=None, maxi=None, out=None):
+		self.name = name
+		self.query = query
+		self.list_path = list_path
+		self.maxi = maxi
+		self.out = out
+		self.ids = None
+
+	def source(self):
+		if self.query is not None:
+			return "q=%s" % self.query
+		return "list=%s" % self.list_path
+
+	def __repr__(self):
+		return "%s (%s)" % (self.name, self.source())
+
+
+def read_manifest(manifest_path, default_out_dir):
+	"""
+	Manifest file => list of Job (ValueError if invalid)
+
+	default_out_dir: parent of the output dirs of the jobs without 'out'
+	"""
+	manifest = ConfigParser(interpolation=None)
+	manifest_file = open(manifest_path, 'r')
+	try:
+		manifest.read_file(manifest_file)
+	except ConfigError as err:
+		raise ValueError(str(err))
+	finally:
+		manifest_file.close()
+	base_dir = path.dirname(path.abspath(manifest_path))
+
+	jobs = []
+	for name in manifest.sections():
+		if not match(r"^[\w.-]+$", name):
+			raise ValueError("job name '%s': only letters, digits, '.', '-' and '_'" % name)
+		section = manifest[name]
+		if ('q' in section) == ('list' in section):
+			raise ValueError("job '%s': needs either q or list" % name)
+		unknown = set(section.keys()) - {'q', 'list', 'maxi', 'out'}
+		if unknown:
+			raise ValueError("job '%s': unknown key(s) %s" % (name, ", ".join(sorted(unknown))))
+		list_path = None
+		if 'list' in section:
+			list_path = path.join(base_dir, section['list'])
+		if section.get('out'):
+			out = path.join(base_dir, section['out'])
+		else:
+			out = path.join(default_out_dir, name)
+		maxi = int(section['maxi']) if section.get('maxi') else None
+		jobs.append(Job(name, section.get('q'), list_path, maxi, out))
+
+	if not jobs:
+		raise ValueError("no job in manifest %s" % manifest_path)
+	return jobs
+
+
+def merge_ids(jobs):
+	"""
+	Union of the ids of all jobs (each id once, in order of first
+	appearance) => (IdStore, total number of ids in the jobs)
+	"""
+	all_ids = IdStore()
+	n_total = 0
+	for job in jobs:
+		n_total += len(job.ids)
+		for istex_id in job.ids:
+			if istex_id not in all_ids:
+				all_ids.append(istex_id)
+	return (all_ids, n_total)
+
+
+def save_jobs(outdir, jobs):
+	"""
+	Writes the jobs and their ids in the run dir (for resume)
+	"""
+	batch_dir = path.join(outdir, BATCH_DIR)
+	makedirs(batch_dir, exist_ok=True)
+	saved = ConfigParser(interpolation=None)
+	for job in jobs:
+		saved[job.name] = {'out': path.abspath(job.out)}
+		if job.query is not None:
+			saved[job.name]['q'] = job.query
+		else:
+			saved[job.name]['list'] = job.list_path
+		if job.maxi is not None:
+			saved[job.name]['maxi'] = str(job.maxi)
+		ids_file = open(path.join(batch_dir, job.name + '.ids'), 'w')
+		for istex_id in job.ids:
+			ids_file.write(istex_id + "\n")
+		ids_file.close()
+	jobs_file = open(path.join(batch_dir, JOBS_NAME), 'w')
+	saved.write(jobs_file)
+	jobs_file.close()
+
+
+def has_jobs(outdir):
+	return path.isfile(path.join(outdir, BATCH_DIR, JOBS_NAME))
+
+
+def read_jobs(outdir):
+	"""
+	Jobs saved by save_jobs, with their ids
+	"""
+	batch_dir = path.join(outdir, BATCH_DIR)
+	jobs = read_manifest(path.join(batch_dir, JOBS_NAME), batch_dir)
+	for job in jobs:
+		ids_file = open(path.join(batch_dir, job.name + '.ids'), 'r')
+		job.ids = IdStore.from_lines(ids_file)
+		ids_file.close()
+	return jobs
+
+
+def link_or_copy(src, dst):
+	"""
+	Hard link dst => src (a copy if not possible, eg another filesystem)
+	"""
+	makedirs(path.dirname(dst), exist_ok=True)
+	if path.lexists(dst):
+		remove(dst)
+	try:
+		link(src, dst)
+	except OSError:
+		copyfile(src, dst)
+
+
+def split_results(jobs, outdir, tei_path):
+	"""
+	Per-job output dirs from the shared run dir
+
+	   tei_path -- function id => TEI file of the run (cf. bib-get)
+
+	Each job dir gets its TEI files (same relative paths as in outdir),
+	job.ids and job.missing (ids without a TEI: failed or not done)
+
+	Returns a list of (job, n_tei, n_missing)
+	"""
+	summary = []
+	for job in jobs:
+		makedirs(job.out, exist_ok=True)
+		n_tei = 0
+		ids_file = open(path.join(job.out, JOB_IDS_NAME), 'w')
+		missing_file = open(path.join(job.out, JOB_MISSING_NAME), 'w')
+		n_missing = 0
+		for istex_id in job.ids:
+			ids_file.write(istex_id + "\n")
+			src = tei_path(istex_id)
+			if path.exists(src):
+				link_or_copy(src, path.join(job.out, path.relpath(src, outdir)))
+				n_tei += 1
+			else:
+				missing_file.write(istex_id + "\n")
+				n_missing += 1
+		ids_file.close()
+		missing_file.close()
+		summary.append((job, n_tei, n_missing))
+	return summary
@@ -0,0 +1,109 @@
+#! /usr/bin/python3
+"""
+Adaptive concurrency control for grobid-service requests (AIMD)
+
+Remplace le nombre fixe de requêtes simultanées (service-ncpu) par une
+limite par backend ajustée en cours de run:
+  - augmentation additive (+1 par "fenêtre" de limit réponses)
+    tant que la latence récente reste proche de la latence de base
+  - diminution multiplicative sur signal de surcharge:
+    503 / timeout => x0.5, latence récente > tolerance x base => x0.9
+    (au plus une diminution par "aller-retour" = 2 x latence récente:
+     une rafale de 503 ne compte qu'une fois)
+  - de plus un 503 ramène tout de suite la limite au nombre de requêtes
+    que le backend traitait à ce moment-là (sinon les 503, immédiats,
+    videraient la liste des docs à toute vitesse)
+
+Pas de signal "longueur de file" à part: grobid ne publie pas la
+longueur de sa file d'attente, qu'on ne voit qu'à travers la latence
+(file qui s'allonge = latence au-dessus de la base) et les 503 (file
+pleine) ; la file côté client (documents en attente d'une place) est
+toujours pleine pendant un run et ne renseigne pas sur le serveur.
+
+La limite reste entre min_limit et la capacité du backend.
+L'état est en mémoire partagée multiprocessing (comme le Balancer qui
+l'utilise, et sous le même verrou): tous les workers du Pool voient et
+ajustent la même limite.
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from sys             import stderr
+from time            import time
+
+from multiprocessing import Array
+from ctypes          import c_double
+
+
+class AIMDLimiter(object):
+	"""
+	Per-backend in-flight limit driven by latency and overload signals
+
+	(méthodes à appeler sous le verrou du Balancer)
+	"""
+	def __init__(self, capacities, initial, min_limit=1,
+	                   tolerance=2.0):
+		n = len(capacities)
+		self.capacities = capacities
+		self.min_limit = min_limit
+		self.tolerance = tolerance
+		self._limit    = Array(c_double, [float(min(max(initial, min_limit), c)) for c in capacities], lock=False)
+		# latences en secondes: moyenne mobile récente et latence de base
+		self._recent   = Array(c_double, n, lock=False)
+		self._baseline = Array(c_double, n, lock=False)
+		self._last_decrease = Array(c_double, n, lock=False)
+
+	def limit(self, i):
+		"""
+		Current max number of requests in flight on backend i
+		"""
+		return int(self._limit[i])
+
+	def update(self, i, latency=None, overload=False, inflight=0):
+		"""
+		Feeds one finished request of backend i into the controller
+
+		   latency  -- seconds (None if no answer)
+		   overload -- True on 503 or timeout
+		   inflight -- requests in flight on i when this one ended
+		               (no increase if the limit wasn't even reached)
+		"""
+		old = self.limit(i)
+
+		# (la latence d'un 503 immédiat ne dit rien du temps de traitement)
+		if latency is not None and not overload:
+			if self._recent[i] == 0:
+				self._recent[i] = self._baseline[i] = latency
+			else:
+				self._recent[i] += 0.1 * (latency - self._recent[i])
+				# base: suit les minima et remonte très lentement
+				#       (le mix de documents peut changer en cours de run)
+				self._baseline[i] = min(self._baseline[i], self._recent[i])
+				self._baseline[i] += 0.001 * (self._recent[i] - self._baseline[i])
+
+		if overload:
+			self._limit[i] = max(float(self.min_limit), min(self._limit[i], inflight))
+			self._decrease(i, 0.5)
+		elif latency is not None:
+			if self._recent[i] > self.tolerance * self._baseline[i]:
+				# la file d'attente côté serveur s'allonge
+				self._decrease(i, 0.9)
+			elif inflight + 1 >= old:
+				self._limit[i] = min(self.capacities[i],
+				                     self._limit[i] + 1.0 / self._limit[i])
+
+		if self.limit(i) != old:
+			print("concurrency: backend %i limit %i => %i (latency %.2fs, base %.2fs)"
+			      % (i, old, self.limit(i), self._recent[i], self._baseline[i]),
+			      file=stderr)
+
+	def _decrease(self, i, factor):
+		now = time()
+		if now - self._last_decrease[i] < 2 * self._recent[i]:
+			return
+		self._last_decrease[i] = now
+		self._limit[i] = max(float(self.min_limit), self._limit[i] * factor)
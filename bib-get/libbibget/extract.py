@@ -0,0 +1,390 @@
+#! /usr/bin/python3
+"""
+Importable extraction API: ISTEX ids => grobid TEI refbibs
+
+Le même traitement que bib-get.py, mais sans fichiers ni variables
+globales ni confirmation: toute la config est passée explicitement et
+les résultats sont restitués au fil de l'eau, en mémoire.
+
+Usage:
+   from libbibget.extract  import Extractor
+   from libbibget.balancer import Backend
+
+   extractor = Extractor([Backend("vp-istex-grobid.intra.inist.fr", 8080, 1, 9)],
+                         api_host="api.istex.fr")
+   for (istex_id, tei_bytes, stats) in extractor.extract(ids):
+       if tei_bytes is None:
+           print("échec:", istex_id, stats['error'])
+       ...
+
+(bib-get.py s'en sert aussi pour ses requêtes grobid)
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from sys             import stderr
+from re              import sub, search, compile, MULTILINE
+from uuid            import uuid4
+from io              import BytesIO
+from time            import time, sleep
+from threading       import current_thread
+from urllib.request  import urlopen, Request
+from urllib.error    import HTTPError
+from http.client     import IncompleteRead
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from libbibget.balancer import Balancer, parse_backends
+from libbibget.pdfcache import download_pdf
+from libbibget.retry    import RetryPolicies, PdfError, classify_status, classify_exception, describe, is_refused
+from libbibget.teistream import TeiRewriter
+
+# taille des lectures de la réponse grobid quand elle part en flux
+READ_CHUNK = 65536
+
+# for identification of empty returns (postprocess_tei)
+void_listBibl = compile(r"<listBibl>[\n\s]+</listBibl>", MULTILINE)
+
+
+def postprocess_tei(result_tei, istex_id):
+	"""
+	Post-traitements optionels sur chaque TEI renvoyée par grobid
+	  - entête <TEI> simplifiée (avec l'ID istex)
+	  - tabulations => espaces
+	  - TEI vide si aucune refbib
+
+	Implémentation de référence, plus appelée par bib-get: les workers
+	utilisent l'équivalent en une passe sur les octets (cf.
+	teistream.TeiRewriter), dont la sortie doit rester identique à
+	celle-ci (cf. test/test_teistream.py et bench/bench_postprocess.py)
+	"""
+	# on simplifie l'entête avant d'écrire le fichier
+	if len(result_tei) and not search(void_listBibl, result_tei):
+		result_tei = sub('<TEI xmlns="http://www.tei-c.org/ns/1.0" xmlns:xlink="http://www.w3.org/1999/xlink" \n xmlns:mml="http://www.w3.org/1998/Math/MathML">',
+		                    '<TEI xml:id="istex-%s">' % istex_id,
+		                    result_tei)
+
+		# on simplifie l'indentation
+		result_tei = sub("\t", " ", result_tei)
+	# tei vide de bibs
+	else:
+		# si 0 refbibs trouvées on ferme la balise TEI tout de suite
+		result_tei = '<TEI xml:id="istex-%s"/>' % istex_id
+
+	return result_tei
+
+
+def multipart_pdf(istex_id, pdf_bytes):
+	"""
+	A PDF as multipart/form-data => (body_bytes, headers_dict)
+	"""
+	boundary = "bibget-" + uuid4().hex
+	body = b"".join([
+		("--%s\r\n" % boundary).encode('ascii'),
+		('Content-Disposition: form-data; name="input"; filename="%s.pdf"\r\n' % istex_id).encode('ascii'),
+		b"Content-Type: application/pdf\r\n\r\n",
+		pdf_bytes,
+		("\r\n--%s--\r\n" % boundary).encode('ascii')
+		])
+	return (body, {'Content-Type': 'multipart/form-data; boundary=%s' % boundary})
+
+
+def upload_pdf_size(istex_id, body_size):
+	"""
+	Size of the PDF in an upload body of body_size bytes (for the ledger)
+
+	(l'enveloppe multipart a une longueur fixe pour un ID donné)
+	"""
+	return body_size - len(multipart_pdf(istex_id, b"")[0])
+
+
+class Extractor(object):
+	"""
+	grobid refbibs extraction for ISTEX documents, with explicit config
+
+	   backends     -- a libbibget.balancer.Balancer, a list of Backend,
+	                   or a backends string (cf. parse_backends)
+	   api_host     -- ISTEX api host (source PDFs)
+	   api_route    -- ISTEX api route of the documents
+	   api_scheme   -- 'https' or 'http'
+	   route        -- grobid route for PDF urls (mode='url')
+	   mode         -- 'url': grobid fetches the PDFs itself
+	                   'upload': the PDFs are POSTed to upload_route
+	   upload_route -- grobid route for POSTed PDFs (mode='upload')
+	   pdf_cache    -- optional libbibget.pdfcache.PdfCache (upload mode)
+	   api_limiter  -- optional libbibget.ratelimit.RateLimiter for the PDF
+	                   downloads of upload mode (grobid isn't limited)
+	   result_cache -- optional libbibget.resultcache.ResultCache
+	   retry        -- libbibget.retry.RetryPolicies (default policies if None)
+	   timeout      -- seconds before a grobid request is abandoned
+	   log_retries  -- print each retry/skip on stderr
+	"""
+	def __init__(self, backends, api_host='api.istex.fr', api_route='document',
+	             api_scheme='https', route='processReferencesViaUrl', mode='url',
+	             upload_route='processReferences', pdf_cache=None,
+	             api_limiter=None, result_cache=None, retry=None, timeout=None,
+	             log_retries=True):
+		if isinstance(backends, Balancer):
+			self.balancer = backends
+		elif isinstance(backends, str):
+			self.balancer = Balancer(parse_backends(backends))
+		else:
+			self.balancer = Balancer(list(backends))
+		if mode not in ('url', 'upload'):
+			raise ValueError("unknown mode '%s' (url|upload)" % mode)
+		self.api_host = api_host
+		self.api_route = api_route
+		self.api_scheme = api_scheme
+		self.route = route
+		self.mode = mode
+		self.upload_route = upload_route
+		self.pdf_cache = pdf_cache
+		self.api_limiter = api_limiter
+		self.result_cache = result_cache
+		self.retry = retry if retry is not None else RetryPolicies()
+		self.timeout = timeout
+		self.log_retries = log_retries
+
+	def pdf_url(self, istex_id):
+		"""
+		ID => PDF URL sur l'api
+		"""
+		return "%s://%s/%s/%s/fulltext/pdf" % (
+		          self.api_scheme,
+		          self.api_host,
+		          self.api_route,
+		          istex_id
+		         )
+
+	def target(self, istex_id):
+		"""
+		Path + query part of the grobid-service request for one document
+
+		ex: "/processReferencesViaUrl?pdf_url=https://api.istex.fr/document/<ID>/fulltext/pdf"
+		    "/processReferences"  (upload mode: the PDF is in the POST body)
+		"""
+		if self.mode == 'upload':
+			return "/%s" % self.upload_route
+		return "/%s?pdf_url=%s" % (self.route, self.pdf_url(istex_id))
+
+	def get_pdf(self, istex_id):
+		"""
+		PDF bytes of a document for upload mode (local cache if configured)
+
+		(toute erreur devient une PdfError: classe d'erreur 'pdf' pour les
+		 nouvelles tentatives)
+		"""
+		try:
+			if self.pdf_cache is None:
+				return download_pdf(self.pdf_url(istex_id), limiter=self.api_limiter)
+			return self.pdf_cache.fetch(istex_id, self.pdf_url(istex_id))
+		except Exception as e:
+			raise PdfError("pdf error (%s)" % e)
+
+	def upload_body(self, istex_id):
+		"""
+		Body of a processReferences request: the PDF as multipart/form-data
+
+		Returns (body_bytes, headers_dict)
+		"""
+		return multipart_pdf(istex_id, self.get_pdf(istex_id))
+
+	def attempt(self, istex_id, stats, sink=None):
+		"""
+		One try of the grobid request of a document
+
+		Returns (result_bytes, None) if ok, else (None, (err_class, err_info))
+		(and fills the stats dict: latency, bytes_in, bytes_out, status,
+		 backend, pdf_bytes)
+
+		With a sink (cf. teistream.TeiFileSink) the answer is passed to
+		sink.feed() chunk by chunk as it is read from the socket, and
+		result_bytes is None.
+		"""
+		# mode upload: on a d'abord besoin du PDF lui-même
+		body, headers = None, {}
+		if self.mode == 'upload':
+			try:
+				body, headers = self.upload_body(istex_id)
+			except PdfError as e:
+				return (None, ('pdf', str(e)))
+			stats['bytes_out'] = len(body)
+			stats['pdf_bytes'] = upload_pdf_size(istex_id, len(body))
+
+		# choix du backend grobid (le moins chargé)
+		i_gb = self.balancer.acquire()
+		backend = self.balancer.backends[i_gb]
+		stats['backend'] = "%s:%i" % (backend.host, backend.port)
+
+		# requête à envoyer à grobid
+		get_tei_url = backend.base_url() + self.target(istex_id)
+
+		# pour le contrôle adaptatif de concurrence
+		t0 = time()
+		latency = None
+		overload = False
+
+		try:
+			# interrogation ============================
+			grobid_answer_content = urlopen(Request(get_tei_url, data=body, headers=headers),
+			                                timeout=self.timeout)
+			# ==========================================
+
+			# urlopen a renvoyé un objet file-like
+			if sink is None:
+				result = grobid_answer_content.read()
+				n_in = len(result)
+			else:
+				# en flux: rien n'est gardé en mémoire
+				result = None
+				n_in = 0
+				sink.begin()
+				chunk = grobid_answer_content.read(READ_CHUNK)
+				while chunk:
+					n_in += len(chunk)
+					sink.feed(chunk)
+					chunk = grobid_answer_content.read(READ_CHUNK)
+				# (read(n) ne signale pas une réponse coupée avant la fin)
+				expected = grobid_answer_content.getheader('Content-Length')
+				if expected is not None and n_in < int(expected):
+					grobid_answer_content.close()
+					raise IncompleteRead(b"", int(expected) - n_in)
+			grobid_answer_content.close()
+			latency = time() - t0
+			stats['latency'] = latency
+			stats['bytes_in'] = n_in
+			stats['status'] = 200
+
+		except HTTPError as e:
+			# 503: grobid-service a atteint org.grobid.max.connections
+			err_class = classify_status(e.code)
+			overload = (err_class == 'overload')
+			latency = time() - t0
+			stats['latency'] = latency
+			stats['status'] = e.code
+			e.close()
+			return (None, (err_class, "HTTP %s" % e.code))
+
+		except Exception as e:
+			# URLError, timeout, connexion coupée pendant la lecture...
+			err_class = classify_exception(e)
+			overload = (err_class == 'timeout')
+			if err_class == 'connection':
+				# backend injoignable: retiré jusqu'à la prochaine sonde
+				# (connexion refusée ou plusieurs erreurs d'affilée)
+				self.balancer.connect_failed(i_gb, is_refused(e))
+			return (None, (err_class, "%s error (%s)" % (err_class, describe(e))))
+
+		finally:
+			self.balancer.release(i_gb, latency, overload)
+
+		return (result, None)
+
+	def process(self, istex_id, sink=None):
+		"""
+		grobid request of a document with its retries (+ result cache)
+
+		Failed tries are retried according to the policy of their error
+		class, after a randomized exponential delay.
+
+		Returns (istex_id, result_bytes, failure, stats)
+		(result_bytes is None and failure is (err_class, err_info) if
+		 failed; stats: measures of the last try, cf. attempt, + 'tries')
+
+		sink: cf. attempt (result_bytes is then always None, the answer
+		has gone to the sink; not compatible with the result cache)
+		"""
+		if sink is not None and self.result_cache is not None:
+			raise ValueError("streamed answers can't go to the result cache")
+		if self.result_cache is not None:
+			cached = self.result_cache.get(istex_id)
+			if cached is not None:
+				return (istex_id, cached, None, {'cached': True, 'tries': 0})
+
+		attempt = 0
+		while True:
+			attempt += 1
+			stats = {'tries': attempt}
+			try:
+				(result, failure) = self.attempt(istex_id, stats, sink)
+			except Exception as e:
+				# rien ne doit tuer le worker
+				(result, failure) = (None, ('other', "error (%s)" % e))
+
+			if failure is None:
+				if self.result_cache is not None:
+					self.result_cache.put(istex_id, result)
+				return (istex_id, result, None, stats)
+
+			delay = self.retry.delay(failure[0], attempt)
+			if delay is None:
+				if self.log_retries:
+					print ("%s on %s: skip (after %i tries)" % (failure[1], istex_id, attempt),
+					        file=stderr)
+				return (istex_id, None, failure, stats)
+
+			if self.log_retries:
+				print ("%s on %s: retry in %.1fs" % (failure[1], istex_id, delay),
+				        file=stderr)
+			sleep(delay)
+
+	def _process_tei(self, istex_id):
+		# (dans un thread de extract)
+		(istex_id, result, failure, stats) = self.process(istex_id)
+		stats['worker'] = current_thread().name
+		if failure is not None:
+			stats['err_class'] = failure[0]
+			stats['error'] = failure[1]
+			return (istex_id, None, stats)
+		tei_out = BytesIO()
+		rewriter = TeiRewriter(istex_id, tei_out)
+		rewriter.feed(result)
+		rewriter.close()
+		stats['n_biblstruct'] = rewriter.n_biblstruct
+		stats['tei_bytes'] = rewriter.n_out
+		return (istex_id, tei_out.getvalue(), stats)
+
+	def extract(self, ids, n_threads=None):
+		"""
+		Generator of (istex_id, tei_bytes, stats) in order of completion
+
+		   ids       -- iterable of ISTEX ids (consumed as needed: at most
+		                n_threads documents are in progress at a time)
+		   n_threads -- simultaneous requests (default: total capacity
+		                of the backends)
+
+		tei_bytes is the post-processed TEI (cf. teistream.TeiRewriter) or None
+		if the document failed after all its tries (then stats has its
+		'err_class' and 'error')
+		"""
+		if n_threads is None:
+			n_threads = self.balancer.total_capacity()
+		ids_iter = iter(ids)
+		executor = ThreadPoolExecutor(n_threads, thread_name_prefix='extract')
+		in_progress = set()
+		try:
+			while True:
+				# on remplit jusqu'à n_threads documents en cours
+				for istex_id in ids_iter:
+					in_progress.add(executor.submit(self._process_tei, istex_id))
+					if len(in_progress) >= n_threads:
+						break
+				if not in_progress:
+					return
+				(done, in_progress) = wait(in_progress, return_when=FIRST_COMPLETED)
+				for future in done:
+					yield future.result()
+		finally:
+			# (y compris si l'appelant arrête avant la fin)
+			executor.shutdown(wait=True, cancel_futures=True)
+
+
+def extract(ids, backends, n_threads=None, **config):
+	"""
+	Shortcut: Extractor(backends, **config).extract(ids, n_threads)
+	"""
+	return Extractor(backends, **config).extract(ids, n_threads)
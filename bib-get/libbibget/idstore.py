@@ -0,0 +1,189 @@
+#! /usr/bin/python3
+"""
+Compact array-backed store of ISTEX ids
+
+Un ID ISTEX (40 caractères hexa) est gardé sous forme de 20 octets bruts
+dans un seul bytearray contigu, au lieu d'une str Python de ~90 octets
+dans une liste (=> ~200MB au lieu de ~1GB pour 10 millions de docs).
+
+Usage:
+   >>> ids = IdStore(["21B88F4EFBA46DC85E863709CA9824DEED7B7BFC"])
+   >>> ids.append("C095E6F0A43EBE3E98E2E6E17DD8775617636034")
+   >>> len(ids)
+   2
+   >>> "C095E6F0A43EBE3E98E2E6E17DD8775617636034" in ids
+   True
+   >>> ids.index("C095E6F0A43EBE3E98E2E6E17DD8775617636034")
+   1
+   >>> [len(chunk) for chunk in ids.chunks(1)]
+   [1, 1]
+
+NB: les IDs sont restitués en majuscules (forme canonique des IDs ISTEX)
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from array           import array
+
+# taille d'un ID en octets bruts
+ID_LEN = 20
+
+
+def id_to_raw(istex_id):
+	"""
+	'21B88F4E...7B7BFC' => 20 raw bytes (ValueError if not an ISTEX id)
+	"""
+	if len(istex_id) != 2*ID_LEN:
+		raise ValueError("not an ISTEX id: '%s'" % istex_id)
+	return bytes.fromhex(istex_id)
+
+
+class IdStore(object):
+	"""
+	Ordered container of ISTEX ids (list-like: append, len, iter,
+	indexing and slicing) with compact storage and fast membership
+
+	Le test d'appartenance utilise un index de hachage construit
+	à la première demande (un array d'entiers: 4 à 8 octets par ID)
+	puis tenu à jour par append().
+	"""
+	def __init__(self, ids=()):
+		self._buf = bytearray()
+		# index de hachage: positions+1 (0 = case vide)
+		self._index = None
+		self.extend(ids)
+
+	# ------------------------------------------------------------
+	#   remplissage
+	# ------------------------------------------------------------
+	def append(self, istex_id):
+		self._append_raw(id_to_raw(istex_id))
+
+	def extend(self, ids):
+		for istex_id in ids:
+			self.append(istex_id)
+
+	def _append_raw(self, raw):
+		self._buf += raw
+		if self._index is not None:
+			if 2 * len(self) > len(self._index):
+				self._index = None   # sera reconstruit plus grand
+			else:
+				self._index_insert(len(self) - 1)
+
+	@classmethod
+	def from_lines(cls, lines, on_error=None):
+		"""
+		Builds a store from lines of text (ex: an ID_list.txt filehandle)
+
+		Empty lines are skipped, invalid ones are passed to on_error(line)
+		(or raise ValueError if no on_error callback)
+		"""
+		store = cls()
+		for line in lines:
+			line = line.strip()
+			if not line:
+				continue
+			try:
+				store.append(line)
+			except ValueError:
+				if on_error is None:
+					raise
+				on_error(line)
+		return store
+
+	# ------------------------------------------------------------
+	#   lecture
+	# ------------------------------------------------------------
+	def __len__(self):
+		return len(self._buf) // ID_LEN
+
+	def _raw(self, i):
+		return bytes(self._buf[i*ID_LEN:(i+1)*ID_LEN])
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			start, stop, step = i.indices(len(self))
+			sub_store = IdStore()
+			if step == 1:
+				sub_store._buf = self._buf[start*ID_LEN:stop*ID_LEN]
+			else:
+				for j in range(start, stop, step):
+					sub_store._buf += self._buf[j*ID_LEN:(j+1)*ID_LEN]
+			return sub_store
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError("IdStore index out of range")
+		return self._raw(i).hex().upper()
+
+	def __iter__(self):
+		view = memoryview(self._buf)
+		for start in range(0, len(self._buf), ID_LEN):
+			yield view[start:start+ID_LEN].hex().upper()
+
+	def chunks(self, size):
+		"""
+		Successive sub-stores of (at most) size ids, eg one per worker task
+		"""
+		for i in range(0, len(self), size):
+			yield self[i:i+size]
+
+	# ------------------------------------------------------------
+	#   appartenance
+	# ------------------------------------------------------------
+	def __contains__(self, istex_id):
+		try:
+			raw = id_to_raw(istex_id)
+		except (ValueError, TypeError):
+			return False
+		if self._index is None:
+			self._build_index()
+		return self._index_find(raw) is not None
+
+	def index(self, istex_id):
+		"""
+		Position of the (first occurrence of) istex_id, like list.index
+		"""
+		if istex_id in self:
+			return self._index[self._index_find(id_to_raw(istex_id))] - 1
+		raise ValueError("%s is not in IdStore" % istex_id)
+
+	def _slot(self, raw):
+		# les IDs ISTEX sont des empreintes: octets déjà bien répartis
+		return int.from_bytes(raw[0:8], 'big') & (len(self._index) - 1)
+
+	def _index_find(self, raw):
+		mask = len(self._index) - 1
+		slot = self._slot(raw)
+		while True:
+			pos = self._index[slot]
+			if pos == 0:
+				return None
+			if self._raw(pos - 1) == raw:
+				return slot
+			slot = (slot + 1) & mask
+
+	def _index_insert(self, i):
+		raw = self._raw(i)
+		mask = len(self._index) - 1
+		slot = self._slot(raw)
+		while self._index[slot] != 0:
+			if self._raw(self._index[slot] - 1) == raw:
+				return   # doublon: on garde la 1ère position
+			slot = (slot + 1) & mask
+		self._index[slot] = i + 1
+
+	def _build_index(self):
+		# table de taille 2^k >= 4n (taux de remplissage entre 1/4 et 1/2)
+		size = 8
+		while size < 4 * len(self):
+			size <<= 1
+		typecode = 'I' if len(self) < 2**31 else 'Q'
+		self._index = array(typecode, bytes(size * array(typecode).itemsize))
+		for i in range(len(self)):
+			self._index_insert(i)
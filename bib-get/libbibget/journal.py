@@ -0,0 +1,192 @@
+#! /usr/bin/python3
+"""
+Per-run completion journal for bib-get (--resume)
+
+Dans le dossier de sortie d'un run on garde:
+  - run.todo    : la liste complète des IDs à traiter (1 par ligne)
+  - run.journal : un journal en ajout seul, 1 ligne par document fini
+                    OK<tab>ID
+                    ERR<tab>ID<tab>info erreur
+
+Un run interrompu peut alors être repris: on ne relance que les IDs
+de run.todo qui n'ont ni ligne OK ni fichier TEI déjà écrit.
+
+En plus, les documents en échec après toutes leurs tentatives vont dans
+  - run.failed  : la "dead-letter" du run, 1 ligne par échec définitif
+                    ID<tab>classe d'erreur<tab>info erreur
+pour être retraités seuls ensuite (bib-get --retry-failed).
+
+En mode flux (bib-get --stream) run.todo n'est complet qu'une fois le
+flux épuisé, d'où aussi
+  - run.stream  : la requête du flux et son état (JSON)
+                    {"q": ..., "maxi": ..., "complete": true|false}
+pour qu'une reprise continue la pagination d'un flux interrompu.
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from os              import path, rename, replace
+from sys             import stderr
+from json            import dump, load
+
+from libbibget.idstore import IdStore
+
+TODO_NAME    = 'run.todo'
+JOURNAL_NAME = 'run.journal'
+DEAD_LETTER_NAME = 'run.failed'
+STREAM_NAME  = 'run.stream'
+
+
+def save_todo(outdir, ids):
+	"""
+	Writes the complete todo list of a run (before dispatch)
+	"""
+	todo_file = open(path.join(outdir, TODO_NAME), 'w')
+	for istex_id in ids:
+		todo_file.write(istex_id + "\n")
+	todo_file.close()
+
+
+def read_todo(outdir):
+	"""
+	Reads back the complete todo list of an earlier run (as an IdStore)
+	"""
+	todo_file = open(path.join(outdir, TODO_NAME), 'r')
+	ids = IdStore.from_lines(
+		todo_file,
+		on_error=lambda line: print("WARN: ID invalide dans %s: '%s'" % (TODO_NAME, line), file=stderr)
+		)
+	todo_file.close()
+	return ids
+
+
+def read_journal(outdir):
+	"""
+	Reads an earlier journal
+
+	Returns (IdStore of ok ids, dict of failed ids => last error info)
+
+	NB: une ligne incomplète en fin de fichier (arrêt brutal) est ignorée
+	    et un ID en erreur puis OK dans un run ultérieur compte comme OK
+	"""
+	ok_ids = IdStore()
+	failed = {}
+	journal_path = path.join(outdir, JOURNAL_NAME)
+	if not path.exists(journal_path):
+		return (ok_ids, failed)
+
+	journal_file = open(journal_path, 'r')
+	for line in journal_file:
+		if not line.endswith("\n"):
+			break
+		fields = line.rstrip("\n").split("\t")
+		if fields[0] == 'OK' and len(fields) == 2:
+			ok_ids.append(fields[1])
+			failed.pop(fields[1], None)
+		elif fields[0] == 'ERR' and len(fields) == 3:
+			failed[fields[1]] = fields[2]
+	journal_file.close()
+	return (ok_ids, failed)
+
+
+def read_dead_letter(outdir):
+	"""
+	Ids of an earlier dead-letter file (each once, in order of failure)
+	"""
+	dead_ids = IdStore()
+	dead_path = path.join(outdir, DEAD_LETTER_NAME)
+	if not path.exists(dead_path):
+		return dead_ids
+
+	dead_file = open(dead_path, 'r')
+	for line in dead_file:
+		if not line.endswith("\n"):
+			break
+		istex_id = line.split("\t")[0]
+		if istex_id not in dead_ids:
+			dead_ids.append(istex_id)
+	dead_file.close()
+	return dead_ids
+
+
+class RunJournal(object):
+	"""
+	Append-only journal of finished documents (+ the dead-letter file)
+
+	(à n'utiliser que depuis le processus principal: les workers
+	 du Pool renvoient leurs résultats via imap_unordered)
+	"""
+	def __init__(self, outdir, new_dead_letter=False):
+		# buffering=1 : vidage à chaque ligne
+		#  => au pire on perd la ligne en cours en cas d'arrêt brutal
+		self.fh = open(path.join(outdir, JOURNAL_NAME), 'a', buffering=1)
+
+		# new_dead_letter: l'ancienne dead-letter (déjà relue, cf.
+		# --retry-failed) est gardée en .prev et on repart de zéro
+		dead_path = path.join(outdir, DEAD_LETTER_NAME)
+		if new_dead_letter and path.exists(dead_path):
+			rename(dead_path, dead_path + '.prev')
+		self.dead_fh = open(dead_path, 'a', buffering=1)
+
+	def done(self, istex_id):
+		self.fh.write("OK\t%s\n" % istex_id)
+
+	def failed(self, istex_id, info, err_class='other'):
+		info = str(info).replace("\t", " ").replace("\n", " ")
+		self.fh.write("ERR\t%s\t%s\n" % (istex_id, info))
+		self.dead_fh.write("%s\t%s\t%s\n" % (istex_id, err_class, info))
+
+	def close(self):
+		self.fh.close()
+		self.dead_fh.close()
+
+
+def save_stream_state(outdir, query, maxi, complete=False):
+	"""
+	Writes the query of a stream run (before its first id) and whether
+	the stream was exhausted (cf. tee_todo)
+	"""
+	state_path = path.join(outdir, STREAM_NAME)
+	state_file = open(state_path + '.tmp', 'w')
+	dump({'q': query, 'maxi': maxi, 'complete': complete}, state_file)
+	state_file.close()
+	replace(state_path + '.tmp', state_path)
+
+
+def read_stream_state(outdir):
+	"""
+	State saved by save_stream_state (None if the run was not a stream)
+	"""
+	state_path = path.join(outdir, STREAM_NAME)
+	if not path.exists(state_path):
+		return None
+	state_file = open(state_path, 'r')
+	state = load(state_file)
+	state_file.close()
+	return state
+
+
+def tee_todo(outdir, ids, append=False):
+	"""
+	Passes the ids through while appending them to the todo list
+	(for runs where ids arrive as a stream, cf. bib-get --stream)
+
+	The stream is marked complete in run.stream only once ids is
+	exhausted: until then run.todo is a partial list.
+
+	append: continues the todo list of an interrupted stream (resume)
+	"""
+	todo_file = open(path.join(outdir, TODO_NAME), 'a' if append else 'w', buffering=1)
+	try:
+		for istex_id in ids:
+			todo_file.write(istex_id + "\n")
+			yield istex_id
+		state = read_stream_state(outdir)
+		if state is not None:
+			save_stream_state(outdir, state['q'], state['maxi'], complete=True)
+	finally:
+		todo_file.close()
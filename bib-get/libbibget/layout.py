@@ -0,0 +1,44 @@
+#! /usr/bin/python3
+"""
+Sharded layout of the per-document output files
+
+Avec des millions de fichiers ID.refbibs.tei.xml dans un seul dossier
+(ls, rsync, ouvertures pour -g...) tout devient très lent. Les fichiers
+peuvent être répartis dans des sous-dossiers d'après les premiers
+caractères de leur ID:
+
+   levels=0 :  outdir/ABCDEF0123....refbibs.tei.xml   (à plat)
+   levels=2 :  outdir/AB/CD/ABCDEF0123....refbibs.tei.xml
+               (65536 sous-dossiers => ~150 fichiers chacun pour 10M)
+
+Les IDs ISTEX sont des empreintes: la répartition est homogène.
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from os              import path
+
+# nombre de caractères de l'ID par niveau de sous-dossier
+SHARD_WIDTH = 2
+
+
+def shard_dir(base_dir, istex_id, levels=0):
+	"""
+	Sub-directory of a document under base_dir
+	"""
+	parts = [istex_id[i*SHARD_WIDTH:(i+1)*SHARD_WIDTH] for i in range(levels)]
+	return path.join(base_dir, *parts)
+
+
+def shard_path(base_dir, istex_id, ext, levels=0):
+	"""
+	Path of a document's file under base_dir
+
+	ex: shard_path("out", "ABCD...", ".refbibs.tei.xml", 2)
+	    => "out/AB/CD/ABCD....refbibs.tei.xml"
+	"""
+	return path.join(shard_dir(base_dir, istex_id, levels), istex_id + ext)
@@ -0,0 +1,174 @@
+#! /usr/bin/python3
+"""
+Per-document ledger of a bib-get run (timings and sizes)
+
+Une ligne par document fini, en CSV ou en JSON lines, dans le dossier
+de sortie du run (run.ledger.csv ou run.ledger.jsonl):
+
+   id             -- ID ISTEX
+   status         -- statut HTTP de la dernière réponse grobid (vide si
+                     pas de réponse: timeout, connexion, PDF...)
+   err_class      -- classe d'erreur (vide si ok, cf. retry.py)
+   tries          -- nombre de tentatives
+   grobid_seconds -- durée de la dernière requête grobid
+   pdf_bytes      -- taille du PDF (connue en mode upload seulement)
+   tei_bytes      -- taille de la TEI écrite
+   n_biblstruct   -- nombre de <biblStruct> renvoyés par grobid
+   worker         -- pid du worker (Pool) ou n° de tâche (--async_mode)
+   backend        -- grobid-service qui a traité la requête
+   cached         -- 1 si servi par le cache des résultats
+
+Ces lignes permettent de repérer les PDF qui monopolisent un worker
+grobid et de mesurer la durée moyenne par document (MeanCost,
+ci-dessous) pour l'estimation du temps de traitement.
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from os              import path
+from sys             import stderr
+from json            import dumps, loads
+import csv
+
+LEDGER_NAME = 'run.ledger'
+
+FIELDS = ['id', 'status', 'err_class', 'tries', 'grobid_seconds',
+          'pdf_bytes', 'tei_bytes', 'n_biblstruct', 'worker', 'backend',
+          'cached']
+
+# champs numériques (pour la relecture des CSV)
+NUMERIC = {'status': int, 'tries': int, 'grobid_seconds': float,
+           'pdf_bytes': int, 'tei_bytes': int, 'n_biblstruct': int,
+           'cached': int}
+
+
+def ledger_path(outdir, fmt):
+	return path.join(outdir, "%s.%s" % (LEDGER_NAME, fmt))
+
+
+def find_ledger(outdir):
+	"""
+	Ledger of an earlier run in its output dir (or None)
+	"""
+	for fmt in ('csv', 'jsonl'):
+		if path.exists(ledger_path(outdir, fmt)):
+			return ledger_path(outdir, fmt)
+	return None
+
+
+class Ledger(object):
+	"""
+	Append-only ledger (a resumed run continues the same file)
+
+	(comme RunJournal: à n'utiliser que depuis le processus principal)
+	"""
+	def __init__(self, outdir, fmt='csv'):
+		if fmt not in ('csv', 'jsonl'):
+			raise ValueError("unknown ledger format '%s' (csv|jsonl)" % fmt)
+		self.fmt = fmt
+		self.path = ledger_path(outdir, fmt)
+		is_new = not path.exists(self.path) or path.getsize(self.path) == 0
+		self.fh = open(self.path, 'a', buffering=1, newline='')
+		if fmt == 'csv':
+			self.writer = csv.DictWriter(self.fh, FIELDS, extrasaction='ignore')
+			if is_new:
+				self.writer.writeheader()
+
+	def write(self, istex_id, failure=None, stats=None):
+		"""
+		One row for a finished document
+
+		   failure -- None if ok, else (err_class, err_info)
+		   stats   -- measures of the last try (keys of FIELDS, except
+		              'latency' => grobid_seconds)
+		"""
+		stats = stats or {}
+		row = {f: stats.get(f) for f in FIELDS}
+		row['id'] = istex_id
+		row['err_class'] = None if failure is None else failure[0]
+		if stats.get('latency') is not None:
+			row['grobid_seconds'] = round(stats['latency'], 4)
+		row['cached'] = 1 if stats.get('cached') else 0
+		if self.fmt == 'csv':
+			self.writer.writerow({f: ('' if v is None else v) for (f, v) in row.items()})
+		else:
+			self.fh.write(dumps(row) + "\n")
+
+	def close(self):
+		self.fh.close()
+
+
+def read_ledger(ledger_file):
+	"""
+	Rows of a ledger file (dicts, empty CSV fields => None)
+	"""
+	fh = open(ledger_file, newline='')
+	try:
+		if ledger_file.endswith('.jsonl'):
+			for line in fh:
+				if line.endswith("\n"):
+					yield loads(line)
+		else:
+			for row in csv.DictReader(fh):
+				for field in row:
+					if row[field] == '' or row[field] is None:
+						row[field] = None
+					elif field in NUMERIC:
+						row[field] = NUMERIC[field](float(row[field]))
+				yield row
+	finally:
+		fh.close()
+
+
+class MeanCost(object):
+	"""
+	Mean grobid seconds per document, measured on earlier ledgers
+
+	(simple moyenne, pas de régression sur la taille du PDF: elle n'est
+	 connue qu'une fois le PDF téléchargé, en mode upload, donc pas avant
+	 le lancement du run ni pour l'ordonnancement, cf. schedule.py)
+	"""
+	def __init__(self, mean_seconds, n_rows):
+		self.mean_seconds = mean_seconds
+		self.n_rows = n_rows
+
+	@classmethod
+	def from_rows(cls, rows):
+		"""
+		Mean from ledger rows (only documents really sent to grobid
+		with a 200 answer count), None if no such row
+		"""
+		n = 0
+		sum_y = 0.0
+		for row in rows:
+			if row.get('status') != 200 or row.get('cached') or row.get('grobid_seconds') is None:
+				continue
+			n += 1
+			sum_y += row['grobid_seconds']
+		if n == 0:
+			return None
+		return cls(sum_y / n, n)
+
+	@classmethod
+	def from_ledgers(cls, ledger_files):
+		"""
+		Mean from several ledger files (missing ones are skipped)
+		"""
+		def all_rows():
+			for ledger_file in ledger_files:
+				if not path.exists(ledger_file):
+					print("WARN: ledger introuvable: '%s'" % ledger_file, file=stderr)
+					continue
+				for row in read_ledger(ledger_file):
+					yield row
+		return cls.from_rows(all_rows())
+
+	def estimate(self, n_docs, concurrency):
+		"""
+		Expected wall time of n_docs with concurrency requests in flight
+		"""
+		return n_docs * self.mean_seconds / max(1, concurrency)
@@ -0,0 +1,148 @@
+#! /usr/bin/python3
+"""
+Local content-addressed cache of the source PDFs (for grobid upload mode)
+
+Au lieu de laisser grobid retélécharger chaque PDF sur l'API à chaque
+run (processReferencesViaUrl), on garde une copie locale des PDF et on
+les envoie nous-mêmes (processReferences en POST multipart).
+
+Organisation du dossier de cache:
+  - sha256/AB/<sha256>  : le contenu de chaque PDF, nommé par son empreinte
+  - ids/AB/<ID ISTEX>   : l'empreinte du PDF de ce document
+
+  => une relecture vérifie toujours le contenu contre son empreinte
+     (fichier tronqué ou abîmé: supprimé et retéléchargé)
+  => les écritures passent par un fichier temporaire + rename
+     (plusieurs processus peuvent remplir le même cache)
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from os              import path, makedirs, rename, remove, fdopen
+from sys             import stderr
+from tempfile        import mkstemp
+from hashlib         import sha256
+from collections     import deque
+from urllib.request  import urlopen
+
+from concurrent.futures import ThreadPoolExecutor
+
+from libbibget.ratelimit import read_limited
+
+
+class PdfCache(object):
+	"""
+	ISTEX id => PDF bytes, on disk, verified by sha256
+	"""
+	def __init__(self, cache_dir, timeout=60, limiter=None):
+		self.cache_dir = cache_dir
+		self.timeout = timeout
+		# optionnel: débit max des téléchargements (cf. ratelimit)
+		self.limiter = limiter
+		for sub_dir in ('sha256', 'ids'):
+			makedirs(path.join(cache_dir, sub_dir), exist_ok=True)
+
+	def _blob_path(self, digest):
+		return path.join(self.cache_dir, 'sha256', digest[0:2], digest)
+
+	def _ref_path(self, istex_id):
+		return path.join(self.cache_dir, 'ids', istex_id[0:2], istex_id)
+
+	def _write_atomic(self, file_path, data):
+		makedirs(path.dirname(file_path), exist_ok=True)
+		(fd, tmp_path) = mkstemp(dir=path.dirname(file_path), suffix='.part')
+		with fdopen(fd, 'wb') as tmp_file:
+			tmp_file.write(data)
+		rename(tmp_path, file_path)
+
+	def get(self, istex_id):
+		"""
+		Cached PDF bytes of a document (None if absent or corrupt)
+		"""
+		try:
+			ref_file = open(self._ref_path(istex_id), 'r')
+			digest = ref_file.read().strip()
+			ref_file.close()
+			blob_file = open(self._blob_path(digest), 'rb')
+			data = blob_file.read()
+			blob_file.close()
+		except (FileNotFoundError, IndexError):
+			return None
+
+		if sha256(data).hexdigest() != digest:
+			print("WARN: pdf en cache corrompu pour %s: supprimé" % istex_id, file=stderr)
+			remove(self._blob_path(digest))
+			return None
+		return data
+
+	def put(self, istex_id, data):
+		"""
+		Stores the PDF bytes of a document (blob first, then the ref)
+		"""
+		digest = sha256(data).hexdigest()
+		blob_path = self._blob_path(digest)
+		if not path.exists(blob_path):
+			self._write_atomic(blob_path, data)
+		self._write_atomic(self._ref_path(istex_id), digest.encode('ascii'))
+
+	def __contains__(self, istex_id):
+		return path.exists(self._ref_path(istex_id))
+
+	def fetch(self, istex_id, url):
+		"""
+		PDF bytes from the cache or else downloaded from url (and cached)
+		"""
+		data = self.get(istex_id)
+		if data is None:
+			data = download_pdf(url, self.timeout, self.limiter)
+			self.put(istex_id, data)
+		return data
+
+
+def download_pdf(url, timeout=60, limiter=None):
+	"""
+	GET a PDF (ValueError if the answer isn't a PDF, eg an error page)
+	
+	(limiter: optional ratelimit.RateLimiter for the request and its bytes)
+	"""
+	if limiter is not None:
+		limiter.acquire()
+	remote_file = urlopen(url, timeout=timeout)
+	data = read_limited(remote_file, limiter)
+	remote_file.close()
+	if not data.startswith(b'%PDF'):
+		raise ValueError("not a pdf: %s" % url)
+	return data
+
+
+def prefetch(ids, cache, url_for_id, n_threads=4, ahead=64):
+	"""
+	Passes the ids through once their PDF is in the cache
+
+	Les téléchargements tournent dans n_threads threads, avec au plus
+	'ahead' PDF d'avance sur le consommateur (ex: le Pool grobid):
+	le PDF suivant arrive pendant que grobid traite le précédent.
+
+	(un échec de téléchargement est juste signalé: l'ID passe quand même
+	 et l'erreur définitive sera constatée et journalisée par le worker)
+	"""
+	def warm(istex_id):
+		if istex_id not in cache:
+			try:
+				cache.fetch(istex_id, url_for_id(istex_id))
+			except Exception as e:
+				print("WARN: préchargement du pdf %s impossible (%s)" % (istex_id, e), file=stderr)
+		return istex_id
+
+	pending = deque()
+	with ThreadPoolExecutor(max_workers=n_threads) as executor:
+		for istex_id in ids:
+			pending.append(executor.submit(warm, istex_id))
+			if len(pending) >= ahead:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
@@ -0,0 +1,191 @@
+#! /usr/bin/python3
+"""
+grobid TEI => one flat JSON record per biblStruct (JSON lines output)
+
+Chaque TEI est parsée une seule fois (dans le worker qui l'a obtenue)
+et chaque <biblStruct> devient un enregistrement avec des champs
+normalisés (espaces réduits, année isolée, pages séparées):
+
+   {"doc": "<ID ISTEX>", "bib": "b0", "n": 0,
+    "title": "...", "authors": [{"surname": "...", "forename": "..."}],
+    "journal": "...", "host_title": "...", "date": "1992-05", "year": 1992,
+    "volume": "12", "issue": "3", "page_first": "45", "page_last": "67",
+    "publisher": "...", "doi": "..."}
+
+(les champs absents de la bib ne sont pas écrits)
+
+Les enregistrements vont dans N fichiers refbibs-XX.jsonl, le fichier
+d'un document étant fixé par son ID. Tous les enregistrements d'un
+document partent en une seule écriture en mode O_APPEND: plusieurs
+processus peuvent écrire dans le même fichier sans mélanger leurs
+lignes (sur un système de fichiers local).
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+import os
+from os              import path, makedirs
+from re              import sub, search
+from json            import dumps
+from lxml            import etree
+
+XML_ID = '{http://www.w3.org/XML/1998/namespace}id'
+
+
+def _text(elt):
+	"""
+	Whole text of an element, whitespace normalized (None if empty)
+	"""
+	if elt is None:
+		return None
+	text = sub(r"\s+", " ", "".join(elt.itertext())).strip()
+	return text or None
+
+
+def _first_text(parent, *paths):
+	# (le premier chemin qui donne un texte non vide)
+	if parent is None:
+		return None
+	for xpath in paths:
+		text = _text(parent.find(xpath))
+		if text is not None:
+			return text
+	return None
+
+
+def _authors(parent):
+	authors = []
+	if parent is None:
+		return authors
+	for pers in parent.findall('{*}author/{*}persName'):
+		author = {}
+		surname = _text(pers.find('{*}surname'))
+		forenames = [_text(f) for f in pers.findall('{*}forename')]
+		forenames = [f for f in forenames if f]
+		if surname:
+			author['surname'] = surname
+		if forenames:
+			author['forename'] = " ".join(forenames)
+		if author:
+			authors.append(author)
+	return authors
+
+
+def bib_record(bib_elt, istex_id, n):
+	"""
+	One biblStruct element => flat dict
+	"""
+	analytic = bib_elt.find('{*}analytic')
+	monogr = bib_elt.find('{*}monogr')
+	imprint = monogr.find('{*}imprint') if monogr is not None else None
+
+	record = {
+		'doc': istex_id,
+		'bib': bib_elt.get(XML_ID) or "b%i" % n,
+		'n': n,
+	}
+
+	if analytic is not None:
+		record['title'] = _first_text(analytic, '{*}title[@level="a"]', '{*}title')
+		record['host_title'] = _first_text(monogr, '{*}title[@level="m"]')
+		record['authors'] = _authors(analytic) or _authors(monogr)
+	else:
+		# monographie entière
+		record['title'] = _first_text(monogr, '{*}title[@level="m"]', '{*}title')
+		record['authors'] = _authors(monogr)
+	record['journal'] = _first_text(monogr, '{*}title[@level="j"]')
+
+	if imprint is not None:
+		date_elt = imprint.find('{*}date')
+		if date_elt is not None:
+			record['date'] = date_elt.get('when') or _text(date_elt)
+			year = search(r"\b(1[5-9]|20)[0-9]{2}\b", record['date'] or "")
+			if year:
+				record['year'] = int(year.group())
+		for biblscope in imprint.findall('{*}biblScope'):
+			unit = biblscope.get('unit')
+			if unit in ('volume', 'vol'):
+				record['volume'] = _text(biblscope)
+			elif unit == 'issue':
+				record['issue'] = _text(biblscope)
+			elif unit in ('page', 'pp'):
+				record['page_first'] = biblscope.get('from') or _text(biblscope)
+				record['page_last'] = biblscope.get('to')
+		record['publisher'] = _first_text(imprint, '{*}publisher')
+
+	for idno in bib_elt.iter('{*}idno'):
+		if (idno.get('type') or '').upper() == 'DOI':
+			record['doi'] = _text(idno)
+			break
+
+	return {k: v for (k, v) in record.items() if v not in (None, [], "")}
+
+
+def bib_records(istex_id, tei_bytes):
+	"""
+	All the records of a raw grobid TEI (with or without namespace)
+
+	(XMLSyntaxError si la TEI n'est pas du XML valide)
+	"""
+	root = etree.fromstring(tei_bytes)
+	bibs = root.findall('.//{*}back//{*}listBibl/{*}biblStruct')
+	if not bibs:
+		# comme le resolver: on prend aussi les bibs hors listBibl
+		bibs = root.findall('.//{*}back//{*}biblStruct')
+	return [bib_record(bib, istex_id, n) for (n, bib) in enumerate(bibs)]
+
+
+class RefbibShards(object):
+	"""
+	Sharded JSON lines files, one shard per document (by its ID)
+
+	   out_dir  -- directory of the refbibs-XX.jsonl files
+	   n_shards -- number of files (1 to 256)
+	"""
+	def __init__(self, out_dir, n_shards=16):
+		if not 1 <= n_shards <= 256:
+			raise ValueError("refbibs shards: %i not in 1..256" % n_shards)
+		self.out_dir = out_dir
+		self.n_shards = n_shards
+		makedirs(out_dir, exist_ok=True)
+		# ouverts à la première écriture (donc par chaque processus
+		# du Pool pour son propre compte)
+		self._fds = {}
+		self._pid = None
+
+	def shard_path(self, istex_id):
+		shard = int(istex_id[0:2], 16) % self.n_shards
+		return path.join(self.out_dir, "refbibs-%02x.jsonl" % shard)
+
+	def write_doc(self, istex_id, records):
+		"""
+		Appends the records of a document to its shard (1 write call)
+		"""
+		if not records:
+			return
+		if self._pid != os.getpid():
+			# après fork: pas de descripteurs partagés avec le parent
+			self._fds = {}
+			self._pid = os.getpid()
+		shard_path = self.shard_path(istex_id)
+		fd = self._fds.get(shard_path)
+		if fd is None:
+			fd = os.open(shard_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+			self._fds[shard_path] = fd
+		data = "".join(dumps(r, ensure_ascii=False) + "\n" for r in records).encode('UTF-8')
+		n = os.write(fd, data)
+		if n != len(data):
+			raise OSError("refbibs: short write on %s" % shard_path)
+
+	def close(self):
+		"""
+		Closes the files opened by this process (those of the Pool
+		workers are closed when the workers exit)
+		"""
+		for fd in self._fds.values():
+			os.close(fd)
+		self._fds = {}
@@ -0,0 +1,81 @@
+#! /usr/bin/python3
+"""
+Model-aware local store of grobid results
+
+Les TEI renvoyées par grobid sont gardées sous une clé (empreinte des
+modèles CRF actifs, ID ISTEX): un nouveau run sur un corpus qui
+recoupe les précédents n'interroge grobid que pour les documents jamais
+traités avec les modèles actuels.
+
+Organisation du dossier:
+  - <empreinte>/models.txt        : les modèles correspondants (pour info)
+  - <empreinte>/AB/<ID>.tei.xml   : la réponse brute de grobid
+
+Un changement de modèles donne une autre empreinte, donc un autre
+sous-dossier (les anciens peuvent être supprimés à la main).
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from os              import path, makedirs, rename, fdopen
+from tempfile        import mkstemp
+from hashlib         import sha1
+
+from libbibget.layout  import shard_path
+
+
+def models_fingerprint(model_names, route=''):
+	"""
+	Short stable hash of a set of grobid models (+ the service route,
+	as different routes give different results with the same models)
+	"""
+	key = "\n".join([route] + sorted(model_names))
+	return sha1(key.encode('UTF-8')).hexdigest()[0:16]
+
+
+class ResultCache(object):
+	"""
+	(models fingerprint, ISTEX id) => raw grobid TEI bytes
+	"""
+	def __init__(self, cache_dir, model_names, route=''):
+		self.fingerprint = models_fingerprint(model_names, route)
+		self.base_dir = path.join(cache_dir, self.fingerprint)
+		makedirs(self.base_dir, exist_ok=True)
+		models_path = path.join(self.base_dir, 'models.txt')
+		if not path.exists(models_path):
+			models_file = open(models_path, 'w')
+			models_file.write("\n".join([route] + sorted(model_names)) + "\n")
+			models_file.close()
+		# compteur local au processus (ex: documents servis par le cache)
+		self.n_hits = 0
+
+	def _path(self, istex_id):
+		return shard_path(self.base_dir, istex_id, '.tei.xml', 1)
+
+	def get(self, istex_id):
+		"""
+		Cached grobid result of a document with the current models (or None)
+		"""
+		try:
+			result_file = open(self._path(istex_id), 'rb')
+		except FileNotFoundError:
+			return None
+		result = result_file.read()
+		result_file.close()
+		self.n_hits += 1
+		return result
+
+	def put(self, istex_id, result):
+		"""
+		Stores a grobid result (temp file + rename: never a partial entry)
+		"""
+		result_path = self._path(istex_id)
+		makedirs(path.dirname(result_path), exist_ok=True)
+		(fd, tmp_path) = mkstemp(dir=path.dirname(result_path), suffix='.part')
+		with fdopen(fd, 'wb') as tmp_file:
+			tmp_file.write(result)
+		rename(tmp_path, result_path)
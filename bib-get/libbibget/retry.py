@@ -0,0 +1,140 @@
+#! /usr/bin/python3
+"""
+Retry policies for failed grobid requests
+
+Chaque échec est rangé dans une classe d'erreur, et chaque classe a sa
+politique: nombre max de tentatives, délai initial et délai max.
+Entre deux tentatives on attend un délai exponentiel avec "full jitter"
+(tirage uniforme entre 0 et min(max, initial x 2^(n-1))): les workers
+qui ont échoué en même temps ne reviennent pas tous en même temps.
+
+Classes d'erreurs:
+   overload   -- 503 (grobid a atteint org.grobid.max.connections)
+   timeout    -- pas de réponse avant request-timeout
+   connection -- connexion refusée, coupée, etc.
+   server     -- autres erreurs HTTP 5xx
+   client     -- erreurs HTTP 4xx (inutile de réessayer en général)
+   pdf        -- PDF impossible à obtenir (mode upload)
+   other      -- tout le reste (réponse illisible...)
+
+Format de la config (section [retry]):
+   overload=6 2 60
+   (une ligne par classe: tentatives [délai initial] [délai max])
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from random          import uniform
+from socket          import timeout as SocketTimeout
+from urllib.error    import URLError
+from http.client     import HTTPException
+from asyncio         import TimeoutError as AsyncTimeout
+
+# tentatives, délai initial, délai max (en secondes)
+DEFAULT_POLICIES = {
+	'overload':   (6, 2.0, 60.0),
+	'timeout':    (3, 5.0, 60.0),
+	'connection': (4, 5.0, 120.0),
+	'server':     (2, 5.0, 30.0),
+	'client':     (1, 0.0, 0.0),
+	'pdf':        (3, 2.0, 30.0),
+	'other':      (1, 0.0, 0.0),
+}
+
+
+class PdfError(Exception):
+	"""
+	The source PDF couldn't be obtained (upload mode)
+	"""
+	pass
+
+
+def classify_status(status):
+	"""
+	HTTP status of a grobid answer => error class (None if ok)
+	"""
+	if status == 200:
+		return None
+	elif status == 503:
+		return 'overload'
+	elif status >= 500:
+		return 'server'
+	elif status >= 400:
+		return 'client'
+	else:
+		return 'other'
+
+
+def classify_exception(e):
+	"""
+	Exception raised by a grobid request => error class
+	"""
+	if isinstance(e, PdfError):
+		return 'pdf'
+	if isinstance(e, (SocketTimeout, AsyncTimeout)):
+		return 'timeout'
+	if isinstance(e, URLError):
+		if isinstance(e.reason, SocketTimeout):
+			return 'timeout'
+		return 'connection'
+	if isinstance(e, (OSError, HTTPException)):
+		return 'connection'
+	return 'other'
+
+
+def is_refused(e):
+	"""
+	True if the connection itself was refused (nothing listens on the
+	backend port), as opposed to a connection reset or a read error
+	"""
+	if isinstance(e, URLError):
+		e = e.reason
+	return isinstance(e, ConnectionRefusedError)
+
+
+def describe(e):
+	"""
+	Short text of an exception for logs (its class name if no message)
+	"""
+	return str(getattr(e, 'reason', e)) or e.__class__.__name__
+
+
+class RetryPolicies(object):
+	"""
+	Per error class retry decisions
+	"""
+	def __init__(self, policies=None):
+		self.policies = dict(DEFAULT_POLICIES)
+		if policies:
+			self.policies.update(policies)
+
+	@classmethod
+	def from_config(cls, section):
+		"""
+		Policies from a config section (missing classes keep the defaults)
+		"""
+		policies = {}
+		for err_class in DEFAULT_POLICIES:
+			if err_class in section:
+				fields = section[err_class].split()
+				default = DEFAULT_POLICIES[err_class]
+				policies[err_class] = (
+					int(fields[0]),
+					float(fields[1]) if len(fields) > 1 else default[1],
+					float(fields[2]) if len(fields) > 2 else default[2]
+					)
+		return cls(policies)
+
+	def delay(self, err_class, attempt):
+		"""
+		Seconds to wait before the next try after the given (1-based)
+		failed attempt, or None if no more tries for this error class
+		"""
+		(max_tries, base, cap) = self.policies.get(err_class, DEFAULT_POLICIES['other'])
+		if attempt >= max_tries:
+			return None
+		return uniform(0, min(cap, base * 2 ** (attempt - 1)))
@@ -0,0 +1,108 @@
+#! /usr/bin/python3
+"""
+Longest-job-first ordering of the documents to send to grobid
+
+Les documents sont envoyés dans l'ordre de l'API: si les plus longs PDF
+arrivent en fin de run, un seul worker grobid travaille encore pendant
+que tous les autres attendent. En envoyant les plus gros d'abord (LPT,
+"longest processing time first") la fin du run est faite de petits
+documents, qui se répartissent bien sur tous les workers.
+
+La taille vient des qualityIndicators de l'API (pdfPageCount,
+pdfWordCount ou pdfCharCount). Le tri est un tri par casiers sur une
+échelle logarithmique (BINS_PER_OCTAVE casiers par doublement de la
+taille): linéaire, stable dans chaque casier, et la mémoire en plus ne
+dépasse pas quelques octets par document.
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from math            import log2
+from array           import array
+
+from libbibget.idstore import IdStore
+
+# indicateurs de taille possibles (section qualityIndicators des hits)
+SIZE_INDICATORS = ('pdfPageCount', 'pdfWordCount', 'pdfCharCount')
+
+# finesse de l'échelle: 4 => casiers de tailles à ~19% près
+BINS_PER_OCTAVE = 4
+
+# taille inconnue (stockée dans un array d'entiers)
+UNKNOWN = -1
+
+
+def hit_size(hit, indicator='pdfPageCount'):
+	"""
+	Size indicator of an API hit, UNKNOWN if absent
+
+	ex: {'id': ..., 'qualityIndicators': {'pdfPageCount': 12}} => 12
+	"""
+	try:
+		return int(hit['qualityIndicators'][indicator])
+	except (KeyError, TypeError, ValueError):
+		return UNKNOWN
+
+
+def size_bin(size):
+	"""
+	Log-scale bin of a size (0 for 0)
+	"""
+	return int(BINS_PER_OCTAVE * log2(size + 1))
+
+
+def longest_first(ids, sizes):
+	"""
+	New IdStore with the ids ordered by decreasing size bin
+
+	   ids   -- IdStore (or sequence of ids)
+	   sizes -- sequence of sizes aligned with ids (UNKNOWN if unknown:
+	            these documents get the median bin of the known ones)
+
+	>>> longest_first(["A"*40, "B"*40, "C"*40, "D"*40], [1, 300, UNKNOWN, 20])[0] == "B"*40
+	True
+	"""
+	if len(ids) != len(sizes):
+		raise ValueError("longest_first: %i ids but %i sizes" % (len(ids), len(sizes)))
+
+	bins = array('H', (size_bin(s) if s != UNKNOWN else 0 for s in sizes))
+	n_bins = max(bins) + 1 if len(bins) else 1
+	counts = [0] * n_bins
+	for (b, s) in zip(bins, sizes):
+		if s != UNKNOWN:
+			counts[b] += 1
+
+	# taille inconnue => casier médian des tailles connues
+	n_known = sum(counts)
+	if n_known < len(sizes):
+		median_bin = 0
+		seen = 0
+		for b in range(n_bins):
+			seen += counts[b]
+			if 2 * seen >= n_known:
+				median_bin = b
+				break
+		for (j, s) in enumerate(sizes):
+			if s == UNKNOWN:
+				bins[j] = median_bin
+				counts[median_bin] += 1
+
+	# tri par casiers: position de départ de chaque casier, du plus grand au plus petit
+	starts = [0] * n_bins
+	pos = 0
+	for b in reversed(range(n_bins)):
+		starts[b] = pos
+		pos += counts[b]
+	order = array('L', bytes(array('L').itemsize * len(bins)))
+	for (j, b) in enumerate(bins):
+		order[starts[b]] = j
+		starts[b] += 1
+
+	ordered = IdStore()
+	for j in order:
+		ordered.append(ids[j])
+	return ordered
@@ -0,0 +1,52 @@
+#! /usr/bin/python3
+"""
+Producer/consumer helpers for bib-get --stream
+
+Un thread producteur remplit une queue bornée (ex: pages de hits de
+l'API) pendant que les workers consomment déjà les premiers éléments.
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from queue           import Queue
+from threading       import Thread
+
+# marqueur de fin de flux
+_END = object()
+
+
+def threaded_iter(iterable, maxsize=10000):
+	"""
+	Iterates over iterable in a background thread through a bounded queue
+
+	  - le producteur bloque quand la queue est pleine
+	    (=> mémoire bornée quelle que soit la taille du flux)
+	  - une exception côté producteur (y compris exit()) est relancée
+	    côté consommateur au lieu de tuer silencieusement le thread
+	"""
+	items = Queue(maxsize=maxsize)
+	failure = []
+
+	def producer():
+		try:
+			for item in iterable:
+				items.put(item)
+		except BaseException as e:
+			failure.append(e)
+		finally:
+			items.put(_END)
+
+	Thread(target=producer, daemon=True).start()
+
+	while True:
+		item = items.get()
+		if item is _END:
+			break
+		yield item
+
+	if failure:
+		raise failure[0]
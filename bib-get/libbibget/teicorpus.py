@@ -0,0 +1,183 @@
+#! /usr/bin/python3
+"""
+Incremental teiCorpus writer for bib-get --group_output
+
+Chaque TEI individuelle est ajoutée au teiCorpus dès que son document
+est fini (au lieu d'une concaténation de tous les fichiers en fin de
+run), par copie dans le noyau: os.copy_file_range, sinon os.sendfile,
+sinon read/write classique.
+
+Options:
+  - compression gzip ou zstd de la sortie (zstd: module 'zstandard')
+    NB: la compression passe forcément par l'espace utilisateur
+  - ordered: les TEI sont d'abord écrites dans un fichier temporaire
+    dans leur ordre d'arrivée puis une passe finale les recopie dans
+    l'ordre demandé (ex: celui de la liste d'entrée)
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+import os
+from os              import path, remove
+from array           import array
+from shutil          import copyfileobj
+import gzip
+
+from libbibget.idstore import IdStore
+
+# compression zstd optionnelle
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+# extension ajoutée au nom du teiCorpus selon la compression
+COMPRESSION_EXT = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+FOOTER = "</teiCorpus>\n"
+
+
+def copy_fd(in_fd, out_fd, count, offset=None):
+	"""
+	Copies count bytes from in_fd (at offset, or at its current position
+	if None) to the current position of out_fd, without going through
+	python buffers when the OS allows it
+	"""
+	while count > 0:
+		n = 0
+		try:
+			if hasattr(os, 'copy_file_range'):
+				n = os.copy_file_range(in_fd, out_fd, count, offset)
+			else:
+				n = os.sendfile(out_fd, in_fd, offset, count)
+		except OSError:
+			# ex: systèmes de fichiers différents selon le noyau
+			n = 0
+		if n == 0:
+			# repli: copie classique du reste
+			if offset is None:
+				chunk = os.read(in_fd, min(count, 1 << 20))
+			else:
+				chunk = os.pread(in_fd, min(count, 1 << 20), offset)
+			if not chunk:
+				raise EOFError("copy_fd: source file shorter than expected")
+			n = os.write(out_fd, chunk)
+		count -= n
+		if offset is not None:
+			offset += n
+
+
+def open_output(out_path, compression='none'):
+	"""
+	Binary output file, compressed or not
+	(not compressed => unbuffered, writes go straight to the fd)
+	"""
+	if compression == 'gzip':
+		return gzip.open(out_path, 'wb')
+	elif compression == 'zstd':
+		if zstandard is None:
+			raise ImportError("zstd compression needs the 'zstandard' module (pip3 install zstandard)")
+		return zstandard.ZstdCompressor().stream_writer(open(out_path, 'wb'))
+	elif compression == 'none':
+		return open(out_path, 'wb', buffering=0)
+	else:
+		raise ValueError("unknown compression '%s' (none|gzip|zstd)" % compression)
+
+
+class TeiCorpusWriter(object):
+	"""
+	teiCorpus file built as the documents finish
+
+	Usage:
+	   writer = TeiCorpusWriter("corpus.xml", header_str)
+	   writer.add_file(id1, "dir/id1.refbibs.tei.xml")
+	   writer.add_empty(id2)
+	   writer.close()
+	"""
+	def __init__(self, out_path, header, compression='none', ordered=False):
+		self.out_path = out_path
+		self.compression = compression
+		self.ordered = ordered
+		self.n_docs = 0
+
+		if ordered:
+			# fichier de travail non compressé et positions de chaque TEI
+			self._work_path = out_path + '.unordered'
+			self._fh = open_output(self._work_path, 'none')
+			self._ids = IdStore()
+			self._offsets = array('Q')
+			self._lengths = array('Q')
+		else:
+			self._fh = open_output(out_path, compression)
+			self._write((header + "\n").encode('UTF-8'))
+		self._pos = 0
+
+	def _write(self, data):
+		self._fh.write(data)
+		return len(data)
+
+	def _entry(self, istex_id, length):
+		if self.ordered:
+			self._ids.append(istex_id)
+			self._offsets.append(self._pos)
+			self._lengths.append(length)
+		self._pos += length
+		self.n_docs += 1
+
+	def add_file(self, istex_id, tei_path):
+		"""
+		Appends the content of an individual TEI file
+		"""
+		src = open(tei_path, 'rb')
+		if self.compression == 'none' or self.ordered:
+			length = os.fstat(src.fileno()).st_size
+			copy_fd(src.fileno(), self._fh.fileno(), length)
+		else:
+			length = path.getsize(tei_path)
+			copyfileobj(src, self._fh)
+		src.close()
+		self._entry(istex_id, length)
+
+	def add_empty(self, istex_id):
+		"""
+		Appends an empty <TEI/> (document without result)
+		"""
+		self._entry(istex_id,
+		            self._write((' <TEI xml:id="istex-%s"/>\n' % istex_id).encode('UTF-8')))
+
+	def close(self, order=None, header=None):
+		"""
+		Writes the footer (ordered mode: first the final ordering pass)
+
+		   order  -- ordered mode: iterable of all the ids in final order
+		             (ids never added get an empty <TEI/>)
+		   header -- ordered mode: the header (written at this point,
+		             so it can give the final number of documents)
+		"""
+		if not self.ordered:
+			self._write(FOOTER.encode('UTF-8'))
+			self._fh.close()
+			return
+
+		self._fh.close()
+		work = open(self._work_path, 'rb')
+		out = open_output(self.out_path, self.compression)
+		out.write((header + "\n").encode('UTF-8'))
+		for istex_id in order:
+			try:
+				j = self._ids.index(istex_id)
+			except ValueError:
+				out.write((' <TEI xml:id="istex-%s"/>\n' % istex_id).encode('UTF-8'))
+				continue
+			if self.compression == 'none':
+				copy_fd(work.fileno(), out.fileno(), self._lengths[j], self._offsets[j])
+			else:
+				out.write(os.pread(work.fileno(), self._lengths[j], self._offsets[j]))
+		out.write(FOOTER.encode('UTF-8'))
+		out.close()
+		work.close()
+		remove(self._work_path)
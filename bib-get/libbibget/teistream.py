@@ -0,0 +1,207 @@
+#! /usr/bin/python3
+"""
+Single-pass streaming post-processing of grobid TEI (bytes => file)
+
+Même résultat que extract.postprocess_tei() mais en une seule passe sur
+les octets au fur et à mesure qu'ils arrivent (ex: lus sur la socket),
+écrits directement dans le fichier de sortie, sans décodage en str ni
+recherches regex sur la chaîne entière:
+  - entête <TEI> simplifiée (avec l'ID istex)
+  - tabulations => espaces (bytes.translate: pas de risque en UTF-8,
+    l'octet 0x09 n'apparaît jamais dans un caractère multi-octets)
+  - TEI vide si aucune refbib (<listBibl> vide: détecté en cours de
+    route, la sortie est alors remplacée à la fin)
+  - + décompte des <biblStruct> au passage (pour le ledger)
+
+Les motifs à cheval sur deux morceaux sont gérés par de courtes
+retenues (les derniers octets du morceau précédent).
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from os              import path, makedirs, rename, remove
+from re              import compile
+
+# racine telle que grobid l'écrit (cf. extract.postprocess_tei)
+GROBID_ROOT = (b'<TEI xmlns="http://www.tei-c.org/ns/1.0" xmlns:xlink="http://www.w3.org/1999/xlink" \n'
+               b' xmlns:mml="http://www.w3.org/1998/Math/MathML">')
+
+TABS_TO_SPACES = bytes.maketrans(b"\t", b" ")
+
+OPEN_LISTBIBL = b"<listBibl>"
+CLOSE_LISTBIBL = b"</listBibl>"
+BIBLSTRUCT = b"<biblStruct"
+void_listBibl = compile(rb"<listBibl>\s+</listBibl>")
+
+# au-delà, on renonce à trouver la racine <TEI ...> (sortie telle quelle)
+MAX_HEAD = 4096
+
+# sortie gardée jusqu'à cette taille avant d'écrire: une petite TEI sans
+# refbibs est remplacée sans avoir jamais touché au fichier
+OUT_BUFFER = 65536
+
+
+class TeiRewriter(object):
+	"""
+	Streaming post-processor of one grobid TEI
+
+	   istex_id -- the document (for the simplified root element)
+	   out      -- binary output, seekable (cf. close: TEI without refbibs
+	               longer than OUT_BUFFER)
+
+	Usage:
+	   rewriter = TeiRewriter(istex_id, out_file)
+	   for chunk in chunks:
+	       rewriter.feed(chunk)
+	   rewriter.close()
+	"""
+	def __init__(self, istex_id, out):
+		self.istex_id = istex_id
+		self.out = out
+		self.n_in = 0
+		self.n_out = 0
+		self.n_biblstruct = 0
+		self.void = False
+		# début du document, gardé jusqu'à la fin de la balise racine
+		self._head = b""
+		self._head_done = False
+		# retenues pour les motifs à cheval sur deux morceaux
+		self._bib_carry = b""
+		self._void_carry = b""
+		# sortie pas encore écrite
+		self._pending = []
+		self._n_pending = 0
+		self._flushed = False
+
+	def _write(self, data):
+		if data:
+			self._pending.append(data.translate(TABS_TO_SPACES))
+			self._n_pending += len(data)
+			self.n_out += len(data)
+			if self._n_pending >= OUT_BUFFER:
+				self._flush()
+
+	def _flush(self):
+		if self._pending:
+			self.out.write(b"".join(self._pending))
+			self._flushed = True
+		self._pending = []
+		self._n_pending = 0
+
+	def _scan(self, chunk):
+		# <biblStruct: la retenue est plus courte que le motif, donc
+		# aucune occurrence n'est comptée deux fois
+		data = self._bib_carry + chunk
+		self.n_biblstruct += data.count(BIBLSTRUCT)
+		self._bib_carry = data[-(len(BIBLSTRUCT)-1):]
+
+		if self.void:
+			return
+		data = self._void_carry + chunk
+		if void_listBibl.search(data):
+			self.void = True
+			self._void_carry = b""
+			return
+		# on ne retient que ce qui peut encore devenir un <listBibl> vide:
+		# un <listBibl> suivi seulement de blancs (+ début de </listBibl>)
+		at = data.rfind(OPEN_LISTBIBL)
+		if at >= 0 and CLOSE_LISTBIBL.startswith(data[at+len(OPEN_LISTBIBL):].lstrip()):
+			self._void_carry = data[at:]
+		else:
+			self._void_carry = data[-(len(OPEN_LISTBIBL)-1):]
+
+	def feed(self, chunk):
+		self.n_in += len(chunk)
+		self._scan(chunk)
+		if self.void:
+			# (la sortie sera remplacée par close)
+			return
+		if self._head_done:
+			self._write(chunk)
+			return
+
+		self._head += chunk
+		root_at = self._head.find(b"<TEI")
+		root_end = self._head.find(b">", root_at) if root_at >= 0 else -1
+		if root_end >= 0:
+			root_end += 1
+			if self._head[root_at:root_end] == GROBID_ROOT:
+				self._write(self._head[0:root_at])
+				self._write(('<TEI xml:id="istex-%s">' % self.istex_id).encode('UTF-8'))
+				self._write(self._head[root_end:])
+			else:
+				self._write(self._head)
+			self._head = b""
+			self._head_done = True
+		elif len(self._head) > MAX_HEAD:
+			self._write(self._head)
+			self._head = b""
+			self._head_done = True
+
+	def close(self):
+		"""
+		Flushes the rest (and writes the empty TEI if there was no refbib)
+		"""
+		if not self.void and self.n_in > 0:
+			self._write(self._head)
+			self._head = b""
+			self._flush()
+			return
+		# TEI vide de bibs: on ferme la balise TEI tout de suite
+		self._pending = []
+		self._n_pending = 0
+		if self._flushed:
+			self.out.seek(0)
+			self.out.truncate()
+		self.n_out = 0
+		self._write(('<TEI xml:id="istex-%s"/>' % self.istex_id).encode('UTF-8'))
+		self._flush()
+
+
+class TeiFileSink(object):
+	"""
+	Streams one grobid answer to its TEI file (via a .part file)
+
+	begin() at each try (a retry starts over), feed() for each chunk,
+	then commit() once the answer is complete or abort()
+	"""
+	def __init__(self, out_path, istex_id):
+		self.out_path = out_path
+		self.istex_id = istex_id
+		self._fh = None
+		self._rewriter = None
+
+	def begin(self):
+		if self._fh is None:
+			makedirs(path.dirname(self.out_path) or '.', exist_ok=True)
+			self._fh = open(self.out_path + '.part', 'wb')
+		else:
+			self._fh.seek(0)
+			self._fh.truncate()
+		self._rewriter = TeiRewriter(self.istex_id, self._fh)
+
+	def feed(self, chunk):
+		self._rewriter.feed(chunk)
+
+	def commit(self, stats=None):
+		"""
+		Finishes the file (rename of the .part: a TEI file that exists is
+		always complete) and puts its sizes in stats if given
+		"""
+		self._rewriter.close()
+		self._fh.close()
+		self._fh = None
+		rename(self.out_path + '.part', self.out_path)
+		if stats is not None:
+			stats['tei_bytes'] = self._rewriter.n_out
+			stats['n_biblstruct'] = self._rewriter.n_biblstruct
+
+	def abort(self):
+		if self._fh is not None:
+			self._fh.close()
+			self._fh = None
+			remove(self.out_path + '.part')
@@ -0,0 +1,250 @@
+#! /usr/bin/python3
+"""
+Live telemetry of a bib-get run
+
+Tenue à jour par le processus principal (1 appel à record() par
+document fini) et restituée par un thread à intervalle régulier:
+  - une ligne de progression sur stderr
+  - optionnellement un fichier d'état JSON
+  - optionnellement un "textfile" Prometheus
+    (à faire lire par le textfile collector de node_exporter)
+
+Mesures: débit glissant et moyen, latences grobid p50/p95/p99
+(sur les derniers documents), erreurs par classe, octets envoyés et
+reçus, ETA d'après le débit glissant.
+"""
+__author__    = "Romain Loth"
+__copyright__ = "Copyright 2015 INIST-CNRS (ISTEX project)"
+__license__   = "LGPL"
+__version__   = "0.1"
+__email__     = "romain.loth@inist.fr"
+__status__    = "Dev"
+
+from sys             import stderr
+from os              import rename
+from json            import dumps
+from time            import time
+from threading       import Thread, Lock, Event
+from collections     import deque, Counter
+
+
+def percentile(sorted_values, p):
+	"""
+	p-th percentile (0-100) of an already sorted list (nearest rank)
+	"""
+	if not sorted_values:
+		return None
+	rank = int(round(p / 100.0 * (len(sorted_values) - 1)))
+	return sorted_values[rank]
+
+
+def hms(seconds):
+	"""
+	4000 => '1h06m40s'
+	"""
+	m, s = divmod(int(seconds), 60)
+	h, m = divmod(m, 60)
+	return "%ih%02im%02is" % (h, m, s) if h else "%im%02is" % (m, s)
+
+
+def _write_atomic(file_path, text):
+	# (les lecteurs ne voient jamais de fichier à moitié écrit)
+	tmp_file = open(file_path + '.tmp', 'w')
+	tmp_file.write(text)
+	tmp_file.close()
+	rename(file_path + '.tmp', file_path)
+
+
+class Telemetry(object):
+	"""
+	Run counters + recent samples, with a periodic reporter
+
+	   n_total     -- expected number of documents (for the ETA)
+	   window      -- seconds of history for the rolling throughput
+	   max_samples -- number of recent latencies kept for percentiles
+	"""
+	def __init__(self, n_total=None, window=300.0, max_samples=10000):
+		self.n_total = n_total
+		self.window = window
+		self.t_start = time()
+		self.n_ok = 0
+		self.n_failed = 0
+		self.n_cached = 0
+		self.errors = Counter()
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self._done_times = deque()
+		self._latencies = deque(maxlen=max_samples)
+		self._lock = Lock()
+		self._stop = Event()
+		self._reporter = None
+		# sorties du reporter: (json_path, prom_path, labels)
+		self._outputs = (None, None, None)
+
+	def record(self, err_class=None, stats=None):
+		"""
+		One finished document
+
+		   err_class -- None if ok
+		   stats     -- optional dict with 'latency' (seconds),
+		                'bytes_in', 'bytes_out' and 'cached' (bool)
+		"""
+		now = time()
+		stats = stats or {}
+		with self._lock:
+			if err_class is None:
+				self.n_ok += 1
+			else:
+				self.n_failed += 1
+				self.errors[err_class] += 1
+			if stats.get('cached'):
+				self.n_cached += 1
+			if stats.get('latency') is not None:
+				self._latencies.append(stats['latency'])
+			self.bytes_in += stats.get('bytes_in') or 0
+			self.bytes_out += stats.get('bytes_out') or 0
+			self._done_times.append(now)
+			while self._done_times and self._done_times[0] < now - self.window:
+				self._done_times.popleft()
+
+	def snapshot(self):
+		"""
+		Current state as a dict (cf. write_json)
+		"""
+		now = time()
+		with self._lock:
+			elapsed = now - self.t_start
+			n_done = self.n_ok + self.n_failed
+			latencies = sorted(self._latencies)
+			# débit glissant: sur la fenêtre (ou depuis le début si plus court)
+			span = min(self.window, elapsed)
+			n_recent = sum(1 for t in self._done_times if t >= now - span)
+			snap = {
+				'elapsed_seconds': round(elapsed, 1),
+				'docs_total': self.n_total,
+				'docs_done': n_done,
+				'docs_ok': self.n_ok,
+				'docs_failed': self.n_failed,
+				'docs_cached': self.n_cached,
+				'errors': dict(self.errors),
+				'error_rate': (self.n_failed / n_done) if n_done else 0.0,
+				'throughput_rolling': (n_recent / span) if span > 0 else 0.0,
+				'throughput_avg': (n_done / elapsed) if elapsed > 0 else 0.0,
+				'latency_p50': percentile(latencies, 50),
+				'latency_p95': percentile(latencies, 95),
+				'latency_p99': percentile(latencies, 99),
+				'bytes_in': self.bytes_in,
+				'bytes_out': self.bytes_out,
+				'eta_seconds': None,
+			}
+		if self.n_total is not None and snap['throughput_rolling'] > 0:
+			snap['eta_seconds'] = round(max(0, self.n_total - n_done)
+			                            / snap['throughput_rolling'], 1)
+		return snap
+
+	def progress_line(self, snap):
+		"""
+		One line summary for the log
+		"""
+		def secs(x):
+			return "-" if x is None else "%.2fs" % x
+		return ("done: %i%s  %.2f docs/s  latency p50/p95/p99 %s/%s/%s  errors %.1f%%%s" % (
+		        snap['docs_done'],
+		        "" if snap['docs_total'] is None else "/%i" % snap['docs_total'],
+		        snap['throughput_rolling'],
+		        secs(snap['latency_p50']), secs(snap['latency_p95']), secs(snap['latency_p99']),
+		        100 * snap['error_rate'],
+		        "" if snap['eta_seconds'] is None else "  ETA %s" % hms(snap['eta_seconds'])))
+
+	def write_json(self, json_path, snap):
+		_write_atomic(json_path, dumps(snap, indent=2, sort_keys=True) + "\n")
+
+	def write_prometheus(self, prom_path, snap, labels=None):
+		"""
+		Prometheus text exposition format (for the node_exporter textfile collector)
+		"""
+		def lbl(extra=None):
+			all_labels = dict(labels or {})
+			all_labels.update(extra or {})
+			if not all_labels:
+				return ""
+			return "{%s}" % ",".join('%s="%s"' % (k, all_labels[k]) for k in sorted(all_labels))
+		lines = [
+			"# HELP bibget_docs_done_total Documents finished by bib-get",
+			"# TYPE bibget_docs_done_total counter",
+			"bibget_docs_done_total%s %i" % (lbl({'result': 'ok'}), snap['docs_ok']),
+			"bibget_docs_done_total%s %i" % (lbl({'result': 'failed'}), snap['docs_failed']),
+			"# HELP bibget_docs_cached_total Documents served from the result cache",
+			"# TYPE bibget_docs_cached_total counter",
+			"bibget_docs_cached_total%s %i" % (lbl(), snap['docs_cached']),
+			"# HELP bibget_errors_total Failed documents by error class",
+			"# TYPE bibget_errors_total counter",
+		]
+		for err_class in sorted(snap['errors']):
+			lines.append("bibget_errors_total%s %i" % (lbl({'class': err_class}), snap['errors'][err_class]))
+		lines += [
+			"# HELP bibget_throughput_docs_per_second Rolling throughput",
+			"# TYPE bibget_throughput_docs_per_second gauge",
+			"bibget_throughput_docs_per_second%s %f" % (lbl(), snap['throughput_rolling']),
+			"# HELP bibget_grobid_latency_seconds Latency of recent grobid requests",
+			"# TYPE bibget_grobid_latency_seconds summary",
+		]
+		for (q, quantile) in (('50', '0.5'), ('95', '0.95'), ('99', '0.99')):
+			value = snap['latency_p' + q]
+			if value is not None:
+				lines.append("bibget_grobid_latency_seconds%s %f" % (lbl({'quantile': quantile}), value))
+		lines += [
+			"# HELP bibget_bytes_total Bytes sent to (out) and received from (in) grobid",
+			"# TYPE bibget_bytes_total counter",
+			"bibget_bytes_total%s %i" % (lbl({'direction': 'in'}), snap['bytes_in']),
+			"bibget_bytes_total%s %i" % (lbl({'direction': 'out'}), snap['bytes_out']),
+		]
+		if snap['docs_total'] is not None:
+			lines += [
+				"# HELP bibget_docs_total Documents expected in the run",
+				"# TYPE bibget_docs_total gauge",
+				"bibget_docs_total%s %i" % (lbl(), snap['docs_total']),
+			]
+		if snap['eta_seconds'] is not None:
+			lines += [
+				"# HELP bibget_eta_seconds Estimated remaining time",
+				"# TYPE bibget_eta_seconds gauge",
+				"bibget_eta_seconds%s %f" % (lbl(), snap['eta_seconds']),
+			]
+		_write_atomic(prom_path, "\n".join(lines) + "\n")
+
+	def report(self, json_path=None, prom_path=None, labels=None, log=True):
+		snap = self.snapshot()
+		if log:
+			print(self.progress_line(snap), file=stderr)
+		if json_path:
+			self.write_json(json_path, snap)
+		if prom_path:
+			self.write_prometheus(prom_path, snap, labels)
+
+	def start_reporter(self, interval, json_path=None, prom_path=None, labels=None):
+		"""
+		Reports every interval seconds from a daemon thread (until stop())
+
+		   json_path -- optional JSON status file
+		   prom_path -- optional Prometheus textfile (*.prom)
+		   labels    -- optional dict of labels for the Prometheus metrics
+		"""
+		self._outputs = (json_path, prom_path, labels)
+		def report_loop():
+			while not self._stop.wait(interval):
+				try:
+					self.report(*self._outputs)
+				except OSError as e:
+					print("WARN: telemetry: %s" % e, file=stderr)
+		self._reporter = Thread(target=report_loop, daemon=True)
+		self._reporter.start()
+
+	def stop(self):
+		"""
+		Stops the reporter and writes the final state
+		"""
+		self._stop.set()
+		if self._reporter is not None:
+			self._reporter.join()
+		self.report(*self._outputs)
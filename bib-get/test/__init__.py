@@ -0,0 +1,4 @@
+"""
+This package contains automated code tests for bib-get (offline: no API
+nor grobid-service needed, run from bib-get with python3 -m unittest).
+"""
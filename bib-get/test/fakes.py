@@ -0,0 +1,10 @@
+#! /usr/bin/python3
+"""
+Shared fake data for the tests (no API nor grobid-service needed)
+"""
+from hashlib          import sha1
+
+
+def fake_ids(n, salt=''):
+	"n distinct ISTEX-like ids (40 hex chars, upper case)"
+	return [sha1(("%s%i" % (salt, i)).encode()).hexdigest().upper() for i in range(n)]
@@ -0,0 +1,182 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+import asyncio
+from threading        import Thread, current_thread
+from unittest.mock    import patch
+from io               import StringIO
+
+# the tested module
+from libbibget import aio_dispatch
+from libbibget.aio_dispatch import KeepAlivePool, run_dispatch
+from libbibget.balancer     import Balancer, Backend
+from libbibget.retry        import RetryPolicies
+
+# shared fake data
+from test.fakes      import fake_ids
+
+
+class StubServer(object):
+	"""
+	Minimal HTTP/1.1 server in its own thread and event loop
+
+	   /doc/<id>     -- 200, Content-Length
+	   /chunked/<id> -- 200, chunked (with a chunk extension and a trailer)
+	   /busy/<id>    -- 503 the first time, then 200
+	   (one_per_conn: the connection is closed after each answer, without
+	    a 'Connection: close' header, like an idle keep-alive timeout)
+	"""
+	def __init__(self):
+		self.one_per_conn = False
+		self.n_conns = 0
+		self.n_requests = 0
+		self.busy_seen = set()
+		self.loop = asyncio.new_event_loop()
+		self.thread = Thread(target=self.loop.run_forever, daemon=True)
+		self.thread.start()
+		self.server = asyncio.run_coroutine_threadsafe(
+			asyncio.start_server(self.handle, '127.0.0.1', 0), self.loop).result()
+		self.port = self.server.sockets[0].getsockname()[1]
+
+	def close(self):
+		async def shutdown():
+			# (+ les connexions encore ouvertes côté serveur)
+			self.server.close()
+			handlers = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+			for task in handlers:
+				task.cancel()
+			await asyncio.gather(*handlers, return_exceptions=True)
+		asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join()
+		self.loop.close()
+
+	async def handle(self, reader, writer):
+		self.n_conns += 1
+		while True:
+			line = await reader.readline()
+			if not line:
+				break
+			(method, target, version) = line.decode('latin-1').split()
+			headers = {}
+			while True:
+				header = await reader.readline()
+				if header in (b"\r\n", b""):
+					break
+				(k, _, v) = header.decode('latin-1').partition(":")
+				headers[k.strip().lower()] = v.strip()
+			await reader.readexactly(int(headers.get('content-length', 0)))
+			self.n_requests += 1
+			(route, _, istex_id) = target[1:].partition('/')
+			content = ("<TEI>%s</TEI>" % istex_id).encode('UTF-8') * 20
+			if route == 'busy' and istex_id not in self.busy_seen:
+				self.busy_seen.add(istex_id)
+				writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n")
+			elif route == 'chunked':
+				writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+				for i in range(0, len(content), 7):
+					piece = content[i:i+7]
+					writer.write(b"%x;ext=1\r\n%s\r\n" % (len(piece), piece))
+				writer.write(b"0\r\nX-Trailer: 1\r\n\r\n")
+			else:
+				writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %i\r\n\r\n%s" % (len(content), content))
+			await writer.drain()
+			if self.one_per_conn:
+				break
+		writer.close()
+
+
+def expected_content(istex_id):
+	return ("<TEI>%s</TEI>" % istex_id).encode('UTF-8') * 20
+
+
+class TestAioDispatch(unittest.TestCase):
+	def setUp(self):
+		self.server = StubServer()
+		# (les nouvelles tentatives sont signalées sur stderr)
+		self.quiet = patch.object(aio_dispatch, 'stderr', StringIO())
+		self.quiet.start()
+
+	def tearDown(self):
+		self.quiet.stop()
+		self.server.close()
+
+	def requests(self, targets):
+		"GET targets one after the other on one pool => answers"
+		async def get_all():
+			pool = KeepAlivePool('127.0.0.1', self.server.port, maxconn=1)
+			answers = [await pool.get(target) for target in targets]
+			pool.close()
+			return answers
+		return asyncio.run(get_all())
+
+	def test_1_content_length_keepalive(self):
+		"Checks Content-Length bodies, several requests on one connection"
+		ids = fake_ids(3)
+		answers = self.requests(["/doc/%s" % i for i in ids])
+		for (istex_id, (status, headers, content)) in zip(ids, answers):
+			self.assertEqual(status, 200)
+			self.assertEqual(content, expected_content(istex_id))
+		self.assertEqual(self.server.n_conns, 1)
+
+	def test_2_chunked(self):
+		"Checks chunked bodies (extensions and trailers skipped)"
+		ids = fake_ids(2)
+		answers = self.requests(["/chunked/%s" % i for i in ids] + ["/doc/%s" % ids[0]])
+		self.assertEqual([a[2] for a in answers],
+		                 [expected_content(ids[0]), expected_content(ids[1]), expected_content(ids[0])])
+		self.assertEqual(answers[0][1]['transfer-encoding'], 'chunked')
+		# la connexion reste utilisable après une réponse chunked
+		self.assertEqual(self.server.n_conns, 1)
+
+	def test_3_idle_connection_closed(self):
+		"Checks a keep-alive connection closed by the server is retried on a fresh one"
+		self.server.one_per_conn = True
+		ids = fake_ids(3)
+		answers = self.requests(["/doc/%s" % i for i in ids])
+		self.assertEqual([a[2] for a in answers], [expected_content(i) for i in ids])
+		self.assertEqual(self.server.n_conns, 3)
+		self.assertEqual(self.server.n_requests, 3)
+
+	def test_4_run_dispatch(self):
+		"Checks run_dispatch: each id once with its own answer, 503 retried"
+		ids = fake_ids(200)
+		balancer = Balancer([Backend('127.0.0.1', self.server.port, 1, 8)])
+		retry = RetryPolicies({'overload': (3, 0.01, 0.01)})
+		results = []
+		threads = set()
+		def on_result(istex_id, status, content, err=None, stats=None):
+			threads.add(current_thread())
+			results.append((istex_id, status, content, err, stats['tries']))
+		def target_for_id(istex_id):
+			route = ('busy', 'chunked', 'doc')[int(istex_id[0:2], 16) % 3]
+			return "/%s/%s" % (route, istex_id)
+
+		run_dispatch(iter(ids), target_for_id, balancer, on_result, retry=retry)
+
+		self.assertEqual(sorted(r[0] for r in results), sorted(ids))
+		for (istex_id, status, content, err, tries) in results:
+			self.assertIsNone(err)
+			self.assertEqual(status, 200)
+			self.assertEqual(content, expected_content(istex_id))
+			self.assertEqual(tries, 2 if target_for_id(istex_id).startswith('/busy') else 1)
+		# callback: un seul thread, hors de la boucle d'événements
+		self.assertEqual(len(threads), 1)
+		self.assertNotEqual(threads.pop(), current_thread())
+		# toutes les places rendues
+		self.assertEqual(balancer.acquire(block=False), 0)
+
+	def test_5_retry_exhausted(self):
+		"Checks the last answer goes to on_result when the tries are exhausted"
+		balancer = Balancer([Backend('127.0.0.1', self.server.port, 1, 2)])
+		results = []
+		run_dispatch(["A" * 40], lambda i: "/busy/%s" % i, balancer,
+		             lambda istex_id, status, content, err=None, stats=None: results.append((status, stats['tries'])),
+		             retry=RetryPolicies({'overload': (1, 0.0, 0.0)}))
+		self.assertEqual(results, [(503, 1)])
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
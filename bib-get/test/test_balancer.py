@@ -0,0 +1,66 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from unittest.mock    import patch
+from io               import StringIO
+
+# the tested module
+from libbibget import balancer
+from libbibget.balancer import Balancer, Backend, parse_backends
+
+
+class TestBalancer(unittest.TestCase):
+	def setUp(self):
+		# (les backends retirés sont signalés sur stderr)
+		self.quiet = patch.object(balancer, 'stderr', StringIO())
+		self.quiet.start()
+
+	def tearDown(self):
+		self.quiet.stop()
+
+	def test_1_parse_backends(self):
+		"Checks backend lines: host:port [weight] [capacity], comments"
+		backends = parse_backends("\n a.fr:8080 \n# b.fr:1\n c.fr:80  2  18\n", default_capacity=5)
+		self.assertEqual([(b.host, b.port, b.weight, b.capacity) for b in backends],
+		                 [('a.fr', 8080, 1.0, 5), ('c.fr', 80, 2.0, 18)])
+		for bad in ("", "a.fr", "a.fr:http", "a.fr:80 0"):
+			with self.assertRaises(ValueError):
+				parse_backends(bad)
+
+	def test_2_least_outstanding(self):
+		"Checks picks by outstanding requests per weight, within capacity"
+		bal = Balancer([Backend('a', 1, 1, 2), Backend('b', 2, 2, 3)])
+		picks = [bal.acquire(block=False) for k in range(6)]
+		self.assertEqual(sorted(picks[:5]), [0, 0, 1, 1, 1])
+		# tous pleins
+		self.assertIsNone(picks[5])
+		bal.release(0, 0.1)
+		self.assertEqual(bal.acquire(block=False), 0)
+
+	def test_3_connection_errors(self):
+		"Checks a backend is removed after consecutive errors, not after one"
+		bal = Balancer([Backend('a', 1, 1, 4), Backend('b', 2, 1, 4)], down_after=3)
+		for k in range(5):
+			bal.connect_failed(0)
+			bal.connect_failed(0)
+			# une réponse de ce backend remet son compteur à zéro
+			i = bal.acquire(block=False)
+			self.assertEqual(i, 0)
+			bal.release(i, 0.1)
+		self.assertEqual(bal.alive_indices(), [0, 1])
+		for k in range(3):
+			bal.connect_failed(1)
+		self.assertEqual(bal.alive_indices(), [0])
+
+	def test_4_refused(self):
+		"Checks a refused connection removes the backend at once"
+		bal = Balancer([Backend('a', 1, 1, 4), Backend('b', 2, 1, 4)])
+		bal.connect_failed(1, refused=True)
+		self.assertEqual(bal.alive_indices(), [0])
+		self.assertEqual([bal.acquire(block=False) for k in range(5)], [0, 0, 0, 0, None])
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
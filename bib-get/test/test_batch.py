@@ -0,0 +1,123 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path, makedirs
+from tempfile         import mkdtemp
+
+# the tested module
+from libbibget import batch
+from libbibget.batch import Job, read_manifest, merge_ids, save_jobs, read_jobs, split_results
+from libbibget.idstore import IdStore
+
+# shared fake data
+from test.fakes      import fake_ids
+
+
+def write_file(file_path, text):
+	fh = open(file_path, 'w')
+	fh.write(text)
+	fh.close()
+
+
+def read_lines(file_path):
+	fh = open(file_path, 'r')
+	lines = fh.read().split()
+	fh.close()
+	return lines
+
+
+class TestBatch(unittest.TestCase):
+	def setUp(self):
+		self.tmp = mkdtemp()
+		self.manifest = path.join(self.tmp, 'manifest.ini')
+
+	def test_1_manifest(self):
+		"Checks jobs read from a manifest (relative paths, default out dir, maxi)"
+		write_file(self.manifest,
+		           "[nature-1990]\nq = corpusName:nature AND publicationDate:1990\nmaxi = 500\n\n"
+		           "[springer_gold]\nlist = lists/gold.txt\nout = out/gold\n")
+		jobs = read_manifest(self.manifest, '/data/run-jobs')
+		self.assertEqual([j.name for j in jobs], ['nature-1990', 'springer_gold'])
+		self.assertEqual(jobs[0].query, "corpusName:nature AND publicationDate:1990")
+		self.assertEqual(jobs[0].maxi, 500)
+		self.assertEqual(jobs[0].out, '/data/run-jobs/nature-1990')
+		self.assertEqual(jobs[1].list_path, path.join(self.tmp, 'lists', 'gold.txt'))
+		self.assertIsNone(jobs[1].maxi)
+		self.assertEqual(jobs[1].out, path.join(self.tmp, 'out', 'gold'))
+
+	def test_2_invalid_manifests(self):
+		"Checks invalid manifests are refused (q and list, unknown key, bad name...)"
+		for text in ["[a]\nq = *\nlist = l.txt\n",
+		             "[a]\nmaxi = 3\n",
+		             "[a]\nq = *\nquery = *\n",
+		             "[a b]\nq = *\n",
+		             "[a/../b]\nq = *\n",
+		             "[a]\nq = *\n[a]\nq = **\n",
+		             "# no job\n"]:
+			write_file(self.manifest, text)
+			with self.assertRaises(ValueError, msg=text):
+				read_manifest(self.manifest, self.tmp)
+
+	def test_3_merge_ids(self):
+		"Checks ids shared by several jobs are processed once, in order"
+		ids = fake_ids(5)
+		jobs = [Job('a', query='*'), Job('b', query='x'), Job('c', query='y')]
+		jobs[0].ids = IdStore(ids[0:3])
+		jobs[1].ids = IdStore([ids[2], ids[3], ids[0]])
+		jobs[2].ids = IdStore([ids[4], ids[4]])
+		(all_ids, n_total) = merge_ids(jobs)
+		self.assertEqual(list(all_ids), [ids[0], ids[1], ids[2], ids[3], ids[4]])
+		self.assertEqual(n_total, 8)
+
+	def test_4_saved_jobs(self):
+		"Checks the jobs saved in the run dir are read back (ids, maxi, out)"
+		ids = fake_ids(4)
+		jobs = [Job('a', query='*', maxi=2, out=path.join(self.tmp, 'out-a')),
+		        Job('b', list_path=path.join(self.tmp, 'l.txt'), out=path.join(self.tmp, 'out-b'))]
+		jobs[0].ids = IdStore(ids[0:2])
+		jobs[1].ids = IdStore(ids[1:4])
+		outdir = path.join(self.tmp, 'run')
+		save_jobs(outdir, jobs)
+		self.assertTrue(batch.has_jobs(outdir))
+		saved = read_jobs(outdir)
+		for (job, saved_job) in zip(jobs, saved):
+			self.assertEqual(saved_job.name, job.name)
+			self.assertEqual(saved_job.query, job.query)
+			self.assertEqual(saved_job.list_path, job.list_path)
+			self.assertEqual(saved_job.maxi, job.maxi)
+			self.assertEqual(saved_job.out, job.out)
+			self.assertEqual(list(saved_job.ids), list(job.ids))
+
+	def test_5_split_results(self):
+		"Checks each job dir gets its TEI files, job.ids and job.missing"
+		ids = fake_ids(4)
+		outdir = path.join(self.tmp, 'run')
+		def tei_path(istex_id):
+			return path.join(outdir, istex_id[0:2], istex_id + '.tei.xml')
+		# TEI des 3 premiers seulement
+		for istex_id in ids[0:3]:
+			makedirs(path.dirname(tei_path(istex_id)), exist_ok=True)
+			write_file(tei_path(istex_id), '<TEI xml:id="istex-%s"/>' % istex_id)
+		jobs = [Job('a', query='*', out=path.join(self.tmp, 'out-a')),
+		        Job('b', query='x', out=path.join(self.tmp, 'out-b'))]
+		jobs[0].ids = IdStore(ids[0:2])
+		jobs[1].ids = IdStore(ids[1:4])
+		summary = split_results(jobs, outdir, tei_path)
+		self.assertEqual([(s[1], s[2]) for s in summary], [(2, 0), (2, 1)])
+		out_b = jobs[1].out
+		self.assertEqual(read_lines(path.join(out_b, batch.JOB_IDS_NAME)), ids[1:4])
+		self.assertEqual(read_lines(path.join(out_b, batch.JOB_MISSING_NAME)), [ids[3]])
+		self.assertEqual(read_lines(path.join(jobs[0].out, batch.JOB_MISSING_NAME)), [])
+		# mêmes chemins relatifs que dans le dossier du run
+		for istex_id in ids[1:3]:
+			self.assertTrue(path.isfile(path.join(out_b, istex_id[0:2], istex_id + '.tei.xml')))
+		self.assertFalse(path.exists(path.join(out_b, ids[3][0:2], ids[3] + '.tei.xml')))
+		# une 2e répartition (reprise) remplace les liens existants
+		split_results(jobs, outdir, tei_path)
+		self.assertTrue(path.isfile(path.join(out_b, ids[1][0:2], ids[1] + '.tei.xml')))
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
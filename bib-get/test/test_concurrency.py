@@ -0,0 +1,90 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from unittest.mock    import patch
+from io               import StringIO
+
+# the tested module
+from libbibget import concurrency
+from libbibget.concurrency import AIMDLimiter
+
+
+class TestAIMDLimiter(unittest.TestCase):
+	def setUp(self):
+		# horloge simulée (cf. AIMDLimiter._decrease)
+		self.now = 1000.0
+		self.clock = patch.object(concurrency, 'time', lambda: self.now)
+		self.clock.start()
+		# (les changements de limite sont écrits sur stderr)
+		self.quiet = patch.object(concurrency, 'stderr', StringIO())
+		self.quiet.start()
+
+	def tearDown(self):
+		self.clock.stop()
+		self.quiet.stop()
+
+	def test_1_additive_increase(self):
+		"Checks +1 per window of limit answers, up to the capacity"
+		lim = AIMDLimiter([10], initial=2)
+		self.assertEqual(lim.limit(0), 2)
+		# à pleine charge: +1/limite par réponse (2 => 2.5 => 2.9 => 3.24)
+		lim.update(0, 0.1, inflight=1)
+		lim.update(0, 0.1, inflight=1)
+		self.assertEqual(lim.limit(0), 2)
+		lim.update(0, 0.1, inflight=1)
+		self.assertEqual(lim.limit(0), 3)
+		for k in range(200):
+			lim.update(0, 0.1, inflight=lim.limit(0) - 1)
+		self.assertEqual(lim.limit(0), 10)
+
+	def test_2_no_increase_below_limit(self):
+		"Checks the limit doesn't grow when it isn't even reached"
+		lim = AIMDLimiter([10], initial=4)
+		for k in range(50):
+			lim.update(0, 0.1, inflight=1)
+		self.assertEqual(lim.limit(0), 4)
+
+	def test_3_overload_backoff(self):
+		"Checks 503/timeout: limit cut to inflight then halved, once per round trip"
+		lim = AIMDLimiter([32], initial=16)
+		lim.update(0, 1.0, inflight=15)
+		lim.update(0, None, overload=True, inflight=12)
+		self.assertEqual(lim.limit(0), 6)
+		# même rafale (< 2 x latence récente): pas de 2e division
+		self.now += 0.5
+		lim.update(0, None, overload=True, inflight=12)
+		self.assertEqual(lim.limit(0), 6)
+		self.now += 5
+		lim.update(0, None, overload=True, inflight=12)
+		self.assertEqual(lim.limit(0), 3)
+
+	def test_4_latency_backoff(self):
+		"Checks x0.9 when the recent latency exceeds tolerance x baseline"
+		lim = AIMDLimiter([32], initial=20, tolerance=2.0)
+		for k in range(20):
+			lim.update(0, 0.1, inflight=0)
+		self.assertEqual(lim.limit(0), 20)
+		for k in range(30):
+			self.now += 10
+			lim.update(0, 2.0, inflight=0)
+		self.assertLess(lim.limit(0), 20)
+		self.assertGreater(lim._recent[0], 2.0 * lim._baseline[0])
+
+	def test_5_min_limit(self):
+		"Checks the limit never goes below min_limit (nor starts outside bounds)"
+		lim = AIMDLimiter([8, 4], initial=6, min_limit=2)
+		self.assertEqual(lim.limit(0), 6)
+		self.assertEqual(lim.limit(1), 4)
+		for k in range(20):
+			self.now += 10
+			lim.update(0, None, overload=True, inflight=0)
+		self.assertEqual(lim.limit(0), 2)
+		# l'autre backend n'est pas touché
+		self.assertEqual(lim.limit(1), 4)
+		self.assertEqual(AIMDLimiter([8], initial=0, min_limit=3).limit(0), 3)
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
@@ -0,0 +1,140 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path, listdir
+from tempfile         import mkdtemp
+from threading        import Thread, Lock
+from urllib.parse     import urlsplit, parse_qs
+from http.server      import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# the tested module
+from libbibget.extract   import Extractor
+from libbibget.balancer  import Backend
+from libbibget.retry     import RetryPolicies
+from libbibget.teistream import TeiFileSink, GROBID_ROOT
+
+# shared fake data
+from test.fakes      import fake_ids
+
+GROBID_TEI = (b'<?xml version="1.0" encoding="UTF-8"?>\n' + GROBID_ROOT
+              + b'\n\t<text>\n\t\t<back>\n\t\t<listBibl>'
+              + b'\n\t\t\t<biblStruct xml:id="b0"/>\n\t\t\t<biblStruct xml:id="b1"/>'
+              + b'\n\t\t</listBibl>\n\t\t</back>\n\t</text>\n</TEI>\n')
+
+# retries sans attente
+FAST_RETRY = RetryPolicies({c: (3, 0.01, 0.01) for c in ('overload', 'server', 'connection', 'other')})
+
+
+class StubGrobid(object):
+	"""
+	processReferencesViaUrl in a thread: answers for each ID in turn
+	the statuses listed in script[ID] (then 200), 'cut' for an answer
+	cut before its end
+	"""
+	def __init__(self, script):
+		self.script = script
+		self.requests = []
+		lock = Lock()
+		stub = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+			def do_GET(self):
+				pdf_url = parse_qs(urlsplit(self.path).query)['pdf_url'][0]
+				istex_id = pdf_url.split('/')[-3]
+				with lock:
+					stub.requests.append(istex_id)
+					todo = stub.script.get(istex_id, [])
+					status = todo.pop(0) if todo else 200
+				if status == 'cut':
+					self.send_response(200)
+					self.send_header('Content-Length', str(len(GROBID_TEI)))
+					self.end_headers()
+					self.wfile.write(GROBID_TEI[:50])
+					self.close_connection = True
+					return
+				body = GROBID_TEI if status == 200 else b'busy'
+				self.send_response(status)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+			def log_message(self, *args):
+				pass
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.port = self.server.server_port
+		self.thread = Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.thread.join()
+
+
+class TestExtract(unittest.TestCase):
+	def setUp(self):
+		self.ids = fake_ids(4)
+		self.stub = StubGrobid({
+			self.ids[1]: [503],
+			self.ids[2]: [500, 500, 500],
+			self.ids[3]: ['cut'],
+			})
+		self.extractor = Extractor([Backend('127.0.0.1', self.stub.port, 1, 2)],
+		                           api_host='api.test', api_scheme='http',
+		                           retry=FAST_RETRY, timeout=5, log_retries=False)
+
+	def tearDown(self):
+		self.stub.close()
+
+	def test_1_extract(self):
+		"Checks if extract yields post-processed TEIs, and failures with their error"
+		results = {r[0]: r for r in self.extractor.extract(self.ids[0:3])}
+		(istex_id, tei_bytes, stats) = results[self.ids[0]]
+		self.assertIn(b'<TEI xml:id="istex-%s">' % istex_id.encode(), tei_bytes)
+		self.assertEqual(stats['status'], 200)
+		self.assertEqual(stats['tries'], 1)
+		self.assertEqual(stats['n_biblstruct'], 2)
+		self.assertEqual(stats['backend'], '127.0.0.1:%i' % self.stub.port)
+		(istex_id, tei_bytes, stats) = results[self.ids[2]]
+		self.assertIsNone(tei_bytes)
+		self.assertEqual(stats['err_class'], 'server')
+		self.assertEqual(stats['error'], 'HTTP 500')
+		self.assertEqual(stats['tries'], 3)
+
+	def test_2_retry_after_503(self):
+		"Checks if a 503 is retried on the same document then succeeds"
+		(istex_id, result, failure, stats) = self.extractor.process(self.ids[1])
+		self.assertIsNone(failure)
+		self.assertEqual(result, GROBID_TEI)
+		self.assertEqual(stats['tries'], 2)
+		self.assertEqual(self.stub.requests, [self.ids[1]] * 2)
+		# la requête est bien celle de processReferencesViaUrl
+		self.assertEqual(self.extractor.target(self.ids[1]),
+		                 "/processReferencesViaUrl?pdf_url=http://api.test/document/%s/fulltext/pdf" % self.ids[1])
+
+	def test_3_sink(self):
+		"Checks if a streamed answer cut short starts over, and a failed one is aborted"
+		out_dir = mkdtemp()
+		# réponse coupée puis complète: le fichier ne garde que la 2e
+		sink = TeiFileSink(path.join(out_dir, 'cut.tei.xml'), self.ids[3])
+		(istex_id, result, failure, stats) = self.extractor.process(self.ids[3], sink)
+		self.assertIsNone(failure)
+		self.assertIsNone(result)
+		self.assertEqual(stats['tries'], 2)
+		sink.commit(stats)
+		self.assertEqual(stats['n_biblstruct'], 2)
+		with open(path.join(out_dir, 'cut.tei.xml'), 'rb') as fh:
+			self.assertEqual(fh.read().count(b'<TEI xml:id='), 1)
+		# échec définitif: abort ne laisse aucun fichier
+		sink = TeiFileSink(path.join(out_dir, 'failed.tei.xml'), self.ids[2])
+		(istex_id, result, failure, stats) = self.extractor.process(self.ids[2], sink)
+		self.assertEqual(failure, ('server', 'HTTP 500'))
+		sink.abort()
+		self.assertEqual(listdir(out_dir), ['cut.tei.xml'])
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
@@ -0,0 +1,81 @@
+#! /usr/bin/python3
+
+import unittest
+
+# the tested module
+from libbibget.idstore import IdStore
+
+# shared fake data
+from test.fakes      import fake_ids
+
+
+class TestIdStore(unittest.TestCase):
+	def test_1_append_and_read(self):
+		"Checks if ids come back in order, upper case, by index and slice"
+		ids = fake_ids(10)
+		store = IdStore(ids[:5])
+		for istex_id in ids[5:]:
+			store.append(istex_id.lower())
+		self.assertEqual(len(store), 10)
+		self.assertEqual(list(store), ids)
+		self.assertEqual(store[3], ids[3])
+		self.assertEqual(store[-1], ids[-1])
+		self.assertIsInstance(store[2:8], IdStore)
+		self.assertEqual(list(store[2:8]), ids[2:8])
+		self.assertEqual(list(store[::3]), ids[::3])
+		with self.assertRaises(IndexError):
+			store[10]
+		with self.assertRaises(ValueError):
+			store.append("not an id")
+
+	def test_2_contains_and_index(self):
+		"Checks membership and positions (first occurrence of a duplicate)"
+		ids = fake_ids(100)
+		store = IdStore(ids)
+		store.append(ids[7])
+		for i, istex_id in enumerate(ids):
+			self.assertIn(istex_id, store)
+			self.assertEqual(store.index(istex_id), i)
+		self.assertEqual(store.index(ids[7]), 7)
+		for istex_id in fake_ids(100, salt='other'):
+			self.assertNotIn(istex_id, store)
+		self.assertNotIn("too short", store)
+		self.assertNotIn(None, store)
+		with self.assertRaises(ValueError):
+			store.index(fake_ids(1, salt='other')[0])
+
+	def test_3_index_growth(self):
+		"Checks if the hash index stays right while growing after a lookup"
+		ids = fake_ids(5000)
+		store = IdStore(ids[:3])
+		# index construit ici, puis agrandi plusieurs fois par append
+		self.assertIn(ids[0], store)
+		for i, istex_id in enumerate(ids[3:], 3):
+			store.append(istex_id)
+			if i % 97 == 0:
+				self.assertIn(istex_id, store)
+		self.assertGreaterEqual(len(store._index), 2 * len(store))
+		for i in range(0, 5000, 7):
+			self.assertEqual(store.index(ids[i]), i)
+		self.assertNotIn(fake_ids(1, salt='other')[0], store)
+
+	def test_4_chunks_and_lines(self):
+		"Checks chunks (sizes, contents) and from_lines (empty, invalid lines)"
+		ids = fake_ids(25)
+		store = IdStore(ids)
+		chunks = list(store.chunks(10))
+		self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+		self.assertEqual([istex_id for chunk in chunks for istex_id in chunk], ids)
+		self.assertEqual(list(IdStore().chunks(10)), [])
+
+		bad = []
+		lines = [ids[0] + "\n", "\n", "  " + ids[1] + "  \n", "junk\n"]
+		store = IdStore.from_lines(lines, on_error=bad.append)
+		self.assertEqual(list(store), ids[:2])
+		self.assertEqual(bad, ["junk"])
+		with self.assertRaises(ValueError):
+			IdStore.from_lines(lines)
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
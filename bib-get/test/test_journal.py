@@ -0,0 +1,89 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path
+from tempfile         import mkdtemp
+
+# the tested module
+from libbibget import journal
+
+# shared fake data
+from test.fakes      import fake_ids
+
+
+class TestJournal(unittest.TestCase):
+	def setUp(self):
+		self.outdir = mkdtemp()
+		self.ids = fake_ids(10)
+
+	def test_1_todo(self):
+		"Checks the todo list is read back as written"
+		journal.save_todo(self.outdir, self.ids)
+		self.assertEqual(list(journal.read_todo(self.outdir)), self.ids)
+
+	def test_2_journal_and_dead_letter(self):
+		"Checks ok and failed ids of an earlier run (retried, crashed...)"
+		run = journal.RunJournal(self.outdir)
+		run.done(self.ids[0])
+		run.failed(self.ids[1], "HTTP 500", 'server')
+		run.failed(self.ids[2], "timeout\terror\n(60s)", 'timeout')
+		run.done(self.ids[1])
+		run.close()
+		# arrêt brutal: dernière ligne incomplète
+		journal_file = open(path.join(self.outdir, journal.JOURNAL_NAME), 'a')
+		journal_file.write("OK\t%s" % self.ids[3])
+		journal_file.close()
+
+		(ok_ids, failed) = journal.read_journal(self.outdir)
+		self.assertEqual(list(ok_ids), [self.ids[0], self.ids[1]])
+		self.assertEqual(failed, {self.ids[2]: "timeout error (60s)"})
+		self.assertEqual(list(journal.read_dead_letter(self.outdir)), self.ids[1:3])
+
+		# --retry-failed: l'ancienne dead-letter passe en .prev
+		run = journal.RunJournal(self.outdir, new_dead_letter=True)
+		run.close()
+		self.assertEqual(len(journal.read_dead_letter(self.outdir)), 0)
+		self.assertTrue(path.exists(path.join(self.outdir, journal.DEAD_LETTER_NAME + '.prev')))
+
+	def test_3_no_earlier_run(self):
+		"Checks an output dir without journal nor dead-letter"
+		(ok_ids, failed) = journal.read_journal(self.outdir)
+		self.assertEqual((len(ok_ids), failed), (0, {}))
+		self.assertEqual(len(journal.read_dead_letter(self.outdir)), 0)
+		self.assertIsNone(journal.read_stream_state(self.outdir))
+
+	def test_4_interrupted_stream(self):
+		"Checks a stream todo is marked complete only once the stream is exhausted"
+		journal.save_stream_state(self.outdir, 'corpusName:nature', 500)
+		ids_out = []
+		for istex_id in journal.tee_todo(self.outdir, iter(self.ids)):
+			ids_out.append(istex_id)
+			if len(ids_out) == 4:
+				# arrêt en cours de flux
+				break
+		state = journal.read_stream_state(self.outdir)
+		self.assertEqual(state, {'q': 'corpusName:nature', 'maxi': 500, 'complete': False})
+		self.assertEqual(list(journal.read_todo(self.outdir)), self.ids[:4])
+
+		# reprise: la suite du flux est ajoutée à run.todo
+		ids_out += list(journal.tee_todo(self.outdir, iter(self.ids[4:]), append=True))
+		self.assertEqual(ids_out, self.ids)
+		self.assertEqual(list(journal.read_todo(self.outdir)), self.ids)
+		self.assertTrue(journal.read_stream_state(self.outdir)['complete'])
+
+	def test_5_failing_stream(self):
+		"Checks a stream that raises is not marked complete"
+		def broken_stream():
+			yield self.ids[0]
+			raise IOError("API down")
+		journal.save_stream_state(self.outdir, 'q', None)
+		with self.assertRaises(IOError):
+			list(journal.tee_todo(self.outdir, broken_stream()))
+		self.assertFalse(journal.read_stream_state(self.outdir)['complete'])
+		self.assertEqual(list(journal.read_todo(self.outdir)), self.ids[:1])
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
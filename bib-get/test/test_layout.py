@@ -0,0 +1,34 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path
+
+# the tested module
+from libbibget.layout import shard_path, shard_dir
+
+ISTEX_ID = "21B88F4EFBA46DC85E863709CA9824DEED7B7BFC"
+
+
+class TestLayout(unittest.TestCase):
+	def test_1_shard_path(self):
+		"Checks the file path of a document for 0, 1 and 2 levels of sub-dirs"
+		ext = '.refbibs.tei.xml'
+		self.assertEqual(shard_path('out', ISTEX_ID, ext),
+		                 path.join('out', ISTEX_ID + ext))
+		self.assertEqual(shard_path('out', ISTEX_ID, ext, 0),
+		                 path.join('out', ISTEX_ID + ext))
+		self.assertEqual(shard_path('out', ISTEX_ID, ext, 1),
+		                 path.join('out', '21', ISTEX_ID + ext))
+		self.assertEqual(shard_path('out', ISTEX_ID, ext, 2),
+		                 path.join('out', '21', 'B8', ISTEX_ID + ext))
+
+	def test_2_shard_dir(self):
+		"Checks the sub-dir of a document (the base dir itself at level 0)"
+		self.assertEqual(shard_dir('/data/out', ISTEX_ID), '/data/out')
+		self.assertEqual(shard_dir('/data/out', ISTEX_ID, 2), '/data/out/21/B8')
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
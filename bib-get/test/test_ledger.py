@@ -0,0 +1,94 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path
+from tempfile         import mkdtemp
+
+# the tested module
+from libbibget.ledger import Ledger, MeanCost, read_ledger, find_ledger
+
+# shared fake data
+from test.fakes      import fake_ids
+
+
+class TestLedger(unittest.TestCase):
+	def write_rows(self, fmt):
+		outdir = mkdtemp()
+		ids = fake_ids(3)
+		ledger = Ledger(outdir, fmt)
+		ledger.write(ids[0], None, {'status': 200, 'tries': 1, 'latency': 1.23456,
+		                            'pdf_bytes': 5000, 'tei_bytes': 800,
+		                            'n_biblstruct': 12, 'worker': 4,
+		                            'backend': 'localhost:8070'})
+		ledger.write(ids[1], ('server', 'HTTP 500'), {'status': 500, 'tries': 3})
+		ledger.write(ids[2], None, {'status': 200, 'tries': 1, 'cached': True})
+		ledger.close()
+		return (outdir, ids)
+
+	def check_rows(self, rows, ids):
+		self.assertEqual([r['id'] for r in rows], ids)
+		self.assertEqual(rows[0]['status'], 200)
+		self.assertEqual(rows[0]['grobid_seconds'], 1.2346)
+		self.assertEqual(rows[0]['pdf_bytes'], 5000)
+		self.assertEqual(rows[0]['n_biblstruct'], 12)
+		self.assertEqual(rows[0]['backend'], 'localhost:8070')
+		self.assertIsNone(rows[0]['err_class'])
+		self.assertEqual(rows[0]['cached'], 0)
+		self.assertEqual(rows[1]['err_class'], 'server')
+		self.assertEqual(rows[1]['tries'], 3)
+		self.assertIsNone(rows[1]['grobid_seconds'])
+		self.assertEqual(rows[2]['cached'], 1)
+
+	def test_1_csv_round_trip(self):
+		"Checks if CSV ledger rows are read back with their types"
+		(outdir, ids) = self.write_rows('csv')
+		self.assertTrue(find_ledger(outdir).endswith('run.ledger.csv'))
+		self.check_rows(list(read_ledger(find_ledger(outdir))), ids)
+
+	def test_2_jsonl_round_trip(self):
+		"Checks if JSON lines ledger rows are read back"
+		(outdir, ids) = self.write_rows('jsonl')
+		self.assertTrue(find_ledger(outdir).endswith('run.ledger.jsonl'))
+		self.check_rows(list(read_ledger(find_ledger(outdir))), ids)
+
+	def test_3_resumed_ledger(self):
+		"Checks if a resumed run appends to the same CSV (a single header)"
+		(outdir, ids) = self.write_rows('csv')
+		ledger = Ledger(outdir, 'csv')
+		ledger.write('X'*40, None, {'status': 200})
+		ledger.close()
+		rows = list(read_ledger(find_ledger(outdir)))
+		self.assertEqual([r['id'] for r in rows], ids + ['X'*40])
+		with self.assertRaises(ValueError):
+			Ledger(outdir, 'xml')
+
+	def test_4_mean_cost(self):
+		"Checks if the mean skips cached, non-200 and unmeasured rows"
+		rows = [
+			{'status': 200, 'cached': 0, 'grobid_seconds': 2.0},
+			{'status': 200, 'cached': 0, 'grobid_seconds': 4.0},
+			{'status': 200, 'cached': 1, 'grobid_seconds': 0.01},
+			{'status': 503, 'cached': 0, 'grobid_seconds': 30.0},
+			{'status': None, 'cached': 0, 'grobid_seconds': None},
+			{'status': 200, 'cached': 0, 'grobid_seconds': None},
+		]
+		mean_cost = MeanCost.from_rows(rows)
+		self.assertEqual(mean_cost.n_rows, 2)
+		self.assertEqual(mean_cost.mean_seconds, 3.0)
+		self.assertEqual(mean_cost.estimate(10, 4), 7.5)
+		self.assertIsNone(MeanCost.from_rows(rows[2:]))
+
+	def test_5_from_ledgers(self):
+		"Checks if the mean is measured over several ledgers, missing ones skipped"
+		(outdir_a, ids) = self.write_rows('csv')
+		(outdir_b, ids) = self.write_rows('jsonl')
+		mean_cost = MeanCost.from_ledgers([find_ledger(outdir_a), find_ledger(outdir_b),
+		                                   path.join(outdir_a, 'absent.csv')])
+		self.assertEqual(mean_cost.n_rows, 2)
+		self.assertAlmostEqual(mean_cost.mean_seconds, 1.2346)
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
@@ -0,0 +1,89 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path, listdir
+from tempfile         import mkdtemp
+from hashlib          import sha256
+from unittest.mock    import patch
+from io               import StringIO
+
+# the tested module
+from libbibget import pdfcache
+from libbibget.pdfcache import PdfCache, prefetch
+
+# shared fake data
+from test.fakes      import fake_ids
+
+
+def fake_pdf(text):
+	return b'%PDF-1.4\n' + text.encode('ascii') + b'\n%%EOF\n'
+
+
+class TestPdfCache(unittest.TestCase):
+	def setUp(self):
+		self.cache = PdfCache(mkdtemp())
+		self.ids = fake_ids(3)
+		# (les entrées corrompues sont signalées sur stderr)
+		self.warnings = StringIO()
+		self.quiet = patch.object(pdfcache, 'stderr', self.warnings)
+		self.quiet.start()
+
+	def tearDown(self):
+		self.quiet.stop()
+
+	def test_1_content_addressing(self):
+		"Checks PDFs are stored once by sha256, whatever the number of ids"
+		self.assertIsNone(self.cache.get(self.ids[0]))
+		self.assertNotIn(self.ids[0], self.cache)
+		self.cache.put(self.ids[0], fake_pdf('same'))
+		self.cache.put(self.ids[1], fake_pdf('same'))
+		self.cache.put(self.ids[2], fake_pdf('other'))
+		self.assertIn(self.ids[0], self.cache)
+		self.assertEqual(self.cache.get(self.ids[1]), fake_pdf('same'))
+		self.assertEqual(self.cache.get(self.ids[2]), fake_pdf('other'))
+		digest = sha256(fake_pdf('same')).hexdigest()
+		self.assertTrue(path.isfile(path.join(self.cache.cache_dir, 'sha256', digest[0:2], digest)))
+		n_blobs = sum(len(listdir(path.join(self.cache.cache_dir, 'sha256', d)))
+		              for d in listdir(path.join(self.cache.cache_dir, 'sha256')))
+		self.assertEqual(n_blobs, 2)
+
+	def test_2_corrupted_entry(self):
+		"Checks a truncated PDF in the cache is dropped then downloaded again"
+		self.cache.put(self.ids[0], fake_pdf('content'))
+		digest = sha256(fake_pdf('content')).hexdigest()
+		blob_path = path.join(self.cache.cache_dir, 'sha256', digest[0:2], digest)
+		blob_file = open(blob_path, 'wb')
+		blob_file.write(fake_pdf('content')[0:5])
+		blob_file.close()
+		self.assertIsNone(self.cache.get(self.ids[0]))
+		self.assertFalse(path.exists(blob_path))
+		self.assertIn(self.ids[0], self.warnings.getvalue())
+		# fetch: retéléchargé puis de nouveau servi par le cache
+		downloads = []
+		def fake_download(url, timeout=60, limiter=None):
+			downloads.append(url)
+			return fake_pdf('content')
+		with patch.object(pdfcache, 'download_pdf', fake_download):
+			self.assertEqual(self.cache.fetch(self.ids[0], 'http://api/pdf'), fake_pdf('content'))
+			self.assertEqual(self.cache.fetch(self.ids[0], 'http://api/pdf'), fake_pdf('content'))
+		self.assertEqual(downloads, ['http://api/pdf'])
+
+	def test_3_prefetch(self):
+		"Checks prefetch passes all the ids through in order, failures included"
+		ids = fake_ids(20)
+		def fake_download(url, timeout=60, limiter=None):
+			if url == ids[5]:
+				raise ValueError("not a pdf: %s" % url)
+			return fake_pdf(url)
+		with patch.object(pdfcache, 'download_pdf', fake_download):
+			passed = list(prefetch(ids, self.cache, lambda istex_id: istex_id, n_threads=3, ahead=4))
+		self.assertEqual(passed, ids)
+		self.assertEqual(self.cache.get(ids[7]), fake_pdf(ids[7]))
+		self.assertNotIn(ids[5], self.cache)
+		self.assertIn(ids[5], self.warnings.getvalue())
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
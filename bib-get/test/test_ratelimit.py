@@ -0,0 +1,53 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path
+from io               import BytesIO
+from tempfile         import mkdtemp
+from time             import time
+
+# the tested module
+from libbibget import ratelimit
+from libbibget.ratelimit import RateLimiter, read_limited
+
+# l'autre copie du module (absente si bib-get est utilisé seul)
+LIBCONSULTE_COPY = path.join(path.dirname(path.abspath(ratelimit.__file__)),
+                             '..', '..', 'bib-adapt-corpus', 'libconsulte', 'ratelimit.py')
+
+
+class TestRateLimit(unittest.TestCase):
+	def test_1_copies_in_sync(self):
+		"Checks if the libconsulte copy of the module is identical (same state files)"
+		if not path.exists(LIBCONSULTE_COPY):
+			self.skipTest("no libconsulte next to bib-get")
+		with open(ratelimit.__file__, 'rb') as ours, open(LIBCONSULTE_COPY, 'rb') as theirs:
+			self.assertEqual(ours.read(), theirs.read())
+
+	def test_2_shared_budget(self):
+		"Checks if two limiters on the same state file share one budget"
+		state_file = path.join(mkdtemp(), 'bucket')
+		lim_a = RateLimiter(state_file, rate=20)
+		lim_b = RateLimiter(state_file, rate=20)
+		t0 = time()
+		# 20 d'un coup (burst commun) puis 10 à 20/s
+		for i in range(15):
+			lim_a.acquire()
+			lim_b.acquire()
+		self.assertGreaterEqual(time() - t0, 0.45)
+		lim_a.close()
+		lim_b.close()
+
+	def test_3_read_limited(self):
+		"Checks if read_limited returns the whole body and pays its bytes"
+		state_file = path.join(mkdtemp(), 'bucket')
+		limiter = RateLimiter(state_file, bytes_rate=1000000)
+		body = b'x' * 300000
+		self.assertEqual(read_limited(BytesIO(body), limiter, chunk_size=65536), body)
+		self.assertEqual(read_limited(BytesIO(body)), body)
+		limiter.close()
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
@@ -0,0 +1,121 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path, listdir
+from json             import loads
+from tempfile         import mkdtemp
+
+# the tested module
+from libbibget.refbibs import bib_records, RefbibShards
+
+# shared fake data
+from test.fakes      import fake_ids
+
+# réponse de grobid (abrégée): article, monographie, bib hors listBibl
+GROBID_TEI = b"""<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0">
+ <teiHeader/>
+ <text>
+  <back>
+   <div type="references">
+    <listBibl>
+     <biblStruct xml:id="b0">
+      <analytic>
+       <title level="a" type="main">On the   electrodynamics
+         of moving bodies</title>
+       <author><persName><forename type="first">A</forename><forename type="middle">B</forename><surname>Einstein</surname></persName></author>
+       <author><persName><surname>Grossmann</surname></persName></author>
+      </analytic>
+      <monogr>
+       <title level="j">Annalen der Physik</title>
+       <imprint>
+        <biblScope unit="volume">17</biblScope>
+        <biblScope unit="issue">10</biblScope>
+        <biblScope unit="page" from="891" to="921" />
+        <date type="published" when="1905-06" />
+       </imprint>
+      </monogr>
+      <idno type="doi">10.1002/andp.19053221004</idno>
+     </biblStruct>
+     <biblStruct>
+      <monogr>
+       <title level="m">Trait\xc3\xa9 de la lumi\xc3\xa8re</title>
+       <author><persName><forename>Christiaan</forename><surname>Huygens</surname></persName></author>
+       <imprint>
+        <publisher>Van der Aa</publisher>
+        <date>vers 1690</date>
+       </imprint>
+      </monogr>
+     </biblStruct>
+    </listBibl>
+   </div>
+  </back>
+ </text>
+</TEI>
+"""
+
+
+class TestRefbibs(unittest.TestCase):
+	def test_1_records(self):
+		"Checks the fields of the records of a grobid TEI"
+		records = bib_records("ABC", GROBID_TEI)
+		self.assertEqual(records[0], {
+			'doc': "ABC", 'bib': "b0", 'n': 0,
+			'title': "On the electrodynamics of moving bodies",
+			'authors': [{'surname': "Einstein", 'forename': "A B"}, {'surname': "Grossmann"}],
+			'journal': "Annalen der Physik",
+			'date': "1905-06", 'year': 1905,
+			'volume': "17", 'issue': "10", 'page_first': "891", 'page_last': "921",
+			'doi': "10.1002/andp.19053221004",
+			})
+		# monographie sans xml:id: clé b<n>, année tirée du texte
+		self.assertEqual(records[1], {
+			'doc': "ABC", 'bib': "b1", 'n': 1,
+			'title': "Traité de la lumière",
+			'authors': [{'surname': "Huygens", 'forename': "Christiaan"}],
+			'date': "vers 1690", 'year': 1690,
+			'publisher': "Van der Aa",
+			})
+
+	def test_2_no_bibs(self):
+		"Checks TEI without refbibs, bibs outside listBibl, bad xml"
+		self.assertEqual(bib_records("ABC", b'<TEI xml:id="istex-ABC"/>'), [])
+		loose = GROBID_TEI.replace(b"<listBibl>", b"<div>").replace(b"</listBibl>", b"</div>")
+		self.assertEqual(len(bib_records("ABC", loose)), 2)
+		with self.assertRaises(Exception):
+			bib_records("ABC", b"<TEI><back>")
+
+	def test_3_shards(self):
+		"Checks the shard of each document, one line per record, unique (doc, bib)"
+		out_dir = path.join(mkdtemp(), 'refbibs')
+		shards = RefbibShards(out_dir, 4)
+		ids = fake_ids(40)
+		for istex_id in ids:
+			shards.write_doc(istex_id, bib_records(istex_id, GROBID_TEI))
+		shards.write_doc(ids[0], [])
+		shards.close()
+
+		self.assertTrue(set(listdir(out_dir)) <= {"refbibs-%02x.jsonl" % i for i in range(4)})
+		keys = set()
+		n_lines = 0
+		for shard_name in listdir(out_dir):
+			shard_file = open(path.join(out_dir, shard_name), encoding='UTF-8')
+			for line in shard_file:
+				record = loads(line)
+				# le fichier d'un document dépend de son ID
+				self.assertEqual(shards.shard_path(record['doc']), path.join(out_dir, shard_name))
+				self.assertEqual(int(record['doc'][0:2], 16) % 4, int(shard_name[8:10], 16))
+				keys.add((record['doc'], record['bib']))
+				n_lines += 1
+			shard_file.close()
+		self.assertEqual(keys, {(i, b) for i in ids for b in ("b0", "b1")})
+		self.assertEqual(n_lines, len(keys))
+
+		with self.assertRaises(ValueError):
+			RefbibShards(out_dir, 0)
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
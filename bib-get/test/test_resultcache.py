@@ -0,0 +1,65 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path, listdir
+from tempfile         import mkdtemp
+
+# the tested module
+from libbibget.resultcache import ResultCache, models_fingerprint
+
+# shared fake data
+from test.fakes      import fake_ids
+
+MODELS = ['citation', 'name-citation', 'date']
+
+
+class TestResultCache(unittest.TestCase):
+	def setUp(self):
+		self.cache_dir = mkdtemp()
+		self.ids = fake_ids(3)
+
+	def test_1_hit_and_miss(self):
+		"Checks stored results are served back, other ids are misses"
+		cache = ResultCache(self.cache_dir, MODELS, 'processReferencesViaUrl')
+		self.assertIsNone(cache.get(self.ids[0]))
+		cache.put(self.ids[0], b'<TEI>0</TEI>')
+		self.assertEqual(cache.get(self.ids[0]), b'<TEI>0</TEI>')
+		self.assertIsNone(cache.get(self.ids[1]))
+		self.assertEqual(cache.n_hits, 1)
+		# une entrée réécrite remplace l'ancienne, sans .part restant
+		cache.put(self.ids[0], b'<TEI>new</TEI>')
+		self.assertEqual(cache.get(self.ids[0]), b'<TEI>new</TEI>')
+		entry_dir = path.dirname(cache._path(self.ids[0]))
+		self.assertEqual(listdir(entry_dir), [self.ids[0] + '.tei.xml'])
+
+	def test_2_models_change(self):
+		"Checks a change of models (or route) is a miss, the old entries are kept"
+		cache = ResultCache(self.cache_dir, MODELS, 'processReferencesViaUrl')
+		cache.put(self.ids[0], b'<TEI>0</TEI>')
+		# même ensemble de modèles, autre ordre: même empreinte
+		same = ResultCache(self.cache_dir, list(reversed(MODELS)), 'processReferencesViaUrl')
+		self.assertEqual(same.fingerprint, cache.fingerprint)
+		self.assertEqual(same.get(self.ids[0]), b'<TEI>0</TEI>')
+		new_models = ResultCache(self.cache_dir, MODELS + ['affiliation-address'], 'processReferencesViaUrl')
+		self.assertIsNone(new_models.get(self.ids[0]))
+		other_route = ResultCache(self.cache_dir, MODELS, 'processReferences')
+		self.assertIsNone(other_route.get(self.ids[0]))
+		self.assertEqual(sorted(listdir(self.cache_dir)),
+		                 sorted([cache.fingerprint, new_models.fingerprint, other_route.fingerprint]))
+		self.assertEqual(ResultCache(self.cache_dir, MODELS, 'processReferencesViaUrl').get(self.ids[0]),
+		                 b'<TEI>0</TEI>')
+
+	def test_3_models_file(self):
+		"Checks the models of a fingerprint are listed in its dir"
+		cache = ResultCache(self.cache_dir, MODELS, 'route')
+		self.assertEqual(len(cache.fingerprint), 16)
+		self.assertEqual(cache.fingerprint, models_fingerprint(MODELS, 'route'))
+		models_file = open(path.join(self.cache_dir, cache.fingerprint, 'models.txt'))
+		self.assertEqual(models_file.read().split(), ['route'] + sorted(MODELS))
+		models_file.close()
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
@@ -0,0 +1,75 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from unittest.mock    import patch
+from socket           import timeout as SocketTimeout
+from urllib.error     import URLError
+from http.client      import IncompleteRead
+from configparser     import ConfigParser
+import asyncio
+
+# the tested module
+from libbibget import retry
+from libbibget.retry import RetryPolicies, PdfError, classify_status, classify_exception, is_refused, describe
+
+
+class TestRetry(unittest.TestCase):
+	def test_1_delay(self):
+		"Checks the exponential delays (full jitter upper bounds), caps and tries"
+		policies = RetryPolicies({'server': (4, 2.0, 5.0)})
+		# tirage remplacé par sa borne haute
+		with patch.object(retry, 'uniform', lambda a, b: b):
+			self.assertEqual(policies.delay('server', 1), 2.0)
+			self.assertEqual(policies.delay('server', 2), 4.0)
+			self.assertEqual(policies.delay('server', 3), 5.0)
+			self.assertIsNone(policies.delay('server', 4))
+			# classes non modifiées: valeurs par défaut
+			self.assertEqual(policies.delay('overload', 1), 2.0)
+			self.assertIsNone(policies.delay('client', 1))
+			# classe inconnue: comme 'other' (pas de nouvelle tentative)
+			self.assertIsNone(policies.delay('unknown', 1))
+		for k in range(100):
+			self.assertTrue(0 <= policies.delay('server', 3) <= 5.0)
+
+	def test_2_from_config(self):
+		"Checks config lines: tries [initial delay] [max delay]"
+		conf = ConfigParser()
+		conf.read_string("[retry]\noverload = 9\ntimeout = 2 1 3\n")
+		policies = RetryPolicies.from_config(conf['retry'])
+		self.assertEqual(policies.policies['overload'], (9, 2.0, 60.0))
+		self.assertEqual(policies.policies['timeout'], (2, 1.0, 3.0))
+		self.assertEqual(policies.policies['server'], retry.DEFAULT_POLICIES['server'])
+
+	def test_3_classify_status(self):
+		"Checks HTTP status => error class"
+		self.assertIsNone(classify_status(200))
+		self.assertEqual(classify_status(503), 'overload')
+		self.assertEqual(classify_status(500), 'server')
+		self.assertEqual(classify_status(404), 'client')
+		self.assertEqual(classify_status(302), 'other')
+
+	def test_4_classify_exception(self):
+		"Checks exception => error class (urllib, socket, asyncio, pdf)"
+		self.assertEqual(classify_exception(PdfError("HTTP 404 on pdf")), 'pdf')
+		self.assertEqual(classify_exception(SocketTimeout()), 'timeout')
+		self.assertEqual(classify_exception(asyncio.TimeoutError()), 'timeout')
+		self.assertEqual(classify_exception(URLError(SocketTimeout())), 'timeout')
+		self.assertEqual(classify_exception(URLError(ConnectionRefusedError())), 'connection')
+		self.assertEqual(classify_exception(ConnectionResetError()), 'connection')
+		self.assertEqual(classify_exception(IncompleteRead(b"")), 'connection')
+		self.assertEqual(classify_exception(ValueError("bad xml")), 'other')
+
+	def test_5_refused_and_describe(self):
+		"Checks refused connections are told apart, and short error texts"
+		self.assertTrue(is_refused(ConnectionRefusedError()))
+		self.assertTrue(is_refused(URLError(ConnectionRefusedError())))
+		self.assertFalse(is_refused(ConnectionResetError()))
+		self.assertFalse(is_refused(URLError("no host")))
+		self.assertEqual(describe(URLError("no host")), "no host")
+		self.assertEqual(describe(ConnectionResetError()), "ConnectionResetError")
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
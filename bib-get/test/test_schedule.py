@@ -0,0 +1,60 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from random           import Random
+
+# the tested module
+from libbibget.schedule import longest_first, hit_size, size_bin, UNKNOWN
+from libbibget.idstore  import IdStore
+
+# shared fake data
+from test.fakes      import fake_ids
+
+
+class TestSchedule(unittest.TestCase):
+	def test_1_hit_size(self):
+		"Checks the size indicator of API hits (UNKNOWN if absent or bad)"
+		hit = {'id': 'x', 'qualityIndicators': {'pdfPageCount': 12, 'pdfWordCount': '3400'}}
+		self.assertEqual(hit_size(hit), 12)
+		self.assertEqual(hit_size(hit, 'pdfWordCount'), 3400)
+		self.assertEqual(hit_size(hit, 'pdfCharCount'), UNKNOWN)
+		self.assertEqual(hit_size({'id': 'x'}), UNKNOWN)
+		self.assertEqual(hit_size({'qualityIndicators': None}), UNKNOWN)
+		self.assertEqual(hit_size({'qualityIndicators': {'pdfPageCount': 'n/a'}}), UNKNOWN)
+
+	def test_2_decreasing_and_stable(self):
+		"Checks the order: decreasing size bins, input order inside a bin"
+		ids = fake_ids(500)
+		rand = Random(7)
+		sizes = [rand.choice([0, 1, 5, 30, 31, 200, 5000]) for i in ids]
+		ordered = longest_first(IdStore(ids), sizes)
+		self.assertIsInstance(ordered, IdStore)
+		self.assertEqual(sorted(ordered), sorted(ids))
+		size_of = dict(zip(ids, sizes))
+		pos_of = dict((istex_id, i) for (i, istex_id) in enumerate(ids))
+		for (a, b) in zip(ordered, ordered[1:]):
+			self.assertGreaterEqual(size_bin(size_of[a]), size_bin(size_of[b]))
+			if size_bin(size_of[a]) == size_bin(size_of[b]):
+				self.assertLess(pos_of[a], pos_of[b])
+
+	def test_3_unknown_sizes(self):
+		"Checks unknown sizes go to the median bin of the known ones"
+		ids = fake_ids(7)
+		sizes = [1, UNKNOWN, 1000, 30, UNKNOWN, 2, 30]
+		ordered = list(longest_first(ids, sizes))
+		# connus: 1000 > 30, 30 > 2 > 1 ; médiane: 30
+		self.assertEqual(ordered, [ids[2], ids[1], ids[3], ids[4], ids[6], ids[5], ids[0]])
+		# toutes inconnues: ordre d'entrée
+		self.assertEqual(list(longest_first(ids, [UNKNOWN] * 7)), ids)
+
+	def test_4_edge_cases(self):
+		"Checks empty input and misaligned sizes"
+		self.assertEqual(len(longest_first(IdStore(), [])), 0)
+		with self.assertRaises(ValueError):
+			longest_first(fake_ids(3), [1, 2])
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
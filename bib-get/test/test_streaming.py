@@ -0,0 +1,58 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from threading        import Event
+
+# the tested module
+from libbibget.streaming import threaded_iter
+
+
+class TestStreaming(unittest.TestCase):
+	def test_1_all_items(self):
+		"Checks all the items come through, in order, past the queue size"
+		self.assertEqual(list(threaded_iter(range(1000), maxsize=7)), list(range(1000)))
+		self.assertEqual(list(threaded_iter([])), [])
+
+	def test_2_producer_exception(self):
+		"Checks a producer exception is raised to the consumer after the items before it"
+		def failing_pages():
+			yield 'a'
+			yield 'b'
+			raise ConnectionError("api unreachable")
+		received = []
+		with self.assertRaises(ConnectionError):
+			for item in threaded_iter(failing_pages()):
+				received.append(item)
+		self.assertEqual(received, ['a', 'b'])
+
+	def test_3_producer_exit(self):
+		"Checks an exit() of the producer (eg api error handling) reaches the consumer"
+		def exiting_pages():
+			yield 'a'
+			exit(1)
+		with self.assertRaises(SystemExit):
+			list(threaded_iter(exiting_pages()))
+
+	def test_4_bounded_queue(self):
+		"Checks the producer blocks once the queue is full"
+		produced = []
+		too_far = Event()
+		def counting():
+			for i in range(100):
+				produced.append(i)
+				if i == 10:
+					too_far.set()
+				yield i
+		items = threaded_iter(counting(), maxsize=5)
+		self.assertEqual(next(items), 0)
+		# (le producteur ne doit pas aller jusque-là)
+		too_far.wait(0.2)
+		# maxsize dans la queue + 1 en main du consommateur + 1 en attente de put
+		self.assertLessEqual(len(produced), 5 + 2)
+		self.assertEqual(list(items), list(range(1, 100)))
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
@@ -0,0 +1,99 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path, listdir
+from tempfile         import mkdtemp
+import gzip
+
+# the tested module
+from libbibget.teicorpus import TeiCorpusWriter
+
+# shared fake data
+from test.fakes      import fake_ids
+
+HEADER = '<teiCorpus>\n<teiHeader/>'
+
+
+def tei_of(istex_id):
+	return ' <TEI xml:id="istex-%s"><text>é%s</text></TEI>\n' % (istex_id, "x" * (int(istex_id[0:2], 16) * 50))
+
+
+def empty_tei_of(istex_id):
+	return ' <TEI xml:id="istex-%s"/>\n' % istex_id
+
+
+class TestTeiCorpus(unittest.TestCase):
+	def setUp(self):
+		# une TEI individuelle par document (les 3 derniers: sans résultat)
+		self.tgt_dir = mkdtemp()
+		self.ids = fake_ids(20)
+		self.tei_paths = {}
+		for istex_id in self.ids[:-3]:
+			self.tei_paths[istex_id] = path.join(self.tgt_dir, istex_id + '.refbibs.tei.xml')
+			tei_file = open(self.tei_paths[istex_id], 'w')
+			tei_file.write(tei_of(istex_id))
+			tei_file.close()
+
+	def fill(self, writer, done_order):
+		for istex_id in done_order:
+			if istex_id in self.tei_paths:
+				writer.add_file(istex_id, self.tei_paths[istex_id])
+			else:
+				writer.add_empty(istex_id)
+
+	def expected(self, order):
+		return (HEADER + "\n"
+		        + "".join(tei_of(i) if i in self.tei_paths else empty_tei_of(i) for i in order)
+		        + "</teiCorpus>\n")
+
+	def test_1_done_order(self):
+		"Checks the teiCorpus in order of completion (no final pass)"
+		done_order = self.ids[::-1]
+		out_path = path.join(self.tgt_dir, 'corpus.xml')
+		writer = TeiCorpusWriter(out_path, HEADER)
+		self.fill(writer, done_order)
+		writer.close()
+		self.assertEqual(writer.n_docs, 20)
+		out_file = open(out_path, 'r')
+		self.assertEqual(out_file.read(), self.expected(done_order))
+		out_file.close()
+
+	def test_2_ordered(self):
+		"Checks ordered mode: input order, empty TEI for ids never added"
+		done_order = self.ids[5:] + self.ids[:2]
+		out_path = path.join(self.tgt_dir, 'corpus.xml')
+		writer = TeiCorpusWriter(out_path, None, ordered=True)
+		self.fill(writer, done_order)
+		writer.close(order=self.ids, header=HEADER)
+		self.assertEqual(writer.n_docs, 17)
+		out_file = open(out_path, 'r')
+		# (ids[2:5] jamais ajoutés => <TEI/> vides comme les sans résultat)
+		self.assertEqual(out_file.read(), self.expected(self.ids).replace(
+		                 "".join(tei_of(i) for i in self.ids[2:5]),
+		                 "".join(empty_tei_of(i) for i in self.ids[2:5])))
+		out_file.close()
+		# le fichier de travail a disparu
+		self.assertFalse(path.exists(out_path + '.unordered'))
+
+	def test_3_ordered_gzip(self):
+		"Checks ordered mode with a gzip output"
+		done_order = self.ids[::2] + self.ids[1::2]
+		out_path = path.join(self.tgt_dir, 'corpus.xml.gz')
+		writer = TeiCorpusWriter(out_path, None, compression='gzip', ordered=True)
+		self.fill(writer, done_order)
+		writer.close(order=self.ids, header=HEADER)
+		out_file = gzip.open(out_path, 'rt')
+		self.assertEqual(out_file.read(), self.expected(self.ids))
+		out_file.close()
+		self.assertEqual(sorted(f for f in listdir(self.tgt_dir) if 'corpus' in f), ['corpus.xml.gz'])
+
+	def test_4_unknown_compression(self):
+		"Checks an unknown compression is refused"
+		with self.assertRaises(ValueError):
+			TeiCorpusWriter(path.join(self.tgt_dir, 'corpus.xml'), HEADER, compression='rar')
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
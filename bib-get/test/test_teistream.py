@@ -0,0 +1,108 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from io               import BytesIO
+from os               import path, listdir
+from random           import Random
+from tempfile         import mkdtemp
+
+# the tested module
+from libbibget.teistream import TeiRewriter, TeiFileSink, GROBID_ROOT, OUT_BUFFER
+# (implémentation de référence)
+from libbibget.extract   import postprocess_tei
+
+ISTEX_ID = "21B88F4EFBA46DC85E863709CA9824DEED7B7BFC"
+
+
+def fake_tei(n_bibs, rand, root=GROBID_ROOT.decode('UTF-8'), pad=0):
+	"A grobid-like TEI answer with n_bibs biblStruct (tabs, accents)"
+	bibs = "".join(
+		'\n\t\t\t<biblStruct xml:id="b%i">\n\t\t\t\t<analytic><title level="a">Étude n°%i %s</title></analytic>\n\t\t\t</biblStruct>'
+		% (i, i, "é" * rand.randint(0, 40)) for i in range(n_bibs))
+	if not n_bibs:
+		bibs = "\n\t\t\t" + " " * pad
+	return ('<?xml version="1.0" encoding="UTF-8"?>\n%s\n\t<teiHeader/>\n\t<text>\n\t\t<back>\n\t\t<listBibl>%s\n\t\t</listBibl>\n\t\t</back>\n\t</text>\n</TEI>\n'
+	        % (root, bibs))
+
+
+def random_chunks(data, rand, max_size):
+	"data cut at random places (chunks of 1 to max_size bytes)"
+	chunks = []
+	i = 0
+	while i < len(data):
+		size = rand.randint(1, max_size)
+		chunks.append(data[i:i+size])
+		i += size
+	return chunks
+
+
+def rewrite(chunks, istex_id=ISTEX_ID):
+	out = BytesIO()
+	rewriter = TeiRewriter(istex_id, out)
+	for chunk in chunks:
+		rewriter.feed(chunk)
+	rewriter.close()
+	return (out.getvalue(), rewriter)
+
+
+class TestTeiStream(unittest.TestCase):
+	def test_1_same_as_reference(self):
+		"Checks TeiRewriter == postprocess_tei whatever the chunking"
+		rand = Random(18)
+		for k in range(300):
+			n_bibs = rand.choice([0, 0, 1, 3, 30])
+			root = rand.choice([GROBID_ROOT.decode('UTF-8'), '<TEI xmlns="http://www.tei-c.org/ns/1.0">'])
+			tei = fake_tei(n_bibs, rand, root)
+			expected = postprocess_tei(tei, ISTEX_ID).encode('UTF-8')
+			data = tei.encode('UTF-8')
+			(result, rewriter) = rewrite(random_chunks(data, rand, rand.choice([1, 7, 64, 5000])))
+			self.assertEqual(result, expected)
+			self.assertEqual(rewriter.n_biblstruct, n_bibs)
+			self.assertEqual(rewriter.n_out, len(expected))
+			self.assertEqual(rewriter.n_in, len(data))
+
+	def test_2_empty_answers(self):
+		"Checks TEI without refbibs (even bigger than OUT_BUFFER) and empty answers"
+		empty_tei = ('<TEI xml:id="istex-%s"/>' % ISTEX_ID).encode('UTF-8')
+		rand = Random(3)
+		big = fake_tei(0, rand, pad=2 * OUT_BUFFER).encode('UTF-8')
+		(result, rewriter) = rewrite(random_chunks(big, rand, 1000))
+		self.assertEqual(result, empty_tei)
+		self.assertTrue(rewriter.void)
+		self.assertEqual(rewrite([])[0], empty_tei)
+		self.assertEqual(postprocess_tei("", ISTEX_ID).encode('UTF-8'), empty_tei)
+
+	def test_3_file_sink(self):
+		"Checks TeiFileSink: file only on commit, retries start over, abort cleans up"
+		tgt_dir = mkdtemp()
+		out_path = path.join(tgt_dir, 'AB', ISTEX_ID + '.refbibs.tei.xml')
+		tei = fake_tei(3, Random(5)).encode('UTF-8')
+		sink = TeiFileSink(out_path, ISTEX_ID)
+		sink.begin()
+		sink.feed(tei[:100])
+		self.assertFalse(path.exists(out_path))
+		# nouvelle tentative: on repart de zéro
+		sink.begin()
+		for chunk in random_chunks(tei, Random(6), 50):
+			sink.feed(chunk)
+		stats = {}
+		sink.commit(stats)
+		out_file = open(out_path, 'rb')
+		self.assertEqual(out_file.read(), postprocess_tei(tei.decode('UTF-8'), ISTEX_ID).encode('UTF-8'))
+		out_file.close()
+		self.assertEqual(stats['n_biblstruct'], 3)
+		self.assertEqual(listdir(path.dirname(out_path)), [ISTEX_ID + '.refbibs.tei.xml'])
+
+		other_path = path.join(tgt_dir, 'other.xml')
+		sink = TeiFileSink(other_path, ISTEX_ID)
+		sink.begin()
+		sink.feed(tei[:100])
+		sink.abort()
+		self.assertFalse(path.exists(other_path))
+		self.assertFalse(path.exists(other_path + '.part'))
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
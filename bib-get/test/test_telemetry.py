@@ -0,0 +1,100 @@
+#! /usr/bin/python3
+
+import unittest
+
+# tools
+from os               import path, listdir
+from tempfile         import mkdtemp
+from re               import match
+
+# the tested module
+from libbibget.telemetry import Telemetry, percentile, hms
+
+
+def read_prom(prom_path):
+	"Prometheus textfile => (lines, {metric line without value: value})"
+	prom_file = open(prom_path, 'r')
+	lines = prom_file.read().split("\n")
+	prom_file.close()
+	values = {}
+	for line in lines:
+		if line and not line.startswith('#'):
+			(key, value) = line.rsplit(' ', 1)
+			values[key] = float(value)
+	return (lines, values)
+
+
+class TestTelemetry(unittest.TestCase):
+	def setUp(self):
+		self.telemetry = Telemetry(n_total=10)
+		for i in range(1, 5):
+			self.telemetry.record(None, {'latency': i * 0.5, 'bytes_in': 1000, 'bytes_out': 10})
+		self.telemetry.record(None, {'cached': True})
+		self.telemetry.record('overload', {'latency': 60.0})
+		self.telemetry.record('server')
+		self.out_dir = mkdtemp()
+
+	def test_1_snapshot(self):
+		"Checks counters, error rate and latency percentiles"
+		snap = self.telemetry.snapshot()
+		self.assertEqual(snap['docs_done'], 7)
+		self.assertEqual(snap['docs_ok'], 5)
+		self.assertEqual(snap['docs_cached'], 1)
+		self.assertEqual(snap['errors'], {'overload': 1, 'server': 1})
+		self.assertAlmostEqual(snap['error_rate'], 2 / 7)
+		self.assertEqual(snap['latency_p50'], 1.5)
+		self.assertEqual(snap['latency_p99'], 60.0)
+		self.assertEqual((snap['bytes_in'], snap['bytes_out']), (4000, 40))
+		self.assertIsNotNone(snap['eta_seconds'])
+		self.assertIsNone(percentile([], 50))
+		self.assertEqual(hms(4000), '1h06m40s')
+		self.assertEqual(hms(65), '1m05s')
+
+	def test_2_prometheus_format(self):
+		"Checks the Prometheus textfile: HELP/TYPE before each metric, labels, values"
+		prom_path = path.join(self.out_dir, 'bibget.prom')
+		self.telemetry.write_prometheus(prom_path, self.telemetry.snapshot(), {'run': 'nightly'})
+		(lines, values) = read_prom(prom_path)
+		self.assertEqual(lines[-1], "")
+		declared = {}
+		for line in lines[:-1]:
+			if line.startswith('# HELP '):
+				declared[line.split()[2]] = None
+			elif line.startswith('# TYPE '):
+				(name, kind) = line.split()[2:4]
+				self.assertIn(name, declared)
+				self.assertIn(kind, ('counter', 'gauge', 'summary'))
+				declared[name] = kind
+			else:
+				sample = match(r'^([a-z_]+)\{([a-z]+="[^"]*"(?:,[a-z]+="[^"]*")*)\} \S+$', line)
+				self.assertIsNotNone(sample, line)
+				self.assertIsNotNone(declared.get(sample.group(1)), line)
+				# labels triés
+				label_names = [l.split('=')[0] for l in sample.group(2).split(',')]
+				self.assertEqual(label_names, sorted(label_names))
+		self.assertEqual(values['bibget_docs_done_total{result="ok",run="nightly"}'], 5)
+		self.assertEqual(values['bibget_docs_done_total{result="failed",run="nightly"}'], 2)
+		self.assertEqual(values['bibget_errors_total{class="overload",run="nightly"}'], 1)
+		self.assertEqual(values['bibget_grobid_latency_seconds{quantile="0.5",run="nightly"}'], 1.5)
+		self.assertEqual(values['bibget_bytes_total{direction="in",run="nightly"}'], 4000)
+		self.assertEqual(values['bibget_docs_total{run="nightly"}'], 10)
+		self.assertEqual(declared['bibget_grobid_latency_seconds'], 'summary')
+		# écriture atomique: pas de .tmp restant
+		self.assertEqual(listdir(self.out_dir), ['bibget.prom'])
+
+	def test_3_prometheus_without_labels(self):
+		"Checks metrics without labels nor latencies nor expected total"
+		telemetry = Telemetry()
+		telemetry.record('server')
+		prom_path = path.join(self.out_dir, 'bibget.prom')
+		telemetry.write_prometheus(prom_path, telemetry.snapshot())
+		(lines, values) = read_prom(prom_path)
+		self.assertEqual(values['bibget_docs_cached_total'], 0)
+		self.assertEqual(values['bibget_errors_total{class="server"}'], 1)
+		self.assertFalse([k for k in values if k.startswith('bibget_grobid_latency_seconds')])
+		self.assertNotIn('bibget_docs_total', values)
+		self.assertNotIn('bibget_eta_seconds', values)
+
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)